@@ -5,6 +5,27 @@ import { ThemedText } from '@/components/ThemedText';
 import { ThemedView } from '@/components/ThemedView';
 import * as FileSystem from 'expo-file-system';
 import * as Sharing from 'expo-sharing';
+import Constants from 'expo-constants';
+
+// Address of the Flask backend, from EXPO_PUBLIC_API_URL or app.json's extra.apiUrl (localhost only works
+// on the machine running the backend); explanation images are served from its /explanations endpoint
+const API_URL: string =
+  process.env.EXPO_PUBLIC_API_URL ?? Constants.expoConfig?.extra?.apiUrl ?? 'http://localhost:5000';
+
+// Fetch an image and return it as a data URI, so a saved report does not depend on the backend
+const fetchDataUri = async (url: string): Promise<string> => {
+  const response = await fetch(url);
+  if (!response.ok) {
+    throw new Error(`Could not fetch ${url}: ${response.status}`);
+  }
+  const blob = await response.blob();
+  return new Promise((resolve, reject) => {
+    const reader = new FileReader();
+    reader.onloadend = () => resolve(reader.result as string);
+    reader.onerror = () => reject(reader.error);
+    reader.readAsDataURL(blob);
+  });
+};
 
 export default function DiagnosisScreen() {
   // State to hold user input for the form fields
@@ -67,11 +88,13 @@ export default function DiagnosisScreen() {
       DiabetesPedigreeFunction: parseFloat(formData.DiabetesPedigreeFunction),
       Age: parseFloat(formData.Age),
       models: selectedModels.length > 0 ? selectedModels : models, // Use selected models or default to all
+      chart_format: 'png', // Ask for a rendered PNG of each explanation graph (the backend defaults to a JSON chart spec)
+      // The PNG is returned as the URL of a cacheable image (lime_explanation_image_url) rather than inline base64
     };
 
     try {
       // Send a POST request to the backend with the form data
-      const response = await fetch('http://localhost:5000/predict', {
+      const response = await fetch(`${API_URL}/predict`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json'
@@ -96,6 +119,13 @@ export default function DiagnosisScreen() {
         return;
       }
 
+      // Embed each explanation chart in the file, as the server may evict it and the report may be opened elsewhere
+      const images: { [model: string]: string | null } = {};
+      await Promise.all(Object.keys(results).map(async (model) => {
+        const imageUrl = results[model].lime_explanation_image_url;
+        images[model] = imageUrl ? await fetchDataUri(`${API_URL}${imageUrl}`).catch(() => null) : null;
+      }));
+
       // Generate an HTML file with the results
       const htmlContent = `
         <!DOCTYPE html>
@@ -129,7 +159,9 @@ export default function DiagnosisScreen() {
             <p><strong>Prediction:</strong> ${results[model].prediction}</p>
             <p><strong>Confidence:</strong> ${(results[model].confidence * 100).toFixed(2)}%</p>
             <div class="image-container">
-              <img src="data:image/png;base64,${results[model].lime_explanation_image}" alt="LIME Explanation for ${model}" />
+              ${images[model]
+                ? `<img src="${images[model]}" alt="LIME Explanation for ${model}" />`
+                : '<p>Explanation chart unavailable</p>'}
             </div>
             <p><strong>Explanation:</strong> ${results[model].text_explanation}</p>
           `).join('')}
@@ -271,7 +303,7 @@ export default function DiagnosisScreen() {
                   <Text style={styles.resultLabel}>Confidence:</Text> {(results[model].confidence * 100).toFixed(2)}%
                 </ThemedText>
                 <Image
-                  source={{ uri: `data:image/png;base64,${results[model].lime_explanation_image}` }}
+                  source={{ uri: `${API_URL}${results[model].lime_explanation_image_url}` }}
                   style={styles.explanationImage}
                 />
                 <ThemedText style={styles.textExplanation}>
@@ -0,0 +1,341 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from schema import FEATURES, TARGET
+
+# Reproducible benchmarks of the serving and training hot paths.
+# "run" measures /predict latency percentiles and throughput through the Flask test client (in-process,
+# so no network noise) under several option sets, and times the training grid search, the evaluation
+# metrics and the preprocessing pipeline on synthetic data scaled up from pima.csv. Results are written
+# as JSON with the library versions and commit they were measured on.
+# "compare" checks a results file against a stored baseline and exits with status 1 on regressions.
+#
+#   python benchmark.py run --output ../benchmarks/baseline.json
+#   python benchmark.py run --baseline ../benchmarks/baseline.json
+#   python benchmark.py compare ../benchmarks/baseline.json ../benchmarks/latest.json
+
+base_path = os.path.dirname(os.path.abspath(__file__))  # Get the directory of the current script
+RAW_DATA = os.path.join(base_path, "../data/pima.csv")
+BENCHMARK_FOLDER = os.path.join(base_path, "../benchmarks")
+
+SUITES = ["serving", "training", "evaluation", "preprocessing"]
+
+# Synthetic dataset sizes, as multiples of the 768 rows of pima.csv
+DEFAULT_SCALES = [10, 100, 1000]
+
+# Relative change of a metric, in the wrong direction, reported as a regression
+DEFAULT_THRESHOLD = 0.10
+
+# /predict request options measured by the serving suite
+PREDICT_OPTION_SETS = {
+    "all_models": {},
+    "single_model": {"models": ["logistic_regression"]},
+    "no_explanations": {"explain": False},
+    "lime": {"explainer": "lime"},
+    "lime_fixed": {"explainer": "lime", "lime_mode": "fixed"},
+    "svg_images": {"chart_format": "svg"},
+    "png_images": {"chart_format": "png"},
+    "cascade": {"mode": "cascade"},
+}
+
+# Metrics compared against the baseline, and whether a lower or a higher value is better
+METRIC_DIRECTIONS = {
+    "p50_ms": "lower",
+    "p95_ms": "lower",
+    "p99_ms": "lower",
+    "throughput_rps": "higher",
+    "median_seconds": "lower",
+}
+
+
+def synthetic_pima(scale, seed=42):
+    """
+    Return scale times the rows of pima.csv, resampled with replacement.
+    Non-zero measurements are jittered by 5% of the column's standard deviation, so repeated rows differ
+    (and miss the prediction cache); zeros, which the preprocessing treats as missing, are kept.
+    """
+    data = pd.read_csv(RAW_DATA)
+    random_state = np.random.RandomState(seed)
+    rows = data.sample(n=len(data) * scale, replace=True, random_state=random_state).reset_index(drop=True)
+    for column in FEATURES:
+        values = rows[column].to_numpy(dtype=float)
+        jittered = np.maximum(values + random_state.normal(scale=0.05 * data[column].std(), size=len(values)), 0)
+        if pd.api.types.is_integer_dtype(data[column]):
+            jittered = np.round(jittered)
+        rows[column] = np.where(values > 0, jittered, 0)
+    return rows
+
+
+def timed(fn, repeat):
+    """Call fn repeat times and return the median, minimum and individual durations in seconds."""
+    runs = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - began)
+    return {"median_seconds": float(np.median(runs)), "min_seconds": min(runs), "runs": runs}
+
+
+def latency_stats(latencies, elapsed):
+    """Return the latency percentiles in milliseconds and the throughput of a series of requests."""
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_ms": float(latencies_ms.mean()),
+        "throughput_rps": len(latencies) / elapsed,
+    }
+
+
+def load_app():
+    """
+    Import model-app.py as a module, with the artifact watcher disabled and the explainers built at
+    startup, so the measured requests do not pay for lazy initialisation. The charts are stored in a fresh
+    temporary folder, so charts rendered by an earlier run or by a running server are never served.
+    """
+    os.environ.setdefault('MODEL_WATCH_INTERVAL', '0')
+    os.environ.setdefault('STARTUP_MODE', 'eager')
+    os.environ['CHART_STORE_DIR'] = tempfile.mkdtemp(prefix='diabetes-sense-bench-charts-')
+    spec = importlib.util.spec_from_file_location("model_app", os.path.join(base_path, "model-app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_serving(requests, warmup, seed):
+    """Measure /predict under every option set, each request with a different patient."""
+    app_module = load_app()
+    client = app_module.app.test_client()
+    scale = -(-(warmup + requests) // 768)  # Enough synthetic rows for every request of one option set
+    records = synthetic_pima(scale, seed)[FEATURES].to_dict(orient="records")
+
+    results = {}
+    for name, options in PREDICT_OPTION_SETS.items():
+        # The same patients are used for every option set, so each starts from empty caches: only its own
+        # warmup requests populate the result cache and the chart store
+        app_module.prediction_cache.clear()
+        app_module.chart_store.clear()
+        for record in records[:warmup]:
+            client.post('/predict', json={**record, **options})
+
+        latencies = []
+        began = time.perf_counter()
+        for record in records[warmup:warmup + requests]:
+            request_began = time.perf_counter()
+            response = client.post('/predict', json={**record, **options})
+            latencies.append(time.perf_counter() - request_began)
+            if response.status_code != 200:
+                raise RuntimeError(f"/predict with {name} options failed: {response.get_json()}")
+        results[f"serving/predict/{name}"] = latency_stats(latencies, time.perf_counter() - began)
+        print(f"serving/predict/{name}: p50 {results[f'serving/predict/{name}']['p50_ms']:.2f} ms")
+    shutil.rmtree(app_module.chart_store.folder, ignore_errors=True)
+    return results
+
+
+def bench_training(scales, repeat, seed, mode):
+    """Time a fixed, small grid search over the three model families at each scale."""
+    from sklearn.base import clone
+    from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.preprocessing import StandardScaler
+    from search import SearchData, SuccessiveHalvingSearch
+
+    # Two candidates per family, so the large scales stay tractable; the grids of ml_model.py are much larger
+    grids = {
+        "logistic_regression": (LogisticRegression(max_iter=1000), {"C": [0.1, 1], "solver": ["liblinear"]}),
+        "random_forest": (RandomForestClassifier(random_state=42), {"n_estimators": [50], "max_depth": [4, 8]}),
+        "gradient_boosting": (GradientBoostingClassifier(random_state=42), {"n_estimators": [50], "max_depth": [2, 3]}),
+    }
+
+    results = {}
+    for scale in scales:
+        data = synthetic_pima(scale, seed)
+        X = StandardScaler().fit_transform(data[FEATURES])
+        search_data = SearchData(X, data[TARGET].to_numpy(), n_splits=3, shuffle=True, random_state=42)
+
+        def run():
+            for name, (estimator, grid) in grids.items():
+                SuccessiveHalvingSearch(name, clone(estimator), grid, mode=mode).run(search_data)
+
+        key = f"training/{mode}_search/{scale}x"
+        results[key] = {"rows": len(data), **timed(run, repeat)}
+        print(f"{key}: {results[key]['median_seconds']:.2f} s")
+    return results
+
+
+def bench_evaluation(scales, repeat, seed, model_folder):
+    """Time the metrics evaluation.py computes for every model of the bundle at each scale (without bootstrap)."""
+    from evaluation_engine import evaluate_dataset
+    from model_bundle import load_bundle
+
+    bundle = load_bundle(model_folder, mmap_mode=None)
+    results = {}
+    for scale in scales:
+        data = synthetic_pima(scale, seed)
+        X, y = data[FEATURES].to_numpy(dtype=float), data[TARGET].to_numpy()
+
+        def run():
+            evaluate_dataset(bundle, X, y, resamples=0)
+
+        key = f"evaluation/metrics/{scale}x"
+        results[key] = {"rows": len(data), **timed(run, repeat)}
+        print(f"{key}: {results[key]['median_seconds']:.2f} s")
+    return results
+
+
+def bench_preprocessing(scales, repeat, seed, chunksize):
+    """Time the chunked preprocessing pipeline (fit, transform, undersample) on a CSV at each scale."""
+    from preprocessing_pipeline import PreprocessingPipeline, undersample
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for scale in scales:
+            csv_path = os.path.join(folder, f"pima_{scale}x.csv")
+            data = synthetic_pima(scale, seed)
+            data.to_csv(csv_path, index=False)
+
+            def run():
+                pipeline = PreprocessingPipeline(csv_path, chunksize=chunksize).fit()
+                pipeline.transform(os.path.join(folder, "preprocessed.npy"))
+                undersample(os.path.join(folder, "preprocessed.npy"), os.path.join(folder, "balanced.npy"),
+                            random_state=42, chunksize=chunksize)
+
+            key = f"preprocessing/pipeline/{scale}x"
+            results[key] = {"rows": len(data), **timed(run, repeat)}
+            print(f"{key}: {results[key]['median_seconds']:.2f} s")
+    return results
+
+
+def environment():
+    """Return the versions and machine details a benchmark run was measured on."""
+    import sklearn
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=base_path,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare the metrics of two benchmark results and print one line per metric.
+    Returns the list of regressions, as (benchmark, metric, baseline value, current value, relative change).
+    """
+    # Timings from different library versions or machines are not directly comparable
+    for name, value in current["environment"].items():
+        if name != "commit" and baseline["environment"].get(name) != value:
+            print(f"Note: baseline {name} is {baseline['environment'].get(name)}, current {name} is {value}")
+
+    regressions = []
+    for key, metrics in current["results"].items():
+        if key not in baseline["results"]:
+            print(f"{key}: not in the baseline")
+            continue
+        for metric, direction in METRIC_DIRECTIONS.items():
+            if metric not in metrics or metric not in baseline["results"][key]:
+                continue
+            before, after = baseline["results"][key][metric], metrics[metric]
+            change = (after - before) / before if before else 0.0
+            worse = change > threshold if direction == "lower" else change < -threshold
+            print(f"{key} {metric}: {before:.4g} -> {after:.4g} ({change:+.1%}){'  REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append((key, metric, before, after, change))
+    return regressions
+
+
+def read_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_results(results, path):
+    """Write the results as JSON, replacing the previous file atomically."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def report_regressions(regressions, threshold):
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {threshold:.0%}")
+        return 1
+    print(f"No regressions beyond {threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    ### COMMAND LINE OPTIONS
+    parser = argparse.ArgumentParser(description="Benchmark the serving and training hot paths.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and write the results as JSON")
+    run_parser.add_argument('--suites', nargs='+', choices=SUITES, default=SUITES, help="Benchmark suites to run")
+    run_parser.add_argument('--scales', nargs='+', type=int, default=DEFAULT_SCALES,
+                            help="Synthetic dataset sizes, as multiples of pima.csv")
+    run_parser.add_argument('--requests', type=int, default=200, help="Measured /predict requests per option set")
+    run_parser.add_argument('--warmup', type=int, default=20, help="Unmeasured /predict requests per option set")
+    run_parser.add_argument('--repeat', type=int, default=3, help="Runs of each training, evaluation and preprocessing benchmark")
+    run_parser.add_argument('--seed', type=int, default=42, help="Seed of the synthetic data")
+    run_parser.add_argument('--search', choices=["grid", "halving"], default="grid", help="Search mode of the training benchmark")
+    run_parser.add_argument('--chunksize', type=int, default=100_000, help="Rows per chunk of the preprocessing benchmark")
+    run_parser.add_argument('--model-folder', default=os.getenv('MODEL_FOLDER', os.path.join(base_path, '..', 'models')),
+                            help="Model bundle used by the serving and evaluation benchmarks")
+    run_parser.add_argument('--output', default=os.path.join(BENCHMARK_FOLDER, "latest.json"), help="Results file")
+    run_parser.add_argument('--baseline', default=None, help="Results file to compare the new results with")
+    run_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="Relative change reported as a regression")
+
+    compare_parser = commands.add_parser("compare", help="Compare a results file with a baseline")
+    compare_parser.add_argument('baseline', help="Baseline results file")
+    compare_parser.add_argument('current', help="Results file to check")
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="Relative change reported as a regression")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        sys.exit(report_regressions(compare(read_results(args.baseline), read_results(args.current), args.threshold), args.threshold))
+
+    os.environ['MODEL_FOLDER'] = args.model_folder
+    results = {}
+    if "serving" in args.suites:
+        results.update(bench_serving(args.requests, args.warmup, args.seed))
+    if "training" in args.suites:
+        results.update(bench_training(args.scales, args.repeat, args.seed, args.search))
+    if "evaluation" in args.suites:
+        results.update(bench_evaluation(args.scales, args.repeat, args.seed, args.model_folder))
+    if "preprocessing" in args.suites:
+        results.update(bench_preprocessing(args.scales, args.repeat, args.seed, args.chunksize))
+
+    output = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "options": {key: value for key, value in vars(args).items() if key not in ("command", "output", "baseline")},
+        "results": results,
+    }
+    write_results(output, args.output)
+    print(f"Benchmark results saved at {args.output}")
+
+    if args.baseline:
+        sys.exit(report_regressions(compare(read_results(args.baseline), output, args.threshold), args.threshold))
@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+
+# Confidence-gated cascade serving for /predict ("mode": "cascade").
+# Instead of running every model, the cascade scores a patient with its stages in order, cheapest first,
+# and stops at the first stage that is confident enough: a stage decides when the probability of its
+# predicted class is at least 0.5 + its margin. Only uncertain cases go on to the next, more expensive stage,
+# and the last stage (the voting ensemble when the bundle has one) always decides.
+# The stages and their margins are read from cascade.json in the model folder, written by
+# cascade_thresholds.py from the test data; without it DEFAULT_STAGES are used.
+
+CASCADE_FILE = "cascade.json"
+
+# Serving modes a /predict request can select with "mode": every selected model, or the cascade
+SERVING_MODES = ["all", "cascade"]
+
+# Stages used when the model folder has no cascade.json
+DEFAULT_STAGES = [
+    {"model": "logistic_regression", "margin": 0.4},
+    {"model": "random_forest", "margin": 0.3},
+    {"model": "gradient_boosting", "margin": 0.2},
+    {"model": "voting_classifier", "margin": 0.0},
+]
+
+
+def cascade_path(model_folder):
+    """Return the path of the cascade configuration in a model folder."""
+    return os.path.join(model_folder, CASCADE_FILE)
+
+
+def validate_stages(stages):
+    """Check a list of stages read from a configuration. Raises ValueError when one is invalid."""
+    if not isinstance(stages, list) or not stages:
+        raise ValueError("The cascade needs a non-empty list of stages")
+    for stage in stages:
+        if not isinstance(stage, dict) or not isinstance(stage.get("model"), str):
+            raise ValueError(f"Invalid cascade stage {stage!r}, expected a model name and a margin")
+        margin = stage.get("margin")
+        if isinstance(margin, bool) or not isinstance(margin, (int, float)) or not 0 <= margin <= 0.5:
+            raise ValueError(f"The margin of cascade stage '{stage['model']}' must be a number between 0 and 0.5")
+
+
+def load_cascade(model_folder):
+    """
+    Return the stages of the cascade configuration in a model folder, or DEFAULT_STAGES when it has none.
+    Raises ValueError when the configuration is invalid.
+    """
+    path = cascade_path(model_folder)
+    if not os.path.exists(path):
+        return [dict(stage) for stage in DEFAULT_STAGES]
+    with open(path) as f:
+        stages = json.load(f).get("stages")
+    validate_stages(stages)
+    return [{"model": stage["model"], "margin": float(stage["margin"])} for stage in stages]
+
+
+def save_cascade(model_folder, config):
+    """Write a cascade configuration (the stages plus how they were chosen), replacing the previous one atomically."""
+    validate_stages(config.get("stages"))
+    path = cascade_path(model_folder)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(config, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def resolve_stages(stages, model_names):
+    """
+    Return the stages whose model is among model_names, in order. The last one always decides, so its margin is 0.
+    """
+    available = [dict(stage) for stage in stages if stage["model"] in model_names]
+    if not available:
+        raise ValueError(f"None of the cascade's models {[stage['model'] for stage in stages]} is loaded")
+    available[-1]["margin"] = 0.0
+    return available
+
+
+def run_cascade(stages, score_fn):
+    """
+    Run the cascade on one input row. score_fn(model_name) scores the row with one model and returns its
+    scores (predictions and confidences, as score_models returns them).
+    Returns the deciding model's name, its scores and a report of the stages that ran.
+    """
+    report = []
+    for index, stage in enumerate(stages):
+        scores = score_fn(stage["model"])
+        confidence = float(scores["confidences"][0])
+        decided = index == len(stages) - 1 or confidence >= 0.5 + stage["margin"]
+        report.append({"model": stage["model"], "confidence": confidence, "margin": stage["margin"], "decided": decided})
+        if decided:
+            return stage["model"], scores, {"decided_by": stage["model"], "stage": index, "stages": report}
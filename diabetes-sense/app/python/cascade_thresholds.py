@@ -0,0 +1,157 @@
+import argparse
+import itertools
+import os
+import time
+
+import numpy as np
+
+from cascade import cascade_path, save_cascade
+from compiled_trees import compile_model
+from dataset_store import dataset_hash, load_dataset
+from model_bundle import ENSEMBLE_NAME, load_bundle
+
+# Pick the margins of the cascade serving mode (see cascade.py) from the test data.
+# Every model of the bundle scores data/test_data.csv once, and the time of a single-row prediction is
+# measured for each the way the server predicts (compiled tree ensembles, one row per call). Every
+# combination of margins for the stages before the last is then replayed offline: the share of cases each
+# stage decides, the expected model latency per request and the agreement of the cascade's predictions with
+# the full ensemble's. The cheapest combination that agrees with the ensemble on at least --min-agreement
+# of the cases is written to models/cascade.json, which the server reloads like the model artifacts.
+#
+#   python cascade_thresholds.py --min-agreement 0.98
+#   python cascade_thresholds.py --dry-run  # Print the latency / agreement frontier without writing
+
+base_path = os.path.dirname(os.path.abspath(__file__))  # Get the directory of the current script
+
+# Margins tried for each stage before the last; a stage can also be skipped altogether
+DEFAULT_MARGINS = [0.0, 0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 0.5]
+
+
+def single_row_latency(predictor, row, repeat):
+    """Return the median seconds of one predict_proba call on a single row."""
+    predictor.predict_proba(row)  # The first call pays for lazy initialization
+    durations = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        predictor.predict_proba(row)
+        durations.append(time.perf_counter() - began)
+    return float(np.median(durations))
+
+
+def score_test_data(bundle, X, repeat):
+    """
+    Score the test rows with every model of the bundle and time a single-row prediction of each.
+    Returns {model name: (probabilities of the positive class, seconds per single-row prediction)}.
+    """
+    scores = {}
+    for model_name, model in bundle.models.items():
+        predictor = compile_model(model) or model
+        model_rows = bundle.model_input(model_name, X)
+        probabilities = predictor.predict_proba(model_rows)[:, 1]
+        scores[model_name] = (probabilities, single_row_latency(predictor, model_rows[:1], repeat))
+    return scores
+
+
+def replay(stages, scores, reference, y):
+    """
+    Replay a cascade of (model name, margin) stages on the scored test rows; a margin of None skips the stage
+    and the last stage always decides. Returns the summary of the cascade's predictions.
+    """
+    undecided = np.ones(len(y), dtype=bool)
+    predictions = np.zeros(len(y), dtype=int)
+    latency = 0.0
+    decided_share = {}
+    run = [(model_name, margin) for model_name, margin in stages if margin is not None]
+    for index, (model_name, margin) in enumerate(run):
+        probabilities, seconds = scores[model_name]
+        latency += seconds * undecided.mean()  # Only the cases still undecided run this stage
+        confidence = np.maximum(probabilities, 1 - probabilities)
+        decides = undecided if index == len(run) - 1 else undecided & (confidence >= 0.5 + margin)
+        predictions[decides] = probabilities[decides] >= 0.5
+        decided_share[model_name] = float(decides.mean())
+        undecided &= ~decides
+    return {
+        "stages": [{"model": model_name, "margin": margin} for model_name, margin in run[:-1]]
+                  + [{"model": run[-1][0], "margin": 0.0}],
+        "agreement": float((predictions == reference).mean()),
+        "accuracy": float((predictions == y).mean()),
+        "mean_latency_ms": latency * 1000,
+        "decided_share": decided_share,
+    }
+
+
+def frontier(candidates):
+    """Return the candidates no other candidate beats on both latency and agreement, fastest first."""
+    best = []
+    for candidate in sorted(candidates, key=lambda c: (c["mean_latency_ms"], -c["agreement"])):
+        if not best or candidate["agreement"] > best[-1]["agreement"]:
+            best.append(candidate)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick the cascade's margins from the test data.")
+    parser.add_argument('--min-agreement', type=float, default=0.98,
+                        help="Share of test cases on which the cascade must agree with the full ensemble")
+    parser.add_argument('--margins', nargs='+', type=float, default=DEFAULT_MARGINS,
+                        help="Margins tried for each stage before the last")
+    parser.add_argument('--repeat', type=int, default=200, help="Timed single-row predictions per model")
+    parser.add_argument('--model-folder', default=os.getenv('MODEL_FOLDER', os.path.join(base_path, '..', 'models')),
+                        help="Model folder to read the bundle from and write cascade.json to")
+    parser.add_argument('--dry-run', action='store_true', help="Print the frontier without writing cascade.json")
+    args = parser.parse_args()
+
+    bundle = load_bundle(args.model_folder, mmap_mode=None)
+    X, y = load_dataset("test")
+    X, y = np.asarray(X, dtype=float), np.asarray(y, dtype=int)
+    scores = score_test_data(bundle, X, args.repeat)
+    for model_name, (_, seconds) in scores.items():
+        print(f"{model_name}: {seconds * 1000:.3f} ms per single-row prediction")
+
+    # The full ensemble is the voting classifier, or without one the soft vote of the models
+    if ENSEMBLE_NAME in scores:
+        reference_name = ENSEMBLE_NAME
+        reference = (scores[ENSEMBLE_NAME][0] >= 0.5).astype(int)
+        final = ENSEMBLE_NAME
+    else:
+        reference_name = "soft_vote"
+        reference = (np.mean([probabilities for probabilities, _ in scores.values()], axis=0) >= 0.5).astype(int)
+        # The model agreeing most with the soft vote decides the cases no earlier stage is sure of
+        final = max(scores, key=lambda model_name: ((scores[model_name][0] >= 0.5) == reference).mean())
+
+    # The stages before the last run cheapest first
+    earlier = sorted((model_name for model_name in scores if model_name != final), key=lambda name: scores[name][1])
+    candidates = [
+        replay(list(zip(earlier, margins)) + [(final, 0.0)], scores, reference, y)
+        for margins in itertools.product([None] + sorted(set(args.margins)), repeat=len(earlier))
+    ]
+
+    print(f"\nLatency / agreement frontier against {reference_name} ({len(y)} test cases):")
+    print(f"{'latency ms':>10} {'agreement':>9} {'accuracy':>8}  stages")
+    for candidate in frontier(candidates):
+        stages = " -> ".join(f"{stage['model']} ({stage['margin']:g})" for stage in candidate["stages"])
+        print(f"{candidate['mean_latency_ms']:>10.3f} {candidate['agreement']:>9.3f} {candidate['accuracy']:>8.3f}  {stages}")
+
+    eligible = [candidate for candidate in candidates if candidate["agreement"] >= args.min_agreement]
+    if not eligible:
+        print(f"\nNo combination agrees with {reference_name} on {args.min_agreement:.1%} of the cases")
+        return
+    chosen = min(eligible, key=lambda c: (c["mean_latency_ms"], -c["agreement"]))
+    print(f"\nChosen: {chosen['mean_latency_ms']:.3f} ms per request, {chosen['agreement']:.1%} agreement, "
+          "decided by " + ", ".join(f"{name} {share:.0%}" for name, share in chosen["decided_share"].items()))
+
+    if args.dry_run:
+        return
+    save_cascade(args.model_folder, {
+        **chosen,
+        "reference": reference_name,
+        "min_agreement": args.min_agreement,
+        "model_version": bundle.content_hash or bundle.source,
+        "test_data_sha256": dataset_hash("test"),
+        "created_at": time.time(),
+    })
+    print(f"Cascade saved at {cascade_path(args.model_folder)}")
+
+
+if __name__ == "__main__":
+    main()
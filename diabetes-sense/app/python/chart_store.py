@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# Content-addressed store of rendered explanation charts.
+# A chart is named by a hash of its JSON spec (title, features and importances) and render options plus
+# its format, e.g. "3f2a...9c.png", so identical charts are rendered once and served from the store.
+# /predict returns the chart's URL instead of inlining the image, and /explanations/<name> serves it with
+# an ETag and a long-lived Cache-Control, since the content behind a name never changes.
+# Recently used charts are kept in memory up to max_bytes; with a folder, charts are also written to disk
+# (up to max_disk_bytes, least recently used files deleted first), so every worker process of a
+# multi-process server can serve the charts rendered by the others.
+
+# Bump when the renderers change output, so previously stored charts are not served for new requests
+RENDER_VERSION = 2
+
+# Chart formats the store holds and their content types
+CONTENT_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+# A chart name: 32 hex digits and a format extension
+NAME_PATTERN = re.compile(r"^([0-9a-f]{32})\.(png|svg)$")
+
+
+def chart_name(spec, chart_format, width, height, dpi):
+    """Return the content-addressed name of a chart spec rendered in the given format and size."""
+    key = json.dumps(
+        {"spec": spec, "format": chart_format, "size": [width, height, dpi], "version": RENDER_VERSION},
+        sort_keys=True,
+    )
+    return f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}.{chart_format}"
+
+
+def parse_chart_name(name):
+    """Return the (digest, format) of a chart name, or None if it is not a valid chart name."""
+    match = NAME_PATTERN.match(name)
+    return (match.group(1), match.group(2)) if match else None
+
+
+class ChartStore:
+    """
+    Thread-safe, size-bounded LRU store of rendered charts, in memory and optionally in a folder on disk.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, folder=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.folder = folder
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()  # name -> content bytes, least recently used first
+        self.bytes = 0
+        self.disk_bytes = None  # Computed on the first write to the folder
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def get(self, name):
+        """Return the content of a stored chart, or None if it is not (or no longer) stored."""
+        with self.lock:
+            content = self.entries.get(name)
+            if content is not None:
+                self.entries.move_to_end(name)
+                self.hits += 1
+                return content
+
+        content = self.read_disk(name)
+        with self.lock:
+            if content is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.remember(name, content)
+            return content
+
+    def contains(self, name):
+        """Check whether a chart is stored, without reading it."""
+        with self.lock:
+            if name in self.entries:
+                return True
+        return bool(self.folder) and os.path.exists(self.path(name))
+
+    def put(self, name, content):
+        """Store the content of a chart under its name."""
+        with self.lock:
+            self.remember(name, content)
+        self.write_disk(name, content)
+
+    def get_or_render(self, name, render):
+        """Return the content of a stored chart, rendering and storing it with render() if it is missing."""
+        content = self.get(name)
+        if content is None:
+            content = render()
+            self.put(name, content)
+        return content
+
+    def remember(self, name, content):
+        """Keep a chart in memory, evicting the least recently used ones beyond max_bytes. Called with the lock held."""
+        if name in self.entries:
+            self.entries.move_to_end(name)
+            return
+        self.entries[name] = content
+        self.bytes += len(content)
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    def read_disk(self, name):
+        if not self.folder:
+            return None
+        try:
+            with open(self.path(name), 'rb') as f:
+                content = f.read()
+            os.utime(self.path(name))  # Mark as recently used for the disk eviction
+            return content
+        except OSError:
+            return None
+
+    def write_disk(self, name, content):
+        """Write a chart to the folder atomically, then delete the least recently used files beyond max_disk_bytes."""
+        if not self.folder or os.path.exists(self.path(name)):
+            return
+        temporary = f"{self.path(name)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(content)
+        os.replace(temporary, self.path(name))
+
+        with self.lock:
+            if self.disk_bytes is None:
+                self.disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.folder) if entry.is_file())
+            else:
+                self.disk_bytes += len(content)
+            if self.disk_bytes > self.max_disk_bytes:
+                self.disk_bytes = self.trim_disk()
+
+    def trim_disk(self):
+        """
+        Delete the least recently used chart files until the folder is below 90% of max_disk_bytes.
+        Returns the remaining size of the folder. Called with the lock held.
+        """
+        files = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.folder) if entry.is_file() and parse_chart_name(entry.name)
+        )
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= 0.9 * self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.evictions += 1
+            except OSError:
+                pass  # Already deleted by another worker
+        return total
+
+    def clear(self):
+        """Discard every chart kept in memory and, with a folder, every chart file in it."""
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            if self.folder:
+                for entry in os.scandir(self.folder):
+                    if entry.is_file() and parse_chart_name(entry.name):
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass  # Already deleted by another worker
+                self.disk_bytes = 0
+
+    def stats(self):
+        """Return the size and counters of the store."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "disk_bytes": self.disk_bytes,
+                "folder": self.folder,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
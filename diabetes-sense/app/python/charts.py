@@ -0,0 +1,167 @@
+import base64
+from functools import partial
+from xml.sax.saxutils import escape
+
+from chart_store import chart_name
+from rendering import render_bar_chart
+from telemetry import span
+
+# Explanation charts for the /predict endpoints.
+# The default output is a compact JSON chart spec that the app can draw natively. A small hand-written
+# SVG or a matplotlib PNG of configurable size (rendered by rendering.py) can be requested instead; nothing
+# is rasterized unless the client asks for an image. Images are returned as the URL of the chart store entry
+# they are kept in ("chart_delivery": "url", the default) or inlined in the response ("inline", base64 for PNG).
+
+# Output formats a request can select with "chart_format"
+CHART_FORMATS = ["json", "svg", "png"]
+
+# How a rendered image is returned, selected with "chart_delivery"
+CHART_DELIVERIES = ["url", "inline"]
+
+# URL path of the stored charts
+CHART_URL_PREFIX = "/explanations/"
+
+# Default image size in inches and resolution; SVG uses the same size converted to pixels at the given DPI
+DEFAULT_WIDTH = 8
+DEFAULT_HEIGHT = 5
+DEFAULT_DPI = 100
+
+# Upper bounds for client supplied sizes, so a request cannot ask for a huge render
+MAX_SIZE = 20
+MAX_DPI = 300
+
+POSITIVE_COLOR = 'green'
+NEGATIVE_COLOR = 'red'
+
+def parse_chart_options(data):
+    """
+    Read and validate the chart options of a request.
+    Raises ValueError with a user facing message when an option is invalid.
+    """
+    chart_format = data.get('chart_format', 'json')
+    if chart_format not in CHART_FORMATS:
+        raise ValueError(f"Unknown chart_format '{chart_format}', expected one of {CHART_FORMATS}")
+
+    chart_delivery = data.get('chart_delivery', 'url')
+    if chart_delivery not in CHART_DELIVERIES:
+        raise ValueError(f"Unknown chart_delivery '{chart_delivery}', expected one of {CHART_DELIVERIES}")
+
+    options = {"chart_format": chart_format, "chart_delivery": chart_delivery}
+    for key, default, upper in [("chart_width", DEFAULT_WIDTH, MAX_SIZE),
+                                ("chart_height", DEFAULT_HEIGHT, MAX_SIZE),
+                                ("chart_dpi", DEFAULT_DPI, MAX_DPI)]:
+        value = data.get(key, default)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value <= upper:
+            raise ValueError(f"'{key}' must be a number between 0 and {upper}")
+        options[key] = value
+    return options
+
+
+def chart_spec(feature_importances, title):
+    """
+    Build the JSON chart spec of a horizontal bar chart from a dictionary of feature -> importance.
+    """
+    return {
+        "type": "bar",
+        "orientation": "horizontal",
+        "title": title,
+        "x_label": "Feature Importance",
+        "bars": [
+            {
+                "label": feature,
+                "value": float(importance),
+                "color": POSITIVE_COLOR if importance > 0 else NEGATIVE_COLOR,
+            }
+            for feature, importance in feature_importances.items()
+        ],
+    }
+
+
+def render_svg(spec, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, dpi=DEFAULT_DPI):
+    """
+    Render the chart spec as a small standalone SVG document, without going through matplotlib.
+    """
+    width_px, height_px = int(width * dpi), int(height * dpi)
+    font_size = max(8, int(height_px / 30))
+    title_height = font_size * 2.5
+    label_width = width_px * 0.3
+    plot_left, plot_right = label_width, width_px - font_size
+    plot_top, plot_bottom = title_height, height_px - font_size * 3
+
+    bars = spec["bars"]
+    limit = max([abs(bar["value"]) for bar in bars] + [1e-12])
+    zero_x = (plot_left + plot_right) / 2
+    half_width = (plot_right - plot_left) / 2
+    row_height = (plot_bottom - plot_top) / max(len(bars), 1)
+
+    elements = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width_px}" height="{height_px}" '
+        f'viewBox="0 0 {width_px} {height_px}" font-family="sans-serif" font-size="{font_size}">',
+        f'<rect width="{width_px}" height="{height_px}" fill="white"/>',
+        f'<text x="{width_px / 2:.1f}" y="{font_size * 1.5:.1f}" text-anchor="middle" '
+        f'font-size="{font_size * 1.2:.1f}">{escape(spec["title"])}</text>',
+    ]
+    for i, bar in enumerate(bars):
+        y = plot_top + i * row_height
+        bar_width = abs(bar["value"]) / limit * half_width
+        x = zero_x if bar["value"] >= 0 else zero_x - bar_width
+        elements.append(
+            f'<rect x="{x:.1f}" y="{y + row_height * 0.1:.1f}" width="{bar_width:.1f}" '
+            f'height="{row_height * 0.8:.1f}" fill="{bar["color"]}"/>'
+        )
+        elements.append(
+            f'<text x="{plot_left - font_size / 2:.1f}" y="{y + row_height / 2 + font_size / 3:.1f}" '
+            f'text-anchor="end">{escape(bar["label"])}</text>'
+        )
+    elements.append(
+        f'<line x1="{zero_x:.1f}" y1="{plot_top:.1f}" x2="{zero_x:.1f}" y2="{plot_bottom:.1f}" stroke="black"/>'
+    )
+    elements.append(
+        f'<text x="{zero_x:.1f}" y="{height_px - font_size:.1f}" text-anchor="middle">{escape(spec["x_label"])}</text>'
+    )
+    elements.append('</svg>')
+    return ''.join(elements)
+
+
+def render_image(spec, chart_format, width, height, dpi, renderer=None):
+    """
+    Render the chart spec as SVG or PNG and return the image bytes.
+    PNGs are rendered by the given rendering.ChartRenderer, or in the calling thread without one.
+    """
+    if chart_format == "svg":
+        with span("chart_svg"):
+            return render_svg(spec, width, height, dpi).encode('utf-8')
+    with span("chart_png"):
+        if renderer is not None:
+            return renderer.render_bar_chart(spec, width, height, dpi)
+        return render_bar_chart(spec, width, height, dpi)
+
+
+def render_chart(feature_importances, title, options, store=None, renderer=None):
+    """
+    Build the chart response fields for one explanation.
+    The JSON spec is always returned; an image is only rendered when the options ask for SVG or PNG.
+    Images are looked up in (and added to) the chart store by their content-addressed name, so identical
+    charts are only rendered once, and are returned as a URL unless the options ask for them inline.
+    """
+    spec = chart_spec(feature_importances, title)
+    fields = {"lime_explanation_chart": spec}
+
+    chart_format = options["chart_format"]
+    if chart_format == "json":
+        return fields
+
+    size = (options["chart_width"], options["chart_height"], options["chart_dpi"])
+    name = chart_name(spec, chart_format, *size)
+    render = partial(render_image, spec, chart_format, *size, renderer)
+    content = store.get_or_render(name, render) if store is not None else None
+
+    fields["lime_explanation_image_format"] = chart_format
+    if options["chart_delivery"] == "url" and store is not None:
+        fields["lime_explanation_image_url"] = CHART_URL_PREFIX + name
+    elif chart_format == "svg":
+        fields["lime_explanation_image"] = (content or render()).decode('utf-8')
+    else:
+        with span("chart_base64"):
+            fields["lime_explanation_image"] = base64.b64encode(content or render()).decode('utf-8')
+    return fields
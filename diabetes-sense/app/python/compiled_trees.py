@@ -0,0 +1,186 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier, VotingClassifier
+
+# Low-latency inference for the tree ensembles.
+# For one patient, RandomForestClassifier / GradientBoostingClassifier.predict_proba spend most of their time
+# on input validation and per-tree dispatch rather than on walking the trees. compile_model flattens every
+# tree of a fitted ensemble into contiguous NumPy node arrays (feature, threshold, children, leaf values)
+# and walks all trees for all rows at once, one tree level per step. Leaves point to themselves, so rows
+# that reach a leaf early simply stay there until the deepest tree is done.
+# Large batches (such as a LIME neighbourhood) are handed back to scikit-learn, which is faster there;
+# a forest walks them with each tree's own compiled apply() instead, which skips scikit-learn's per-tree
+# dispatch and input validation, so the batches of an adaptive LIME neighbourhood stay cheap.
+# A soft voting ensemble averages the probabilities of its estimators, each predicted by its compiled version.
+
+# Batches with more rows than this are predicted by the original scikit-learn model
+MAX_COMPILED_ROWS = 64
+
+
+class CompiledTrees(ABC):
+    """
+    The trees of a fitted ensemble flattened into one set of node arrays.
+    Subclasses define the value stored at each leaf and how the leaf values are combined.
+    """
+
+    def __init__(self, model, trees, max_rows=MAX_COMPILED_ROWS):
+        self.model = model
+        self.classes_ = model.classes_
+        self.n_features_in_ = model.n_features_in_
+        self.max_rows = max_rows
+
+        features, thresholds, lefts, rights, roots = [], [], [], [], []
+        offset = 0
+        for tree in trees:
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+            roots.append(offset)
+            # Leaves test feature 0 against any threshold and point back to themselves either way
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+            offset += tree.node_count
+
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds).astype(np.float64)
+        self.left = np.concatenate(lefts).astype(np.intp)
+        self.right = np.concatenate(rights).astype(np.intp)
+        self.roots = np.array(roots, dtype=np.intp)
+        self.depth = max(tree.max_depth for tree in trees)
+        self.trees = trees
+
+    def leaves(self, X):
+        """Return the leaf node reached by each row in each tree, as a (rows, trees) matrix of node indices."""
+        # scikit-learn compares float32 inputs against float64 thresholds, so the inputs are rounded the same way
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+        for _ in range(self.depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    @abstractmethod
+    def predict_proba_compiled(self, X):
+        """Return the class probabilities of X computed from the node arrays."""
+
+    def predict_proba_large(self, X):
+        """Return the class probabilities of a batch with more than max_rows rows."""
+        return self.model.predict_proba(X)
+
+    def predict_proba(self, X):
+        """
+        Return the class probabilities of X, like the original model's predict_proba.
+        Rows with missing values are predicted by the original model.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if np.isnan(X).any():
+            return self.model.predict_proba(X)
+        if X.shape[0] > self.max_rows:
+            return self.predict_proba_large(X)
+        return self.predict_proba_compiled(X)
+
+
+class CompiledForest(CompiledTrees):
+    """A compiled RandomForestClassifier: the average of each tree's leaf class fractions."""
+
+    def __init__(self, model, max_rows=MAX_COMPILED_ROWS):
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        super().__init__(model, trees, max_rows)
+
+        # Normalize each leaf's class weights into probabilities, as DecisionTreeClassifier.predict_proba does
+        values = np.concatenate([tree.value[:, 0, :] for tree in trees])
+        normalizer = values.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        self.values = values / normalizer
+
+    def predict_proba_compiled(self, X):
+        return self.values[self.leaves(X)].sum(axis=1) / len(self.roots)
+
+    def predict_proba_large(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        total = np.zeros((X.shape[0], self.values.shape[1]))
+        for root, tree in zip(self.roots, self.trees):
+            total += self.values[tree.apply(X) + root]
+        return total / len(self.roots)
+
+
+class CompiledBoosting(CompiledTrees):
+    """A compiled binary GradientBoostingClassifier: the sigmoid of the initial score plus the scaled leaf values."""
+
+    def __init__(self, model, max_rows=MAX_COMPILED_ROWS):
+        trees = [estimator.tree_ for estimator in model.estimators_[:, 0]]
+        super().__init__(model, trees, max_rows)
+        self.values = model.learning_rate * np.concatenate([tree.value[:, 0, 0] for tree in trees])
+        # The initial estimator predicts the same raw score for every row (the class prior, or zero), so it is
+        # the decision function of any row minus the sum of that row's leaf values
+        row = np.zeros((1, model.n_features_in_))
+        self.init_score = float(np.ravel(model.decision_function(row))[0] - self.values[self.leaves(row)].sum())
+
+    def predict_proba_compiled(self, X):
+        raw = self.init_score + self.values[self.leaves(X)].sum(axis=1)
+        positive = 1.0 / (1.0 + np.exp(-raw))
+        return np.column_stack([1.0 - positive, positive])
+
+
+class CompiledVoting:
+    """A compiled soft VotingClassifier: the weighted average of its estimators' probabilities."""
+
+    def __init__(self, model, max_rows=MAX_COMPILED_ROWS):
+        self.model = model
+        self.classes_ = model.classes_
+        self.n_features_in_ = model.n_features_in_
+        self.estimators = [compile_model(estimator, max_rows) or estimator for estimator in model.estimators_]
+        if model.weights is None:
+            self.weights = None
+        else:
+            # Dropped estimators have a weight but no fitted estimator
+            self.weights = [weight for estimator, weight in zip(model.estimators, model.weights) if estimator[1] != "drop"]
+
+    def average(self, method, X):
+        probabilities = [getattr(estimator, method, estimator.predict_proba)(X) for estimator in self.estimators]
+        return np.average(probabilities, axis=0, weights=self.weights)
+
+    def predict_proba_compiled(self, X):
+        return self.average("predict_proba_compiled", X)
+
+    def predict_proba_large(self, X):
+        return self.average("predict_proba_large", X)
+
+    def predict_proba(self, X):
+        return self.average("predict_proba", X)
+
+
+def compile_model(model, max_rows=MAX_COMPILED_ROWS):
+    """
+    Return a compiled predictor for a fitted random forest, binary gradient boosting classifier or soft voting
+    ensemble of them, or None for models that cannot be compiled (other model types, hard voting,
+    multi-class boosting or a custom initial estimator whose score depends on the input).
+    """
+    if isinstance(model, VotingClassifier):
+        return CompiledVoting(model, max_rows) if model.voting == "soft" else None
+    if isinstance(model, RandomForestClassifier) and model.n_outputs_ == 1:
+        return CompiledForest(model, max_rows)
+    if isinstance(model, GradientBoostingClassifier) and len(model.classes_) == 2:
+        if model.init_ != "zero" and type(model.init_).__name__ != "DummyClassifier":
+            return None
+        return CompiledBoosting(model, max_rows)
+    return None
+
+
+def check_parity(compiled, X, tolerance=1e-9):
+    """
+    Check that the compiled predictor returns the same probabilities as its original model on the rows of X,
+    for both single rows and large batches. Raises ValueError with the largest difference otherwise.
+    """
+    expected = compiled.model.predict_proba(X)
+    for actual in (compiled.predict_proba_compiled(X), compiled.predict_proba_large(X)):
+        if actual.shape != expected.shape:
+            raise ValueError(f"Compiled {type(compiled.model).__name__} returned shape {actual.shape}, expected {expected.shape}")
+        difference = np.abs(expected - actual).max()
+        if not difference <= tolerance:
+            raise ValueError(
+                f"Compiled {type(compiled.model).__name__} differs from scikit-learn by {difference:.3g} (tolerance {tolerance})"
+            )
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from schema import FEATURES, TARGET
+from preprocessing_pipeline import ColumnarWriter, temporary_file
+
+# Binary cache of the CSV datasets shared by training, evaluation and serving.
+# Each dataset is parsed from CSV once and stored as a column-major float32 feature matrix and an int8 label
+# vector (.npy files), with a manifest recording the schema and the size, modification time and SHA-256 of
+# the CSV it was built from. load_dataset memory-maps the cached files, so loading costs no parsing and no
+# copy; the CSV is only read again when the manifest shows it changed.
+# Several processes may build the same dataset at once: every file is written under a unique temporary name
+# and moved into place complete, the .npy files are named by the build (a hash of the CSV's SHA-256 and of
+# the layout), so files of one name always hold the same arrays, and the manifest, replaced last, is what
+# switches readers to a new build. Files of replaced builds are deleted once their manifest is replaced.
+
+# Folder of the CSV datasets and of their binary cache
+DATA_FOLDER = os.getenv('DATA_FOLDER', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+CACHE_FOLDER = os.getenv('DATASET_CACHE', os.path.join(DATA_FOLDER, 'cache'))
+
+# Dataset names and the CSV file each is built from
+DATASETS = {
+    "raw": "pima.csv",
+    "preprocessed": "preprocessed_pima.csv",
+    "balanced": "balanced_pima.csv",
+    "train": "train_data.csv",  # The training split of the last ml_model.py run
+    "test": "test_data.csv",
+    "clinic": "clinic_cases.csv",  # Labelled cases collected by incremental_training.py
+}
+
+# Bumped whenever the cached layout changes, so older caches are rebuilt
+STORE_VERSION = 2
+
+# Attempts of load_dataset when the build it was opening is replaced meanwhile by another process
+LOAD_ATTEMPTS = 3
+
+
+def file_hash(path):
+    """Return the SHA-256 of a file's contents."""
+    with open(path, "rb") as f:
+        return stream_hash(f)
+
+
+def stream_hash(f):
+    """Return the SHA-256 of the rest of an open binary file."""
+    digest = hashlib.sha256()
+    for block in iter(lambda: f.read(1 << 20), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_path(name):
+    """Return the path of the manifest of a cached dataset."""
+    return os.path.join(CACHE_FOLDER, f"{name}.manifest.json")
+
+
+def build_paths(name, build):
+    """Return the paths of the feature matrix and label vector of one build of a cached dataset."""
+    prefix = os.path.join(CACHE_FOLDER, f"{name}.{build}")
+    return f"{prefix}.features.npy", f"{prefix}.labels.npy"
+
+
+def manifest_paths(manifest):
+    """Return the paths of the feature matrix and label vector a manifest points to."""
+    return [os.path.join(CACHE_FOLDER, manifest["files"][key]) for key in ("features", "labels")]
+
+
+def build_name(sha256):
+    """Return the name of the build of a CSV, identifying both its contents and the cached layout."""
+    key = json.dumps({"sha256": sha256, "features": FEATURES, "target": TARGET, "version": STORE_VERSION})
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def source_path(name):
+    """Return the CSV file of a dataset name."""
+    if name not in DATASETS:
+        raise ValueError(f"Unknown dataset '{name}', expected one of {list(DATASETS)}")
+    return os.path.join(DATA_FOLDER, DATASETS[name])
+
+
+def read_manifest(name):
+    """Return the manifest of a cached dataset, or None if it is not cached."""
+    if not os.path.exists(manifest_path(name)):
+        return None
+    with open(manifest_path(name)) as f:
+        return json.load(f)
+
+
+def write_manifest(name, manifest):
+    """Write the manifest of a cached dataset, replacing the previous one atomically."""
+    with temporary_file(manifest_path(name), ".tmp", mode="w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f.name, manifest_path(name))
+
+
+def is_fresh(name, manifest):
+    """
+    Check that a cached dataset still matches its CSV and the current schema.
+    An unchanged size and modification time is trusted; otherwise the contents are hashed, and a CSV that
+    was only touched gets its manifest updated instead of being parsed again.
+    """
+    if manifest is None or manifest.get("store_version") != STORE_VERSION:
+        return False
+    if manifest["features"] != FEATURES or manifest["target"] != TARGET:
+        return False
+    if not all(os.path.exists(path) for path in manifest_paths(manifest)):
+        return False
+
+    stat = os.stat(source_path(name))
+    source = manifest["source"]
+    if (source["size"], source["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+        return True
+    if source["size"] != stat.st_size or source["sha256"] != file_hash(source_path(name)):
+        return False
+
+    manifest["source"]["mtime_ns"] = stat.st_mtime_ns
+    write_manifest(name, manifest)
+    return True
+
+
+def remove_replaced_builds(name, manifest):
+    """Delete the files of the builds of a dataset other than the one its manifest points to."""
+    current = set(manifest["files"].values())
+    for entry in os.scandir(CACHE_FOLDER):
+        if (entry.name.startswith(f"{name}.") and entry.name.endswith((".features.npy", ".labels.npy"))
+                and entry.name not in current):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass  # Already deleted by another process, or still open (Windows)
+
+
+def build_dataset(name, chunksize=100_000):
+    """
+    Parse a dataset's CSV in chunks into the binary cache and return its manifest.
+    The CSV is hashed and parsed through one open file, so the manifest describes the rows that were cached
+    even if the file is replaced meanwhile; a CSV rewritten in place during the build raises OSError.
+    """
+    import pandas as pd
+
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    csv_path = source_path(name)
+    with open(csv_path, "rb") as source:
+        stat = os.fstat(source.fileno())
+        sha256 = stream_hash(source)
+        source.seek(0)
+
+        build = build_name(sha256)
+        features_path, labels_path = build_paths(name, build)
+        features = ColumnarWriter(features_path, FEATURES, dtype=np.float32, sidecar=False)
+        labels = ColumnarWriter(labels_path, [TARGET], dtype=np.int8, sidecar=False)
+        for chunk in pd.read_csv(source, chunksize=chunksize):
+            features.write(chunk)
+            labels.write(chunk)
+
+        after = os.fstat(source.fileno())
+        if (after.st_size, after.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            raise OSError(f"{csv_path} was rewritten while it was being cached")
+    features.close()
+    labels.close()
+
+    manifest = {
+        "store_version": STORE_VERSION,
+        "name": name,
+        "build": build,
+        "features": FEATURES,
+        "target": TARGET,
+        "rows": features.rows,
+        "dtype": {"features": "float32", "labels": "int8"},
+        "files": {"features": os.path.basename(features_path), "labels": os.path.basename(labels_path)},
+        "source": {
+            "path": DATASETS[name],
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256,
+        },
+    }
+    write_manifest(name, manifest)
+    remove_replaced_builds(name, manifest)
+    return manifest
+
+
+def read_csv_dataset(name):
+    """Read a dataset straight from its CSV, as in-memory float32 features and int8 labels."""
+    import pandas as pd
+
+    data = pd.read_csv(source_path(name))
+    return data[FEATURES].to_numpy(dtype=np.float32), data[TARGET].to_numpy(dtype=np.int8)
+
+
+def open_dataset(name):
+    """
+    Return the features, labels and manifest of a dataset, as load_dataset does. The manifest is None when
+    the dataset could not be cached and was read from its CSV.
+    """
+    for _ in range(LOAD_ATTEMPTS):
+        try:
+            manifest = read_manifest(name)
+            if not is_fresh(name, manifest):
+                manifest = build_dataset(name)
+            features_path, labels_path = manifest_paths(manifest)
+            features = np.load(features_path, mmap_mode='r')
+            labels = np.load(labels_path, mmap_mode='r')[:, 0]  # A single contiguous column, so still a memory map
+            return features, labels, manifest
+        except FileNotFoundError:
+            if not os.path.exists(source_path(name)):
+                raise
+            continue  # Another process replaced the build and deleted its files meanwhile
+        except (OSError, ValueError) as e:
+            print(f"Could not cache dataset '{name}' ({e}), reading it from CSV")
+            break
+    return (*read_csv_dataset(name), None)
+
+
+def load_dataset(name):
+    """
+    Return the features (rows x FEATURES, float32, column-major) and labels (int8) of a dataset.
+    Both are read-only memory maps of the binary cache, which is (re)built from the CSV when missing or stale.
+    If the cache cannot be written, the CSV is read into memory instead.
+    """
+    features, labels, _ = open_dataset(name)
+    return features, labels
+
+
+def dataset_hash(name):
+    """Return the SHA-256 of the CSV a dataset was built from, recorded in its manifest."""
+    _, _, manifest = open_dataset(name)
+    return manifest["source"]["sha256"] if manifest is not None else file_hash(source_path(name))
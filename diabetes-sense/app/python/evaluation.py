@@ -1,108 +1,132 @@
 import os
-import pickle
-import joblib  # Add joblib for compatibility
+import argparse
 import numpy as np
 import pandas as pd
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix, roc_curve, auc
-import matplotlib.pyplot as plt
 from lime.lime_tabular import LimeTabularExplainer
+from schema import FEATURES
+from dataset_store import dataset_hash, load_dataset, source_path
+from model_bundle import load_bundle
+from charts import chart_spec
+from evaluation_engine import METRICS, build_report, save_report
+from lime_engine import SharedLimeExplainer
+from prediction_store import default_store
+from rendering import ChartRenderer, render_bar_chart, render_roc_curves
+
+### COMMAND LINE OPTIONS
+parser = argparse.ArgumentParser(description="Evaluate the models and write the evaluation report.")
+parser.add_argument('--datasets', nargs='+', default=["train", "test"],
+                    help="Labelled datasets to evaluate the models on (missing ones are skipped)")
+parser.add_argument('--resamples', type=int, default=1000, help="Bootstrap resamples per dataset (0 skips the intervals)")
+parser.add_argument('--confidence', type=float, default=0.95, help="Coverage of the bootstrap confidence intervals")
+parser.add_argument('--seed', type=int, default=42, help="Seed of the bootstrap resamples")
+parser.add_argument('--workers', type=int, default=int(os.getenv('EVALUATION_WORKERS', os.cpu_count() or 1)),
+                    help="Processes computing the bootstrap resamples (0 computes them in this process)")
+parser.add_argument('--lime-instances', type=int, default=5, help="Test instances explained with LIME")
+args = parser.parse_args()
 
 # Define the folder where the models are stored
 model_folder = os.getenv('MODEL_FOLDER', os.path.join(os.path.dirname(__file__), '..', 'models'))
 
-# Load the machine learning models and their accuracies
-models = {}
-accuracies = {}
-model_names = ["logistic_regression.pkl", "random_forest.pkl", "gradient_boosting.pkl"]
-
-for name in model_names:
-    model_path = os.path.join(model_folder, name)
-    if not os.path.exists(model_path):
-        raise FileNotFoundError(f"Model file not found: {model_path}")
-    # Load the model and its accuracy from the file
-    model, accuracy = joblib.load(model_path)
-    models[name.split('.')[0]] = model  # Use the model name without the file extension as the key
-    accuracies[name.split('.')[0]] = accuracy
+# Load the machine learning models, their accuracies, the scaler and each model's input space from the bundle
+bundle = load_bundle(model_folder, mmap_mode=None)
+models = bundle.models
 
 # Load test data
-test_data_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'test_data.csv')
+test_data_path = source_path("test")
 if not os.path.exists(test_data_path):
     raise FileNotFoundError(f"Test data file not found: {test_data_path}. Please ensure the file exists at the specified location.")
 
-test_data = pd.read_csv(test_data_path)
-X_test = test_data.drop("Outcome", axis=1).values  # Convert to NumPy array to avoid feature name mismatch
-y_test = test_data["Outcome"].values  # Convert to NumPy array for consistency
-
-# Load the scaler
-scaler_path = os.path.join(model_folder, "scaler.pkl")
-if not os.path.exists(scaler_path):
-    raise FileNotFoundError(f"Scaler file not found: {scaler_path}. Please ensure the scaler exists at the specified location.")
-scaler = joblib.load(scaler_path)
-
-# Scale the test data
-X_test = scaler.transform(X_test)
-
-# Initialize LIME explainer
-explainer = LimeTabularExplainer(
-    training_data=X_test,
-    feature_names=test_data.drop("Outcome", axis=1).columns.tolist(),
-    class_names=["Non-Diabetic", "Diabetic"],
-    mode="classification"
-)
+# NumPy features and labels from the dataset store, parsed from the CSV only when it changed
+datasets = {}
+for name in args.datasets:
+    if not os.path.exists(source_path(name)):
+        print(f"Skipping the {name} data, {source_path(name)} not found (ml_model.py writes the training split)")
+        continue
+    X, y = load_dataset(name)
+    datasets[name] = (X, y, dataset_hash(name))
+X_test, y_test = load_dataset("test")
 
 # Create evaluation folder if it doesn't exist
 evaluation_folder = os.path.join(os.path.dirname(__file__), '..', 'evaluation')
 os.makedirs(evaluation_folder, exist_ok=True)
 
-# Evaluate each model
-for model_name, model in models.items():
-    print(f"Evaluating {model_name}...")
-    y_pred = model.predict(X_test)
-    y_proba = model.predict_proba(X_test)[:, 1]
-
-    # Debugging: Print predictions
-    print(f"Predictions for {model_name}: {np.unique(y_pred, return_counts=True)}")
-
-    # Print evaluation metrics
-    print(f"Accuracy: {accuracy_score(y_test, y_pred):.2f}")
-    print(f"Precision: {precision_score(y_test, y_pred):.2f}")
-    print(f"Recall: {recall_score(y_test, y_pred):.2f}")
-    print(f"F1-Score: {f1_score(y_test, y_pred):.2f}")
-
-    # Generate confusion matrix
-    cm = confusion_matrix(y_test, y_pred)
-    print(f"Confusion Matrix:\n{cm}")
-
-    # Plot ROC curve
-    fpr, tpr, _ = roc_curve(y_test, y_proba)
-    roc_auc = auc(fpr, tpr)
-    plt.figure()
-    plt.plot(fpr, tpr, label=f"{model_name} (AUC = {roc_auc:.2f})")
-    plt.plot([0, 1], [0, 1], "k--")
-    plt.xlabel("False Positive Rate")
-    plt.ylabel("True Positive Rate")
-    plt.title(f"ROC Curve for {model_name}")
-    plt.legend(loc="lower right")
-    roc_curve_path = os.path.join(evaluation_folder, f"{model_name}_roc_curve.png")
-    plt.savefig(roc_curve_path)
-    plt.close()
-
-# Run LIME explanations on selected instances
-selected_instances = pd.DataFrame(X_test, columns=test_data.drop("Outcome", axis=1).columns).sample(5, random_state=42)
+# The figures are rendered on a process pool while the models are explained
+renderer = ChartRenderer(
+    workers=int(os.getenv('RENDER_WORKERS', os.cpu_count() or 1)),
+    templates=[(FEATURES, 10, 8)],  # The LIME figures' layout
+)
+renders = []  # (path, future of the PNG bytes)
+
+# Probabilities computed by earlier runs for the same models and data are read from the prediction store
+store = default_store()
+
+# Every model scores each dataset once; the metrics and their bootstrap intervals are derived from the scores
+report = build_report(bundle, datasets, args.resamples, args.confidence, args.seed, args.workers, store)
+
+for name, dataset in report["datasets"].items():
+    print(f"\n{name.capitalize()} data ({dataset['rows']} rows):")
+    for model_name, result in dataset["models"].items():
+        print(f"{model_name}:")
+        for metric in METRICS:
+            value = result["metrics"][metric]
+            interval = result["intervals"].get(metric)
+            bounds = f" ({args.confidence:.0%} CI {interval[0]:.2f}-{interval[1]:.2f})" if interval else ""
+            print(f"  {metric}: {'n/a' if value is None else f'{value:.2f}'}{bounds}")
+        print(f"  Confusion Matrix:\n{np.array(result['confusion_matrix'])}")
+
+        # Plot ROC curve
+        if name == "test" and result["metrics"]["roc_auc"] is not None:
+            curve = result["roc_curve"]
+            roc_curve_path = os.path.join(evaluation_folder, f"{model_name}_roc_curve.png")
+            renders.append((roc_curve_path, renderer.submit(
+                render_roc_curves, [(curve["fpr"], curve["tpr"], f"{model_name} (AUC = {result['metrics']['roc_auc']:.2f})")],
+                f"ROC Curve for {model_name}",
+            )))
+
+# Run LIME explanations on selected instances, every model on one shared neighbourhood per instance
+explainer = SharedLimeExplainer(LimeTabularExplainer(
+    training_data=np.asarray(X_test, dtype=float),
+    feature_names=FEATURES,
+    class_names=["Non-Diabetic", "Diabetic"],
+    mode="classification",
+    random_state=args.seed,
+))
+def predict_fn(model_name):
+    """Return the predict_proba of a model for the raw rows LIME perturbs, through the prediction store if enabled."""
+    if store is not None:
+        return lambda rows: store.predict_proba(bundle, model_name, rows)  # The seeded neighbourhoods repeat across runs
+    return lambda rows: models[model_name].predict_proba(bundle.model_input(model_name, rows))
+
+predict_fns = {model_name: predict_fn(model_name) for model_name in models}
+lime_scores = {model_name: [] for model_name in models}
+selected_instances = pd.DataFrame(np.asarray(X_test, dtype=float), columns=FEATURES).sample(args.lime_instances, random_state=42)
 for idx, instance in selected_instances.iterrows():
-    explanation = explainer.explain_instance(
-        data_row=instance.values,  # Use .values to avoid deprecated behavior
-        predict_fn=models["logistic_regression"].predict_proba  # Change model as needed
-    )
-    lime_png_path = os.path.join(evaluation_folder, f"lime_explanation_{idx}.png")
-    fig = explanation.as_pyplot_figure()
+    explanations = explainer.explain(instance.values, predict_fns)
+    for model_name, explanation in explanations.items():
+        lime_scores[model_name].append(float(explanation.score))  # R² of the local surrogate
 
-    # Customize the graph
-    fig.set_size_inches(10, 8)  # Make the graph larger
-    ax = fig.gca()
-    ax.set_yticklabels([label.get_text().split(' ')[0] for label in ax.get_yticklabels()])  # Extract text and remove thresholds
-
-    # Adjust layout to prevent feature names from being cut off
-    fig.tight_layout(pad=3.0)
-    plt.savefig(lime_png_path, bbox_inches="tight")  # Use bbox_inches to ensure everything fits
-    plt.close()
\ No newline at end of file
+    # One bar per feature, in the same layout as the app's explanation charts, so every figure reuses the
+    # renderer's template and the labels are feature names rather than LIME's threshold labels
+    lime_png_path = os.path.join(evaluation_folder, f"lime_explanation_{idx}.png")
+    feature_importances = {feature: 0 for feature in FEATURES}
+    for feature_index, importance in explanations["logistic_regression"].as_map():
+        feature_importances[FEATURES[feature_index]] = importance
+    spec = chart_spec(feature_importances, "Local explanation for class Diabetic")
+    renders.append((lime_png_path, renderer.submit(render_bar_chart, spec, 10, 8, 100)))
+
+# How faithfully LIME's local surrogates follow each model around the explained instances
+report["lime"] = {
+    model_name: {"instances": len(scores), "mean_surrogate_r2": float(np.mean(scores))}
+    for model_name, scores in lime_scores.items()
+}
+print("\nLIME surrogate R²: " + ", ".join(f"{name} {each['mean_surrogate_r2']:.2f}" for name, each in report["lime"].items()))
+print(f"Evaluation report saved at {save_report(evaluation_folder, report)}")
+if store is not None:
+    stats = store.stats()
+    print(f"Prediction store: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions")
+
+# Write the figures once they are rendered
+for path, future in renders:
+    with open(path, 'wb') as f:
+        f.write(future.result())
+renderer.shutdown()
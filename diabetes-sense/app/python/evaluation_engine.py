@@ -0,0 +1,214 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.stats
+from sklearn.metrics import roc_curve
+
+# Evaluation of the bundle's models on the labelled datasets, shared by evaluation.py, result_graph.py and
+# benchmark.py. Every model scores each dataset once; the predictions, confusion matrix, accuracy, precision,
+# recall, F1 and ROC AUC are all derived from those probabilities with array operations, the AUC from the
+# ranks of the scores (the Mann-Whitney statistic, equal to the area under the ROC curve with ties averaged).
+# The same functions work on a matrix of bootstrap resamples, one per row, so the confidence intervals take
+# one vectorized pass per chunk of resamples. The chunks run on a process pool and each draws from its own
+# seed, spawned from the report's seed, so the intervals do not depend on the number of workers.
+# The results are written to a JSON report, which the plotting scripts read instead of scoring the models.
+
+REPORT_FILE = "evaluation_report.json"
+REPORT_FORMAT = 1
+
+# Metrics computed for every model, with a bootstrap confidence interval each
+METRICS = ["accuracy", "precision", "recall", "f1", "roc_auc"]
+
+# Bootstrap resamples per chunk, and the most resampled indices a chunk draws at once (rows times resamples)
+CHUNK_RESAMPLES = 100
+CHUNK_ELEMENTS = 2_000_000
+
+
+def report_path(evaluation_folder):
+    """Return the path of the evaluation report in an evaluation folder."""
+    return os.path.join(evaluation_folder, REPORT_FILE)
+
+
+def score_models(bundle, X, store=None, dataset_key=None):
+    """
+    Score the rows of X once with every model of the bundle, each in the input space it was trained on.
+    With a PredictionStore, probabilities computed before for the same model and dataset_key are read back instead.
+    Returns {model name: (predicted classes, probabilities of the positive class)}.
+    """
+    scores = {}
+    for model_name, model in bundle.models.items():
+        if store is not None:
+            probabilities = store.predict_proba(bundle, model_name, X, dataset_key)
+        else:
+            probabilities = model.predict_proba(bundle.model_input(model_name, X))
+        scores[model_name] = (probabilities.argmax(axis=1), probabilities[:, 1])  # argmax, as predict() decides
+    return scores
+
+
+def confusion_counts(y, predictions):
+    """Return the true positives, false positives, false negatives and true negatives along the last axis."""
+    y, predictions = y.astype(bool), predictions.astype(bool)
+    tp = np.count_nonzero(y & predictions, axis=-1)
+    fp = np.count_nonzero(~y & predictions, axis=-1)
+    fn = np.count_nonzero(y & ~predictions, axis=-1)
+    tn = y.shape[-1] - tp - fp - fn
+    return tp, fp, fn, tn
+
+
+def ratio(numerator, denominator):
+    """Divide element-wise, with 0 where the denominator is 0 (as sklearn's zero_division default reports)."""
+    numerator, denominator = np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+
+def roc_auc(y, scores):
+    """
+    Return the area under the ROC curve along the last axis, from the ranks of the scores.
+    NaN where the labels hold a single class.
+    """
+    positives = np.count_nonzero(y, axis=-1)
+    negatives = y.shape[-1] - positives
+    ranks = scipy.stats.rankdata(scores, axis=-1)  # Ties get their average rank
+    rank_sum = np.where(y.astype(bool), ranks, 0).sum(axis=-1)
+    pairs = (positives * negatives).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(pairs > 0, (rank_sum - positives * (positives + 1) / 2) / pairs, np.nan)
+
+
+def compute_metrics(y, predictions, scores):
+    """
+    Return every metric of METRICS plus the confusion counts, computed along the last axis: scalars for
+    one set of labels, arrays with one value per row for a matrix of resamples.
+    """
+    tp, fp, fn, tn = confusion_counts(y, predictions)
+    precision = ratio(tp, tp + fp)
+    recall = ratio(tp, tp + fn)
+    return {
+        "accuracy": ratio(tp + tn, y.shape[-1]),
+        "precision": precision,
+        "recall": recall,
+        "f1": ratio(2 * tp, 2 * tp + fp + fn),
+        "roc_auc": roc_auc(y, scores),
+        "counts": (tp, fp, fn, tn),
+    }
+
+
+def bootstrap_chunk(y, model_scores, resamples, seed):
+    """
+    Compute the metrics of every model on resamples bootstrap resamples of the rows, drawn from seed.
+    Returns {model name: {metric: array of one value per resample}}.
+    """
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, len(y), size=(resamples, len(y)))
+    y_resampled = y[indices]
+    results = {}
+    for model_name, (predictions, scores) in model_scores.items():
+        metrics = compute_metrics(y_resampled, predictions[indices], scores[indices])
+        results[model_name] = {metric: metrics[metric] for metric in METRICS}
+    return results
+
+
+def bootstrap(y, model_scores, resamples, seed=42, workers=None):
+    """
+    Compute the metrics of every model on bootstrap resamples, in chunks on a pool of workers processes
+    (0 computes them in the calling process). Returns {model name: {metric: array of one value per resample}}.
+    """
+    chunk = max(1, min(CHUNK_RESAMPLES, CHUNK_ELEMENTS // max(len(y), 1)))
+    sizes = [min(chunk, resamples - start) for start in range(0, resamples, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers == 0 or len(sizes) == 1:
+        chunks = [bootstrap_chunk(y, model_scores, size, each) for size, each in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(sizes))) as executor:
+            chunks = list(executor.map(bootstrap_chunk, [y] * len(sizes), [model_scores] * len(sizes), sizes, seeds))
+    return {
+        model_name: {metric: np.concatenate([each[model_name][metric] for each in chunks]) for metric in METRICS}
+        for model_name in model_scores
+    }
+
+
+def confidence_interval(values, confidence):
+    """Return the percentile interval of the bootstrap values holding the given share of them, or None if all are NaN."""
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return None
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(values, [tail, 100 - tail])
+    return [float(low), float(high)]
+
+
+def evaluate_dataset(bundle, X, y, resamples=1000, confidence=0.95, seed=42, workers=None, store=None, dataset_key=None):
+    """
+    Evaluate every model of the bundle on one labelled dataset, scoring it once per model (see score_models).
+    Returns {model name: its metrics, confidence intervals, confusion matrix, ROC curve and mean confidence}.
+    """
+    y = np.asarray(y, dtype=np.int8)
+    model_scores = score_models(bundle, np.asarray(X, dtype=float), store, dataset_key)
+    resampled = bootstrap(y, model_scores, resamples, seed, workers) if resamples else {}
+
+    results = {}
+    for model_name, (predictions, scores) in model_scores.items():
+        metrics = compute_metrics(y, predictions, scores)
+        tp, fp, fn, tn = metrics.pop("counts")
+        both_classes = 0 < np.count_nonzero(y) < len(y)
+        fpr, tpr, _ = roc_curve(y, scores) if both_classes else (np.array([]), np.array([]), None)
+        results[model_name] = {
+            # The AUC is undefined (None) when the dataset holds a single class
+            "metrics": {metric: None if np.isnan(value) else float(value) for metric, value in metrics.items()},
+            "intervals": {
+                metric: confidence_interval(values, confidence) for metric, values in resampled.get(model_name, {}).items()
+            },
+            "confusion_matrix": [[int(tn), int(fp)], [int(fn), int(tp)]],  # Rows are the true class, as sklearn orders them
+            "mean_confidence": float(np.maximum(scores, 1 - scores).mean()),
+            "roc_curve": {"fpr": fpr.tolist(), "tpr": tpr.tolist()},
+        }
+    return results
+
+
+def build_report(bundle, datasets, resamples=1000, confidence=0.95, seed=42, workers=None, store=None):
+    """
+    Evaluate the bundle's models on every dataset of datasets, {name: (X, y, SHA-256 of its source)}, with
+    the probabilities of a PredictionStore when one is given.
+    Returns the report as a dictionary, ready for save_report.
+    """
+    return {
+        "format": REPORT_FORMAT,
+        "created_at": time.time(),
+        "model_version": bundle.content_hash or bundle.source,
+        "models": list(bundle.models),
+        "bootstrap": {"resamples": resamples, "confidence": confidence, "seed": seed},
+        "datasets": {
+            name: {
+                "rows": len(y),
+                "sha256": sha256,
+                "models": evaluate_dataset(bundle, X, y, resamples, confidence, seed, workers, store, sha256),
+            }
+            for name, (X, y, sha256) in datasets.items()
+        },
+    }
+
+
+def save_report(evaluation_folder, report):
+    """Write the evaluation report, replacing the previous one atomically. Returns its path."""
+    path = report_path(evaluation_folder)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(temp_path, path)
+    return path
+
+
+def load_report(evaluation_folder):
+    """Read the evaluation report of an evaluation folder. Raises FileNotFoundError when there is none."""
+    path = report_path(evaluation_folder)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Evaluation report not found: {path}. Run evaluation.py first.")
+    with open(path) as f:
+        report = json.load(f)
+    if report.get("format") != REPORT_FORMAT:
+        raise ValueError(f"Unsupported evaluation report format {report.get('format')} in {path}")
+    return report
@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+from collections import Counter
+
+import numpy as np
+
+# Precomputed training statistics for the LIME explainer.
+# LimeTabularExplainer normally derives its quartile bins, per-bin means/stds/ranges and bin frequencies
+# from the full training matrix. These statistics are computed once here (with the same formulas as LIME's
+# QuartileDiscretizer) and stored as a small JSON artifact, so the server does not have to read the
+# training CSV, or even import LIME, before it can serve traffic.
+
+
+def compute_training_stats(training_data, feature_names):
+    """
+    Compute LIME's quartile discretizer statistics from a training matrix (rows x features).
+    Returns a JSON-serializable dictionary with one list entry per feature.
+    """
+    training_data = np.asarray(training_data, dtype=float)
+    stats = {
+        "feature_names": list(feature_names),
+        "data_hash": hashlib.sha256(np.ascontiguousarray(training_data).tobytes()).hexdigest()[:16],
+        "n_samples": int(training_data.shape[0]),
+        "feature_means": training_data.mean(axis=0).tolist(),
+        "bins": [], "means": [], "stds": [], "mins": [], "maxs": [],
+        "feature_values": [], "feature_frequencies": [],
+    }
+    for feature in range(training_data.shape[1]):
+        column = training_data[:, feature]
+        qts = np.unique(np.percentile(column, [25, 50, 75]))
+        discretized = np.searchsorted(qts, column)
+
+        means, stds = [], []
+        for x in range(len(qts) + 1):
+            selection = column[discretized == x]
+            means.append(0.0 if len(selection) == 0 else float(np.mean(selection)))
+            stds.append((0.0 if len(selection) == 0 else float(np.std(selection))) + 0.00000000001)
+
+        counts = sorted(Counter(discretized.tolist()).items())
+        stats["bins"].append(qts.tolist())
+        stats["means"].append(means)
+        stats["stds"].append(stds)
+        stats["mins"].append([float(column.min())] + qts.tolist())
+        stats["maxs"].append(qts.tolist() + [float(column.max())])
+        stats["feature_values"].append([value for value, _ in counts])
+        stats["feature_frequencies"].append([count for _, count in counts])
+    return stats
+
+
+def save_training_stats(path, stats):
+    """Write the statistics to a JSON file, replacing it atomically so a watching server never reads it half-written."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(stats, f)
+    os.replace(tmp_path, path)
+
+
+def load_training_stats(path):
+    """Read the statistics written by save_training_stats, or return None if the file does not exist."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def lime_training_data_stats(stats):
+    """
+    Convert the statistics into the training_data_stats dictionary LimeTabularExplainer expects,
+    which is keyed by feature index.
+    """
+    keys = ["bins", "means", "stds", "mins", "maxs", "feature_values", "feature_frequencies"]
+    return {key: dict(enumerate(stats[key])) for key in keys}
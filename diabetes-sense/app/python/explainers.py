@@ -0,0 +1,156 @@
+import numpy as np
+import scipy.sparse as sp
+
+# Fast, exact feature attributions for the model types served by the app.
+# LIME has to sample and score thousands of perturbed rows per prediction, whereas linear models
+# and tree ensembles can be attributed directly from their parameters:
+# - LinearExplainer: coefficient x deviation of the input from the training mean (log-odds units)
+# - TreeExplainer: path-based attributions, where each split on the decision path credits the change
+#   in the node value to the feature it splits on (probability units for forests, log-odds for boosting)
+
+
+class FeatureAttribution:
+    """
+    Per-feature contributions for one prediction, exposing the same as_list/as_map views as LIME's Explanation.
+    """
+
+    def __init__(self, feature_labels, contributions):
+        self.feature_labels = feature_labels
+        # Sort by decreasing absolute contribution, like LIME's local explanation
+        order = np.argsort(-np.abs(contributions), kind='stable')
+        self.local_exp = [(int(index), float(contributions[index])) for index in order]
+
+    def as_map(self):
+        """Return the attribution as a list of (feature index, contribution) tuples."""
+        return list(self.local_exp)
+
+    def as_list(self):
+        """Return the attribution as a list of (feature label, contribution) tuples."""
+        return [(self.feature_labels[index], weight) for index, weight in self.local_exp]
+
+
+def feature_labels(feature_names, raw_row):
+    """
+    Label each feature with the value it had in the original (unscaled) input, e.g. "Glucose = 150.00".
+    """
+    return [f"{name} = {value:.2f}" for name, value in zip(feature_names, raw_row)]
+
+
+class LinearExplainer:
+    """
+    Closed-form attributions for binary linear classifiers such as LogisticRegression:
+    contribution_j = coef_j * (x_j - mean_j), in the log-odds of the positive class.
+    """
+    name = "linear"
+
+    def __init__(self, model, background, feature_names):
+        self.coef = model.coef_[0]
+        self.mean = np.asarray(background, dtype=float).mean(axis=0)
+        self.feature_names = feature_names
+
+    @staticmethod
+    def supports(model):
+        """Return True for fitted binary linear models."""
+        coef = getattr(model, 'coef_', None)
+        return coef is not None and coef.ndim == 2 and coef.shape[0] == 1
+
+    def explain(self, model_row, raw_row):
+        """Attribute one row given in the model's input space; raw_row is only used for the labels."""
+        contributions = self.coef * (np.asarray(model_row, dtype=float) - self.mean)
+        return FeatureAttribution(feature_labels(self.feature_names, raw_row), contributions)
+
+
+class TreeExplainer:
+    """
+    Path-based attributions for RandomForestClassifier and binary GradientBoostingClassifier.
+    For every tree, the change in node value between a parent and its child is credited to the feature
+    the parent splits on. These per-node deltas are precomputed into one (total nodes x features) matrix,
+    so attributing rows is a single sparse product of the decision path indicator with that matrix.
+    """
+    name = "tree"
+
+    def __init__(self, model, background, feature_names):
+        self.model = model
+        self.feature_names = feature_names
+        n_features = len(feature_names)
+
+        if self.is_boosting(model):
+            # Boosting trees are regressors on the log-odds, scaled by the learning rate
+            self.trees = [estimator[0].tree_ for estimator in model.estimators_]
+            scale = model.learning_rate
+            node_values = [tree.value[:, 0, 0] for tree in self.trees]
+        else:
+            # Forest trees vote with the positive class fraction of each node, averaged over trees
+            self.trees = [estimator.tree_ for estimator in model.estimators_]
+            scale = 1.0 / len(self.trees)
+            node_values = [tree.value[:, 0, 1] / tree.value[:, 0, :].sum(axis=1) for tree in self.trees]
+
+        self.deltas = np.vstack([
+            self.delta_matrix(tree, values, n_features) * scale
+            for tree, values in zip(self.trees, node_values)
+        ])
+
+    @staticmethod
+    def is_boosting(model):
+        """Return True for gradient boosting models, whose estimators_ is a 2D array of regressors."""
+        return isinstance(getattr(model, 'estimators_', None), np.ndarray) and model.estimators_.ndim == 2
+
+    @classmethod
+    def supports(cls, model):
+        """Return True for fitted binary tree ensembles."""
+        estimators = getattr(model, 'estimators_', None)
+        if estimators is None or len(getattr(model, 'classes_', [])) != 2:
+            return False
+        if cls.is_boosting(model):
+            return estimators.shape[1] == 1
+        return all(hasattr(estimator, 'tree_') for estimator in estimators)
+
+    @staticmethod
+    def delta_matrix(tree, values, n_features):
+        """
+        Build the (nodes x features) matrix holding, for every non-root node, the change in value
+        from its parent in the column of the feature the parent splits on.
+        """
+        parents = np.full(tree.node_count, -1)
+        internal = np.where(tree.children_left >= 0)[0]
+        parents[tree.children_left[internal]] = internal
+        parents[tree.children_right[internal]] = internal
+
+        children = np.where(parents >= 0)[0]
+        deltas = np.zeros((tree.node_count, n_features))
+        deltas[children, tree.feature[parents[children]]] = values[children] - values[parents[children]]
+        return deltas
+
+    def decision_path(self, X):
+        """Return the node indicator of X for all trees, with columns in the same order as self.deltas."""
+        if self.is_boosting(self.model):
+            return sp.hstack([estimator[0].decision_path(X) for estimator in self.model.estimators_]).tocsr()
+        indicator, _ = self.model.decision_path(X)
+        return indicator
+
+    def contributions(self, X):
+        """Return the (rows x features) attribution matrix for the rows of X in the model's input space."""
+        return np.asarray(self.decision_path(np.asarray(X, dtype=np.float32)) @ self.deltas)
+
+    def explain(self, model_row, raw_row):
+        """Attribute one row given in the model's input space; raw_row is only used for the labels."""
+        contributions = self.contributions(np.asarray(model_row).reshape(1, -1))[0]
+        return FeatureAttribution(feature_labels(self.feature_names, raw_row), contributions)
+
+
+# Fast explainers, tried in order when picking one by model type
+EXPLAINERS = {
+    LinearExplainer.name: LinearExplainer,
+    TreeExplainer.name: TreeExplainer,
+}
+
+
+def build_explainer(model, background, feature_names):
+    """
+    Return the fast explainer matching the model type, or None when the model can only be explained with LIME.
+    background is the training data in the model's input space.
+    """
+    for explainer_class in EXPLAINERS.values():
+        if explainer_class.supports(model):
+            return explainer_class(model, background, feature_names)
+    return None
@@ -0,0 +1,60 @@
+import gc
+import os
+import sys
+import tempfile
+
+# Production serving of model-app.py: gunicorn -c gunicorn.conf.py (from diabetes-sense/app/python)
+# The app is preloaded in the master process, which loads the model bundle (memory-mapped), compiles the
+# tree ensembles, builds the explainers and runs the warm-up predictions once, then forks the workers.
+# The workers share those pages copy-on-write, so memory stays close to one copy of the models however
+# many workers run. Each worker limits its BLAS / OpenMP threads so the workers do not oversubscribe the CPUs.
+
+# BLAS / OpenMP threads per worker; the variables must be set before the preloaded app imports NumPy
+blas_threads = os.getenv('WORKER_BLAS_THREADS', '1')
+for variable in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "BLIS_NUM_THREADS",
+                 "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]:
+    os.environ.setdefault(variable, blas_threads)
+
+# Build the explainers and run the warm-up predictions before forking, so every worker starts warm
+os.environ.setdefault('STARTUP_MODE', 'eager')
+
+# Aggregate the Prometheus metrics of all workers on /metrics
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='diabetes-sense-metrics-'))
+
+wsgi_app = "model-app:app"
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_WORKERS', os.cpu_count() or 1))
+threads = int(os.getenv('WEB_THREADS', 1))
+timeout = int(os.getenv('WEB_TIMEOUT', 120))  # A LIME explanation with PNG charts can take a few seconds
+preload_app = True
+
+# With several threads per worker, concurrent single-patient predictions are scored in micro-batches
+if threads > 1:
+    os.environ.setdefault('PREDICT_BATCH_WINDOW_MS', '2')
+
+# Objects allocated before the fork are never collected by the workers: the garbage collector is disabled
+# while the app is preloaded and everything it allocated is frozen, so collections in the workers do not
+# write to (and copy) the shared pages
+gc.disable()
+
+
+def when_ready(server):
+    """Freeze the preloaded app's objects just before the first workers are forked."""
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Limit the worker's native thread pools, re-enable its garbage collector and restart the app's threads."""
+    from threadpoolctl import threadpool_limits
+
+    threadpool_limits(limits=int(blas_threads))
+    gc.enable()
+    app_module = sys.modules[server.app.wsgi().import_name]
+    app_module.after_fork()
+
+
+def child_exit(server, worker):
+    """Drop the metrics files of an exited worker."""
+    from telemetry import mark_process_dead
+
+    mark_process_dead(worker.pid)
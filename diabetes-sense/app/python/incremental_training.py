@@ -0,0 +1,312 @@
+import argparse
+import copy
+import os
+import subprocess
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier, VotingClassifier
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.linear_model import LogisticRegression
+
+from dataset_store import load_dataset, source_path
+from model_bundle import load_bundle, save_bundle
+from preprocessing_pipeline import DROP_ZERO_COLUMNS, IMPUTE_ZERO_COLUMNS, temporary_file
+from schema import FEATURES, TARGET
+
+# Incremental retraining from a small batch of newly labelled cases, without a grid search.
+# The new cases are first compared with the training data: the population stability index (PSI) of each
+# feature over the explainer statistics' quartile bins measures drift, and the current models' accuracy on
+# the new cases is compared with their test accuracy. If either moved more than its threshold, the models are
+# retrained from scratch by ml_model.py, which trains on the clinic cases collected so far too.
+# Otherwise the latest --holdout share of the cases (in file order) is held out and the rest updates the
+# bundle in place: the scaler's running mean and variance absorb the new rows, every model trained on scaled
+# rows is adapted to the updated scaler (coefficients rescaled, tree thresholds moved, so it predicts exactly
+# as before), logistic regression continues from its current coefficients on the training data plus the new
+# rows (a few iterations, as it starts next to the optimum), and the random forest grows warm-start trees
+# fitted on the new rows alone. Each updated model is re-validated on the
+# held-out window and kept only if it is not worse there than before the update. The result is saved as a
+# new bundle version, which a running server reloads, and the cases are added to data/clinic_cases.csv.
+#
+#   python incremental_training.py ../data/new_cases.csv
+#   python incremental_training.py ../data/new_cases.csv --no-full-search  # Only report drift
+
+base_path = os.path.dirname(os.path.abspath(__file__))  # Get the directory of the current script
+
+# PSI above which a feature is considered to have drifted (0.1 - 0.25 is the usual "moderate shift" band)
+DEFAULT_DRIFT_THRESHOLD = 0.25
+
+# Drop of a model's accuracy on the new cases, below its test accuracy, that triggers a full search
+DEFAULT_MAX_ACCURACY_DROP = 0.1
+
+# Frequencies are floored to this value so empty bins do not make the PSI infinite
+PSI_FLOOR = 1e-4
+
+
+def read_cases(path):
+    """
+    Read labelled cases (the FEATURES and TARGET columns) from a CSV file, in file order, cleaned like the
+    training data: rows with a zero where it is impossible are dropped, and zeros that mean "not measured"
+    are replaced by the median of the training data.
+    """
+    data = pd.read_csv(path)
+    missing = [column for column in FEATURES + [TARGET] if column not in data.columns]
+    if missing:
+        raise ValueError(f"{path} is missing the columns {missing}")
+    data = data[(data[DROP_ZERO_COLUMNS] != 0).all(axis=1)].dropna(subset=FEATURES + [TARGET])
+
+    training, _ = load_dataset("balanced")
+    for column in IMPUTE_ZERO_COLUMNS:
+        median = float(np.median(training[:, FEATURES.index(column)]))
+        data[column] = data[column].replace(0, median)
+    return data[FEATURES].to_numpy(dtype=float), data[TARGET].to_numpy(dtype=int)
+
+
+def population_stability(stats, X):
+    """
+    Return the population stability index of each feature of X against the training data, computed over the
+    quartile bins of the explainer statistics (see explainer_stats.py).
+    """
+    psi = {}
+    for feature, name in enumerate(stats["feature_names"]):
+        bins = stats["bins"][feature]
+        expected = np.zeros(len(bins) + 1)
+        expected[stats["feature_values"][feature]] = stats["feature_frequencies"][feature]
+        actual = np.bincount(np.searchsorted(bins, X[:, feature]), minlength=len(bins) + 1)
+        expected = np.maximum(expected / expected.sum(), PSI_FLOOR)
+        actual = np.maximum(actual / actual.sum(), PSI_FLOOR)
+        psi[name] = float(np.sum((actual - expected) * np.log(actual / expected)))
+    return psi
+
+
+def model_accuracy(bundle, model_name, X, y):
+    """Return the accuracy of one model of the bundle on raw rows."""
+    return float((bundle.models[model_name].predict(bundle.model_input(model_name, X)) == y).mean())
+
+
+def retraining_triggers(bundle, X, y, drift_threshold=DEFAULT_DRIFT_THRESHOLD, max_accuracy_drop=DEFAULT_MAX_ACCURACY_DROP):
+    """
+    Compare new cases with the training data and the bundle's models. Returns the PSI of every feature, the
+    features whose PSI is above drift_threshold and the models whose accuracy on the cases is more than
+    max_accuracy_drop below their test accuracy (feature or model name -> PSI or drop). Any drifted feature or
+    dropped model calls for a full search instead of an incremental update.
+    """
+    psi = population_stability(bundle.explainer_stats, X)
+    drifted = {name: value for name, value in psi.items() if value > drift_threshold}
+    drops = {}
+    for model_name in bundle.models:
+        reference = bundle.metrics.get(model_name, {}).get("test_accuracy", bundle.accuracies[model_name])
+        drop = reference - model_accuracy(bundle, model_name, X, y)
+        if drop > max_accuracy_drop:
+            drops[model_name] = drop
+    return psi, drifted, drops
+
+
+def scaled_values(values, old_scaler, new_scaler):
+    """
+    Return, for each feature, the distinct values of the raw rows standardized with the old and with the new
+    scaler, both sorted and rounded to float32 as the trees compare them.
+    """
+    grid = []
+    for feature, column in enumerate(np.asarray(values, dtype=float).T):
+        column = np.unique(column)
+        grid.append((
+            ((column - old_scaler.mean_[feature]) / old_scaler.scale_[feature]).astype(np.float32),
+            ((column - new_scaler.mean_[feature]) / new_scaler.scale_[feature]).astype(np.float32),
+        ))
+    return grid
+
+
+def rescale_model(model, old_scaler, new_scaler, values):
+    """
+    Adapt a model trained on rows standardized with old_scaler to rows standardized with new_scaler, so it
+    predicts the same for the same raw rows: linear coefficients are rescaled and tree thresholds moved.
+    values are raw rows (the training data) whose every value must stay on the same side of every split.
+    """
+    # A row standardized with the old scaler is ratio * (the row standardized with the new one) + shift
+    ratio = new_scaler.scale_ / old_scaler.scale_
+    shift = (new_scaler.mean_ - old_scaler.mean_) / old_scaler.scale_
+    if isinstance(model, LogisticRegression):
+        model.intercept_ = model.intercept_ + model.coef_ @ shift
+        model.coef_ = model.coef_ * ratio
+        return
+    if isinstance(model, VotingClassifier):
+        for estimator in model.estimators_:
+            rescale_model(estimator, old_scaler, new_scaler, values)
+        return
+    if isinstance(model, RandomForestClassifier):
+        trees = [estimator.tree_ for estimator in model.estimators_]
+    elif isinstance(model, GradientBoostingClassifier):
+        trees = [estimator.tree_ for estimator in model.estimators_.ravel()]
+    else:
+        raise ValueError(f"Cannot adapt a {type(model).__name__} to an updated scaler")
+
+    # Thresholds are mapped linearly. Trees compare float32 inputs with them, though, and a value within a
+    # float32 step of a threshold can round to the other side of the mapped one, so each mapped threshold is
+    # kept between the nearest known values on either side of the original, standardized with the new scaler.
+    grid = scaled_values(values, old_scaler, new_scaler)
+    for tree in trees:
+        thresholds = tree.threshold  # A view of the tree's nodes, so the thresholds are moved in place
+        for feature, (old, new) in enumerate(grid):
+            nodes = np.flatnonzero(tree.feature == feature)
+            left = np.searchsorted(old, thresholds[nodes], side='right')  # Known values left of each split
+            lowest = np.where(left > 0, new[np.maximum(left - 1, 0)], -np.inf)
+            below_right = np.nextafter(new[np.minimum(left, len(new) - 1)], np.float32(-np.inf))
+            highest = np.where(left < len(new), below_right, np.inf)
+            moved = (thresholds[nodes] - shift[feature]) / ratio[feature]
+            thresholds[nodes] = np.maximum(np.minimum(moved, highest), lowest)
+
+
+def update_scaler(scaler, X):
+    """
+    Fold raw rows into a fitted StandardScaler's running mean and variance. The rows are given as the scaler
+    was fitted: a DataFrame for scalers fitted with feature names (the legacy scaler.pkl), an array otherwise.
+    """
+    if hasattr(scaler, "feature_names_in_"):
+        X = pd.DataFrame(X, columns=scaler.feature_names_in_)
+    scaler.partial_fit(X)
+
+
+def continue_logistic_regression(model, X, y, max_iter):
+    """
+    Continue fitting logistic regression from its current coefficients for at most max_iter iterations.
+    X should hold the rows the model was trained on as well as the new ones, since a warm start does not
+    remember the previous data: on the new rows alone it would converge to their optimum.
+    """
+    if model.solver == "liblinear":
+        model.set_params(solver="lbfgs")  # liblinear always starts from zero
+    model.set_params(warm_start=True, max_iter=max_iter)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", ConvergenceWarning)  # Stopping early is the point
+        model.fit(X, y)
+
+
+def grow_forest(model, X, y, new_trees, max_trees):
+    """Add new_trees warm-start trees fitted on X to a random forest, keeping at most the max_trees newest."""
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + new_trees)
+    model.fit(X, y)
+    if max_trees and len(model.estimators_) > max_trees:
+        del model.estimators_[:len(model.estimators_) - max_trees]
+        model.set_params(n_estimators=len(model.estimators_))
+
+
+def training_history():
+    """Return the rows the models were trained on: the balanced dataset and the clinic cases recorded so far."""
+    X, y = load_dataset("balanced")
+    if os.path.exists(source_path("clinic")):
+        X_clinic, y_clinic = load_dataset("clinic")
+        X, y = np.concatenate([X, X_clinic]), np.concatenate([y, y_clinic])
+    return np.asarray(X, dtype=float), np.asarray(y, dtype=int)
+
+
+def record_cases(X, y):
+    """Append labelled cases to data/clinic_cases.csv, which ml_model.py trains on with the balanced data."""
+    path = source_path("clinic")
+    cases = pd.DataFrame(X, columns=FEATURES)
+    cases[TARGET] = y
+    if os.path.exists(path):
+        cases = pd.concat([pd.read_csv(path), cases], ignore_index=True)
+    # Written to a temporary file and moved into place, so the dataset store never reads it half-written
+    with temporary_file(path, ".tmp", mode="w") as f:
+        cases.to_csv(f, index=False, float_format='%g')
+    os.replace(f.name, path)
+    print(f"{len(y)} cases added to {path} ({len(cases)} in total)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the models with newly labelled cases.")
+    parser.add_argument('new_cases', help="CSV file of labelled cases with the feature and Outcome columns")
+    parser.add_argument('--holdout', type=float, default=0.25,
+                        help="Share of the newest cases held out to validate the updated models")
+    parser.add_argument('--drift-threshold', type=float, default=DEFAULT_DRIFT_THRESHOLD,
+                        help="Feature PSI above which the models are retrained with a full search")
+    parser.add_argument('--max-accuracy-drop', type=float, default=DEFAULT_MAX_ACCURACY_DROP,
+                        help="Accuracy drop on the new cases above which the models are retrained with a full search")
+    parser.add_argument('--lr-max-iter', type=int, default=50, help="Iterations logistic regression continues for at most")
+    parser.add_argument('--new-trees', type=int, default=20, help="Trees added to the random forest")
+    parser.add_argument('--max-trees', type=int, default=500, help="Trees the random forest keeps, newest first")
+    parser.add_argument('--search', choices=['grid', 'halving'], default='halving', help="Search mode of a full search")
+    parser.add_argument('--no-full-search', action='store_true',
+                        help="Only report drift or an accuracy drop instead of running the full search")
+    parser.add_argument('--model-folder', default=os.getenv('MODEL_FOLDER', os.path.join(base_path, '..', 'models')),
+                        help="Model folder to update")
+    args = parser.parse_args()
+
+    bundle = load_bundle(args.model_folder, mmap_mode=None)
+    X, y = read_cases(args.new_cases)
+    holdout = int(round(len(y) * args.holdout))
+    if holdout < 1 or len(y) - holdout < 1 or len(np.unique(y[:len(y) - holdout])) < 2:
+        sys.exit(f"{args.new_cases} needs cases of both outcomes to train on and at least one to hold out")
+    print(f"{len(y)} new cases, the newest {holdout} held out for validation")
+
+    # Drift of the inputs and accuracy of the current models on the new cases
+    psi, drifted, drops = retraining_triggers(bundle, X, y, args.drift_threshold, args.max_accuracy_drop)
+    print("Feature PSI: " + ", ".join(f"{name} {value:.3f}" for name, value in psi.items()))
+
+    if drifted or drops:
+        for name, value in drifted.items():
+            print(f"Drift: {name} PSI {value:.3f} > {args.drift_threshold}")
+        for model_name, drop in drops.items():
+            print(f"Accuracy drop: {model_name} is {drop:.3f} below its test accuracy on the new cases")
+        if args.no_full_search:
+            return
+        record_cases(X, y)
+        print(f"Retraining every model with a full {args.search} search")
+        subprocess.run([sys.executable, os.path.join(base_path, "ml_model.py"), "--search", args.search], check=True)
+        return
+
+    X_train, y_train = X[:len(y) - holdout], y[:len(y) - holdout]
+    X_window, y_window = X[len(y) - holdout:], y[len(y) - holdout:]
+
+    # Fold the new rows into the scaler and adapt every model trained on scaled rows to it
+    old_scaler = copy.deepcopy(bundle.scaler)
+    update_scaler(bundle.scaler, X_train)
+    X_history, y_history = training_history()
+    for model_name, model in bundle.models.items():
+        if bundle.input_spaces[model_name] == "scaled":
+            rescale_model(model, old_scaler, bundle.scaler, np.vstack([X_history, X]))
+            # It no longer matches the scaler ml_model.py fits, so ml_model.py must not keep it (see previous_model)
+            bundle.metrics.get(model_name, {}).pop("data_hash", None)
+
+    # Continue logistic regression on the training data and the new rows, grow the random forest on the new rows
+    X_continued, y_continued = np.vstack([X_history, X_train]), np.concatenate([y_history, y_train])
+    updates = {
+        "logistic_regression": lambda model: continue_logistic_regression(
+            model, bundle.model_input("logistic_regression", X_continued), y_continued, args.lr_max_iter
+        ),
+        "random_forest": lambda model: grow_forest(
+            model, bundle.model_input("random_forest", X_train), y_train, args.new_trees, args.max_trees
+        ),
+    }
+    for model_name, update in updates.items():
+        if model_name not in bundle.models:
+            continue
+        previous = copy.deepcopy(bundle.models[model_name])
+        previous_accuracy = model_accuracy(bundle, model_name, X_window, y_window)
+        update(bundle.models[model_name])
+
+        # Keep the update only if the model is not worse on the held-out window than before it
+        updated_accuracy = model_accuracy(bundle, model_name, X_window, y_window)
+        kept = updated_accuracy >= previous_accuracy
+        if not kept:
+            bundle.models[model_name] = previous
+        print(f"{model_name}: held-out accuracy {previous_accuracy:.3f} -> {updated_accuracy:.3f}, "
+              + ("updated" if kept else "update discarded"))
+        bundle.metrics[model_name] = {**bundle.metrics.get(model_name, {}), "incremental": {
+            "cases": int(len(y_train)),
+            "holdout_cases": int(holdout),
+            "holdout_accuracy_before": previous_accuracy,
+            "holdout_accuracy_after": updated_accuracy,
+            "updated": kept,
+        }}
+
+    bundle.created_at = None  # Stamped with the time of this save
+    content_hash = save_bundle(args.model_folder, bundle)
+    print(f"Model bundle {content_hash} saved successfully at {args.model_folder}")
+    record_cases(X, y)
+
+
+if __name__ == "__main__":
+    main()
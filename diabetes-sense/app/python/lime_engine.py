@@ -0,0 +1,428 @@
+import hashlib
+import threading
+import time
+
+import numpy as np
+import scipy.stats
+import sklearn.metrics
+from sklearn.linear_model import Ridge
+
+from telemetry import span
+
+# LIME explanations that share one perturbation neighbourhood across several models.
+# LimeTabularExplainer.explain_instance samples, discretizes and weights a fresh neighbourhood
+# for every model it explains. SharedLimeExplainer builds that neighbourhood and its kernel
+# weights once per input row, scores it with every model and fits one local surrogate per model.
+# With seed_from_input, the random state is derived from the row itself so the same input always gets
+# the same explanation, which keeps cached and freshly computed results identical.
+# In adaptive mode the neighbourhood is sampled in batches that double its size: each model's surrogate
+# is refitted from running weighted sums after every batch, and stops asking for more samples once its
+# weights and their ranking have stopped changing, or once the request's time budget has run out.
+# Doubling keeps the number of model calls low, as the forest's predict_proba has a high cost per call.
+
+# Options a request can set for LIME explanations, see parse_lime_options
+LIME_MODES = ["adaptive", "fixed"]
+MAX_TIME_BUDGET_MS = 10000
+
+
+class SurrogateExplanation:
+    """
+    The local surrogate fitted for one model, exposing the same as_list/as_map views as LIME's Explanation.
+    """
+
+    def __init__(self, feature_labels, local_exp, intercept, score, local_pred, samples, stability=None, stop_reason=None):
+        self.feature_labels = feature_labels
+        self.local_exp = local_exp  # List of (feature index, weight) sorted by decreasing absolute weight
+        self.intercept = intercept
+        self.score = score
+        self.local_pred = local_pred
+        self.samples = samples  # Neighbourhood samples the surrogate was fitted on
+        self.stability = stability  # Adaptive mode: 1 minus the relative change of the weights in the last batch
+        self.stop_reason = stop_reason  # Adaptive mode: "converged", "time_budget" or "max_samples"
+
+    def as_map(self):
+        """Return the explanation as a list of (feature index, weight) tuples."""
+        return list(self.local_exp)
+
+    def as_list(self):
+        """Return the explanation as a list of (feature label, weight) tuples, like LIME's as_list()."""
+        return [(self.feature_labels[index], weight) for index, weight in self.local_exp]
+
+
+class Neighbourhood:
+    """
+    The perturbed samples around one input row and their distance kernel weights.
+    """
+
+    def __init__(self, data, inverse, scaled_data, weights, feature_labels):
+        self.data = data  # Interpretable (binary when discretized) representation of the samples
+        self.inverse = inverse  # The same samples in the original feature space, passed to the models
+        self.scaled_data = scaled_data  # Representation the surrogate models are fitted on
+        self.weights = weights  # Kernel weights of each sample
+        self.feature_labels = feature_labels  # Human readable name of each interpretable feature
+
+
+class AdaptiveNeighbourhood:
+    """
+    A neighbourhood sampled in batches on demand and shared by the models explained on it: a model that
+    needs more samples than the others draws the next batch, which the others reuse if they need it too.
+    """
+
+    def __init__(self, explainer, data_row, random_state):
+        self.explainer = explainer
+        self.data_row = data_row
+        self.random_state = random_state
+        self.feature_labels = explainer.feature_labels(data_row)
+        self.origin = None  # The instance in the scaled interpretable space, which distances are measured from
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def batch(self, index):
+        """Return the index-th batch of samples as a Neighbourhood, sampling it and any before it if needed."""
+        with self.lock:
+            while len(self.batches) <= index:
+                first = not self.batches
+                size = self.batch_size()
+                with span("lime_sampling"):
+                    data, inverse = self.explainer.sample(self.data_row, size, self.random_state, include_instance=first)
+                    if first:
+                        self.origin = self.explainer.scale_samples(data[:1])[0]
+                    self.batches.append(self.explainer.weigh_samples(data, inverse, self.origin, self.feature_labels))
+            return self.batches[index]
+
+    def batch_size(self):
+        """The size of the next batch: initial_samples first, then as many samples as drawn so far, up to num_samples in total."""
+        drawn = sum(len(batch.weights) for batch in self.batches)
+        if not drawn:
+            return self.explainer.initial_samples
+        return min(drawn, self.explainer.num_samples - drawn)
+
+
+class IncrementalRidge:
+    """
+    Weighted ridge regression with an intercept, like scikit-learn's Ridge, refitted from running weighted
+    sums of the samples (sum of weights, of weighted features and targets, and of their cross products),
+    so adding a batch costs a small solve instead of a refit on every sample seen so far.
+    """
+
+    def __init__(self, num_features, alpha=1.0):
+        self.alpha = alpha
+        self.sum_w = 0.0
+        self.sum_wx = np.zeros(num_features)
+        self.sum_wy = 0.0
+        self.sum_wxx = np.zeros((num_features, num_features))
+        self.sum_wxy = np.zeros(num_features)
+        self.sum_wyy = 0.0
+
+    def update(self, X, y, weights):
+        """Add a batch of samples X with targets y and sample weights."""
+        weighted_x = X * weights[:, np.newaxis]
+        self.sum_w += weights.sum()
+        self.sum_wx += weighted_x.sum(axis=0)
+        self.sum_wy += weights @ y
+        self.sum_wxx += weighted_x.T @ X
+        self.sum_wxy += weighted_x.T @ y
+        self.sum_wyy += weights @ (y * y)
+
+    def fit(self):
+        """
+        Solve for the coefficients on all samples added so far.
+        Returns (coefficients, intercept, weighted R^2 score on those samples).
+        """
+        mean_x = self.sum_wx / self.sum_w
+        mean_y = self.sum_wy / self.sum_w
+        # Weighted scatter matrices of the centred samples, as Ridge centres the data to fit the intercept
+        xx = self.sum_wxx - self.sum_w * np.outer(mean_x, mean_x)
+        xy = self.sum_wxy - self.sum_w * mean_x * mean_y
+        yy = self.sum_wyy - self.sum_w * mean_y * mean_y
+        coef = np.linalg.solve(xx + self.alpha * np.eye(len(xy)), xy)
+        intercept = mean_y - mean_x @ coef
+        residual = yy - 2 * coef @ xy + coef @ xx @ coef
+        score = 1 - residual / yy if yy > 0 else 0.0
+        return coef, float(intercept), float(score)
+
+
+def weight_change(previous, current):
+    """The largest change of a surrogate weight between two fits, relative to the largest current weight."""
+    scale = max(np.abs(current).max(), 1e-12)
+    return float(np.abs(current - previous).max() / scale)
+
+
+def ranking_changed(previous, current, tolerance):
+    """
+    Check whether two features swapped places in the ranking by absolute weight between two fits.
+    Features whose absolute weights are within tolerance (relative to the largest weight) of each other
+    count as tied, so they may swap without the ranking counting as changed.
+    """
+    gaps = []
+    for weights in (np.abs(previous), np.abs(current)):
+        gap = weights[:, np.newaxis] - weights[np.newaxis, :]
+        gap[np.abs(gap) <= tolerance * max(weights.max(), 1e-12)] = 0
+        gaps.append(np.sign(gap))
+    return bool((gaps[0] * gaps[1] < 0).any())
+
+
+def parse_lime_options(data, default_mode="adaptive", default_time_budget_ms=500):
+    """
+    Read and validate the LIME options of a request: "lime_mode" (adaptive or fixed) and
+    "lime_time_budget_ms", the time adaptive explanations may take before using the samples drawn so far.
+    Raises ValueError with a user facing message when an option is invalid.
+    """
+    lime_mode = data.get('lime_mode', default_mode)
+    if lime_mode not in LIME_MODES:
+        raise ValueError(f"Unknown lime_mode '{lime_mode}', expected one of {LIME_MODES}")
+
+    time_budget_ms = data.get('lime_time_budget_ms', default_time_budget_ms)
+    if isinstance(time_budget_ms, bool) or not isinstance(time_budget_ms, (int, float)) or not 0 < time_budget_ms <= MAX_TIME_BUDGET_MS:
+        raise ValueError(f"'lime_time_budget_ms' must be a number between 0 and {MAX_TIME_BUDGET_MS}")
+    return {"lime_mode": lime_mode, "lime_time_budget_ms": time_budget_ms}
+
+
+class SharedLimeExplainer:
+    """
+    Explain one input row for several models from a single LIME neighbourhood.
+    Wraps a configured LimeTabularExplainer and reuses its discretizer, sampling statistics,
+    kernel and feature selection so the explanations match what explain_instance would produce.
+    Adaptive explanations start from initial_samples samples and double them with every batch, up to
+    num_samples, until the weights changed by at most tolerance (relative to the largest weight) without
+    the ranking changing, for patience batches in a row.
+    """
+
+    def __init__(self, explainer, num_samples=5000, seed_from_input=False,
+                 initial_samples=500, tolerance=0.1, patience=1):
+        self.explainer = explainer
+        self.num_samples = num_samples
+        self.seed_from_input = seed_from_input
+        self.initial_samples = initial_samples
+        self.tolerance = tolerance
+        self.patience = patience
+
+    @staticmethod
+    def seed_for_row(data_row):
+        """Derive a reproducible 32-bit seed from the values of data_row."""
+        digest = hashlib.sha256(np.ascontiguousarray(data_row, dtype=np.float64).tobytes()).digest()
+        return int.from_bytes(digest[:4], 'little')
+
+    def random_state_for(self, data_row):
+        """Return the random state to sample the neighbourhood of data_row with."""
+        if self.seed_from_input:
+            return np.random.RandomState(self.seed_for_row(data_row))
+        return self.explainer.random_state
+
+    def undiscretize(self, data, random_state):
+        """
+        Map discretized bins back to feature values, like the discretizer's undiscretize
+        but drawing from the given random state instead of the discretizer's own.
+        """
+        discretizer = self.explainer.discretizer
+        ret = data.copy()
+        for feature in discretizer.means:
+            values = ret[:, feature].astype(int)
+            mins = np.array(discretizer.mins[feature])[values]
+            maxs = np.array(discretizer.maxs[feature])[values]
+            means = np.array(discretizer.means[feature])[values]
+            stds = np.array(discretizer.stds[feature])[values]
+            minz = (mins - means) / stds
+            maxz = (maxs - means) / stds
+            min_max_unequal = (minz != maxz)
+
+            column = minz
+            column[min_max_unequal] = scipy.stats.truncnorm.rvs(
+                minz[min_max_unequal], maxz[min_max_unequal],
+                loc=means[min_max_unequal], scale=stds[min_max_unequal],
+                random_state=random_state
+            )
+            ret[:, feature] = column
+        return ret
+
+    def sample(self, data_row, num_samples, random_state, include_instance=True):
+        """
+        Generate the perturbation neighbourhood around data_row.
+        Mirrors LimeTabularExplainer's sampling for dense rows: discretized features are drawn
+        from the training bin frequencies, continuous ones from a normal around the training mean.
+        Returns a tuple (data, inverse) whose first row is the original instance, unless include_instance
+        is False (the later batches of an adaptive neighbourhood).
+        """
+        explainer = self.explainer
+        num_cols = data_row.shape[0]
+        first = 1 if include_instance else 0  # Index of the first perturbed row
+
+        if explainer.discretizer is None:
+            # Perturb continuous features around the training mean (or the instance)
+            centre = data_row if explainer.sample_around_instance else explainer.scaler.mean_
+            data = random_state.normal(0, 1, num_samples * num_cols).reshape(num_samples, num_cols)
+            data = data * explainer.scaler.scale_ + centre
+            first_row = data_row
+        else:
+            data = np.zeros((num_samples, num_cols))
+            first_row = explainer.discretizer.discretize(data_row)
+
+        if include_instance:
+            data[0] = data_row.copy()
+        inverse = data.copy()
+        for column in explainer.categorical_features:
+            # Sample each categorical (or discretized) column from its training distribution
+            values = explainer.feature_values[column]
+            freqs = explainer.feature_frequencies[column]
+            inverse_column = random_state.choice(values, size=num_samples, replace=True, p=freqs)
+            binary_column = (inverse_column == first_row[column]).astype(int)
+            if include_instance:
+                binary_column[0] = 1
+                inverse_column[0] = data[0, column]
+            data[:, column] = binary_column
+            inverse[:, column] = inverse_column
+
+        if explainer.discretizer is not None:
+            inverse[first:] = self.undiscretize(inverse[first:], random_state)
+        if include_instance:
+            inverse[0] = data_row
+        return data, inverse
+
+    def feature_labels(self, data_row):
+        """
+        Return the label of each interpretable feature, e.g. "Glucose > 140.00" when discretized.
+        """
+        explainer = self.explainer
+        labels = list(explainer.feature_names)
+        if explainer.discretizer is not None:
+            discretized_row = explainer.discretizer.discretize(data_row)
+            for feature in explainer.discretizer.names:
+                labels[feature] = explainer.discretizer.names[feature][int(discretized_row[feature])]
+        return labels
+
+    def scale_samples(self, data):
+        """Scale interpretable samples like LIME's scaler, the space distances and surrogates are computed in."""
+        return (data - self.explainer.scaler.mean_) / self.explainer.scaler.scale_
+
+    def weigh_samples(self, data, inverse, origin, feature_labels):
+        """Scale samples and weigh them by the kernel of their distance to origin, the scaled instance."""
+        scaled_data = self.scale_samples(data)
+        distances = sklearn.metrics.pairwise_distances(
+            scaled_data, origin.reshape(1, -1), metric='euclidean'
+        ).ravel()
+        weights = self.explainer.base.kernel_fn(distances)
+        return Neighbourhood(data, inverse, scaled_data, weights, feature_labels)
+
+    def build_neighbourhood(self, data_row, num_samples=None):
+        """
+        Sample the neighbourhood of data_row and compute its distance kernel weights once.
+        """
+        data_row = np.asarray(data_row, dtype=float)
+        data, inverse = self.sample(data_row, num_samples or self.num_samples, self.random_state_for(data_row))
+
+        # Distances are measured in LIME's scaled interpretable space, as in explain_instance
+        scaled_instance = self.scale_samples(data[:1])[0]
+        return self.weigh_samples(data, inverse, scaled_instance, self.feature_labels(data_row))
+
+    def build_adaptive_neighbourhood(self, data_row):
+        """Return a neighbourhood of data_row that adaptive explanations sample in batches as they need them."""
+        data_row = np.asarray(data_row, dtype=float)
+        neighbourhood = AdaptiveNeighbourhood(self, data_row, self.random_state_for(data_row))
+        neighbourhood.batch(0)
+        return neighbourhood
+
+    def fit_surrogate(self, neighbourhood, probabilities, num_features, label=1):
+        """
+        Fit the weighted ridge surrogate for one model's predictions on the neighbourhood.
+        """
+        explainer = self.explainer
+        labels_column = probabilities[:, label]
+        used_features = explainer.base.feature_selection(
+            neighbourhood.scaled_data, labels_column, neighbourhood.weights,
+            num_features, explainer.feature_selection
+        )
+
+        surrogate = Ridge(alpha=1, fit_intercept=True, random_state=explainer.random_state)
+        surrogate.fit(neighbourhood.scaled_data[:, used_features], labels_column, sample_weight=neighbourhood.weights)
+        score = surrogate.score(
+            neighbourhood.scaled_data[:, used_features], labels_column, sample_weight=neighbourhood.weights
+        )
+        local_pred = surrogate.predict(neighbourhood.scaled_data[0, used_features].reshape(1, -1))
+
+        local_exp = sorted(zip(used_features, surrogate.coef_), key=lambda x: np.abs(x[1]), reverse=True)
+        return SurrogateExplanation(
+            neighbourhood.feature_labels, local_exp, surrogate.intercept_, score, local_pred, len(labels_column)
+        )
+
+    def explain(self, data_row, predict_fns, num_features=10, label=1, adaptive=False, deadline=None):
+        """
+        Explain data_row for every model in predict_fns, a dictionary mapping a model name to a
+        function that takes a matrix of rows in the original feature space and returns probabilities.
+        With adaptive, the neighbourhood is grown until each model's surrogate converges or the
+        time.perf_counter() deadline passes.
+        Returns a dictionary mapping each model name to its SurrogateExplanation.
+        """
+        if adaptive:
+            neighbourhood = self.build_adaptive_neighbourhood(data_row)
+            return {
+                model_name: self.explain_model_adaptive(neighbourhood, model_name, predict_fn, num_features, label, deadline)
+                for model_name, predict_fn in predict_fns.items()
+            }
+
+        with span("lime_sampling"):
+            neighbourhood = self.build_neighbourhood(data_row)
+
+        return {
+            model_name: self.explain_model(neighbourhood, model_name, predict_fn, num_features, label)
+            for model_name, predict_fn in predict_fns.items()
+        }
+
+    def explain_model(self, neighbourhood, model_name, predict_fn, num_features=10, label=1):
+        """
+        Score a neighbourhood built by build_neighbourhood with one model and fit its surrogate.
+        Models can be explained on the same neighbourhood concurrently.
+        """
+        with span("lime_inference", model_name):
+            probabilities = predict_fn(neighbourhood.inverse)
+        with span("lime_surrogate", model_name):
+            return self.fit_surrogate(neighbourhood, probabilities, num_features, label)
+
+    def explain_model_adaptive(self, neighbourhood, model_name, predict_fn, num_features=10, label=1, deadline=None):
+        """
+        Explain one model on an adaptive neighbourhood built by build_adaptive_neighbourhood, scoring one batch
+        of samples at a time and refitting the ridge surrogate from its running sums after each batch.
+        Stops once the weights and their ranking have been stable for patience batches in a row, once
+        num_samples samples were used, or once the time.perf_counter() deadline has passed.
+        The surrogate is fitted on every interpretable feature and the num_features largest weights are kept.
+        Models can be explained on the same neighbourhood concurrently.
+        """
+        surrogate = IncrementalRidge(len(neighbourhood.feature_labels))
+        previous = None
+        change = None
+        stable_batches = 0
+        samples = 0
+        index = 0
+        while True:
+            batch = neighbourhood.batch(index)
+            with span("lime_inference", model_name):
+                probabilities = predict_fn(batch.inverse)
+            with span("lime_surrogate", model_name):
+                surrogate.update(batch.scaled_data, probabilities[:, label], batch.weights)
+                coef, intercept, score = surrogate.fit()
+            samples += len(batch.weights)
+
+            if previous is not None:
+                change = weight_change(previous, coef)
+                if change <= self.tolerance and not ranking_changed(previous, coef, self.tolerance):
+                    stable_batches += 1
+                else:
+                    stable_batches = 0
+            previous = coef
+
+            if stable_batches >= self.patience:
+                stop_reason = "converged"
+            elif samples >= self.num_samples:
+                stop_reason = "max_samples"
+            elif deadline is not None and time.perf_counter() >= deadline:
+                stop_reason = "time_budget"
+            else:
+                index += 1
+                continue
+            break
+
+        local_exp = sorted(enumerate(coef), key=lambda x: np.abs(x[1]), reverse=True)[:num_features]
+        local_pred = np.array([intercept + neighbourhood.origin @ coef])
+        stability = max(0.0, 1 - change) if change is not None else 0.0
+        return SurrogateExplanation(
+            neighbourhood.feature_labels, local_exp, intercept, score, local_pred, samples, stability, stop_reason
+        )
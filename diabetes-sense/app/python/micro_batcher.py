@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from telemetry import MICRO_BATCH_QUEUE_DEPTH, MICRO_BATCH_QUEUE_SECONDS, MICRO_BATCH_REJECTED, MICRO_BATCH_ROWS, start_trace
+
+# Request coalescing for single-patient predictions.
+# Concurrent /predict requests each need a one-row predict_proba per model, and for such small inputs the
+# per-call overhead dominates. A MicroBatcher queues the rows of concurrent requests for a short window
+# (or until max_batch_size rows are waiting), scores them with one batched call per group of rows that
+# share a key (the model version and the selected models), and hands every request its own row of the
+# results. A full queue rejects new rows straight away, so a busy worker sheds load instead of queueing
+# requests it cannot answer in time.
+
+
+class QueueFull(RuntimeError):
+    """Raised when a row is submitted while max_queue_depth rows are already waiting."""
+
+
+class MicroBatcher:
+    """
+    Coalesces single rows submitted by concurrent threads into batched calls of score_fn(key, matrix),
+    which must return one result per row of the matrix. Rows are dispatched by one background thread,
+    started on the first submission.
+    """
+
+    def __init__(self, score_fn, window_seconds=0.002, max_batch_size=64, max_queue_depth=1024):
+        self.score_fn = score_fn
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.max_queue_depth = max_queue_depth
+        self.reset()
+
+    def reset(self):
+        """Start with an empty queue and no dispatcher thread, e.g. in a process forked from a running server."""
+        self.condition = threading.Condition()
+        self.pending = deque()  # (key, row, future, time queued), oldest first
+        self.thread = None
+
+    def submit(self, key, row):
+        """
+        Queue one row to be scored with the other rows of the same key and return the Future of its result.
+        Raises QueueFull when max_queue_depth rows are already waiting.
+        """
+        future = Future()
+        with self.condition:
+            if len(self.pending) >= self.max_queue_depth:
+                MICRO_BATCH_REJECTED.inc()
+                raise QueueFull(f"Prediction queue is full ({self.max_queue_depth} rows waiting)")
+            self.pending.append((key, row, future, time.perf_counter()))
+            MICRO_BATCH_QUEUE_DEPTH.set(len(self.pending))
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.dispatch_forever, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return future
+
+    def score(self, key, row):
+        """Score one row with the rows other threads submit meanwhile and return its result."""
+        return self.submit(key, row).result()
+
+    def next_batch(self):
+        """
+        Wait until the oldest waiting row has waited window_seconds or max_batch_size rows are waiting,
+        then take up to max_batch_size rows off the queue.
+        """
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            deadline = self.pending[0][3] + self.window_seconds
+            while len(self.pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = [self.pending.popleft() for _ in range(min(self.max_batch_size, len(self.pending)))]
+            MICRO_BATCH_QUEUE_DEPTH.set(len(self.pending))
+            return batch
+
+    def dispatch_forever(self):
+        while True:
+            batch = self.next_batch()
+            # Spans of the batched inference are recorded under their own endpoint label, one trace per batch
+            start_trace("micro_batch")
+            self.dispatch(batch)
+
+    def dispatch(self, batch):
+        """Score a batch of queued rows, one score_fn call per key, and resolve their futures."""
+        dispatched = time.perf_counter()
+        groups = {}
+        for key, row, future, queued in batch:
+            MICRO_BATCH_QUEUE_SECONDS.observe(dispatched - queued)
+            groups.setdefault(key, []).append((row, future))
+
+        for key, items in groups.items():
+            MICRO_BATCH_ROWS.observe(len(items))
+            try:
+                results = self.score_fn(key, np.vstack([row for row, _ in items]))
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(items, results):
+                future.set_result(result)
@@ -2,31 +2,48 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import joblib
-from sklearn.model_selection import train_test_split, GridSearchCV, StratifiedKFold, cross_val_score
+from sklearn.model_selection import train_test_split
 from sklearn import metrics
-from sklearn.metrics import accuracy_score, classification_report
+from sklearn.metrics import accuracy_score, classification_report, f1_score, precision_score, recall_score
 from sklearn.preprocessing import StandardScaler
 
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.ensemble import VotingClassifier
 
 from lime.lime_tabular import LimeTabularExplainer
 import warnings
 import os
+import argparse
+
+from search import SEARCH_MODES, SearchBudget, SearchData, SearchReport, SuccessiveHalvingSearch
+from explainer_stats import compute_training_stats
+from model_bundle import ENSEMBLE_NAME, ModelBundle, load_bundle, save_bundle
+from schema import FEATURES, TARGET
+from dataset_store import load_dataset, source_path
 
 # Suppress all warnings
 warnings.filterwarnings('ignore')
 
+### COMMAND LINE OPTIONS
+parser = argparse.ArgumentParser(description="Train the diabetes prediction models.")
+parser.add_argument('--search', choices=SEARCH_MODES, default='grid',
+                    help="'grid' evaluates every candidate fully, 'halving' uses successive halving")
+parser.add_argument('--max-seconds', type=float, default=None, help="Wall-clock budget for the whole search")
+parser.add_argument('--max-fits', type=int, default=None, help="Maximum number of model fits for the whole search")
+args = parser.parse_args()
+
 ### IMPORTING PREPROCESSED DATA
 base_path = os.path.dirname(os.path.abspath(__file__))  # Get the directory of the current script
-data_path = os.path.join(base_path, "../data/balanced_pima.csv")  # Adjust path relative to script
-data = pd.read_csv(data_path)
+X, y = load_dataset("balanced")  # Features and target, memory-mapped from the dataset store
+
+# Labelled clinic cases collected by incremental_training.py are trained on as well
+if os.path.exists(source_path("clinic")):
+    X_clinic, y_clinic = load_dataset("clinic")
+    X, y = np.concatenate([X, X_clinic]), np.concatenate([y, y_clinic])
 
 ### Splitting the data into training and testing sets (80% training, 20% testing)
-X = data[['Pregnancies', 'Glucose', 'BloodPressure', 'SkinThickness', 'Insulin', 'BMI', 'DiabetesPedigreeFunction', 'Age']]  # Features
-y = data['Outcome']  # Target variable
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
 
 ### Standardizing the data
@@ -56,70 +73,150 @@ param_grid_gmb = {
 }
 
 # Define Stratified K-Fold Cross-Validation
-cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
+# The folds and the scaled training matrix are computed once and shared by all three model families
+search_data = SearchData(X_train_scaled, y_train, n_splits=5, shuffle=True, random_state=42)
+
+# Evaluations are recorded per data hash, so retraining on the same data skips candidates already evaluated
+search_report = SearchReport(os.path.join(base_path, "../models/search_report.json"))
+search_budget = SearchBudget(max_seconds=args.max_seconds, max_fits=args.max_fits)
+
+def run_search(name, label, estimator, param_grid):
+    """
+    Search the parameter grid of one model family, then report its cross-validation and test accuracy.
+    Returns the best model refitted on the full training data, its mean cross-validation accuracy and its
+    metrics, or (None, None, None) when the search budget ran out before any candidate was evaluated.
+    """
+    search = SuccessiveHalvingSearch(name, estimator, param_grid, mode=args.search)
+    result = search.run(search_data, budget=search_budget, report=search_report)
+    search_report.save()
+
+    if result["best_params"] is None:
+        print(f"{label}: search budget exhausted before any candidate was evaluated, keeping the saved model")
+        return None, None, None
+
+    best_model = result["best_estimator"]
+    cv_scores = np.array(result["cv_scores"])
+    print(f"{label} Cross-Validation Accuracy: {cv_scores.mean():.2f} ± {cv_scores.std():.2f}")
+    if result["budget_exhausted"]:
+        print(f"{label}: search budget exhausted after {result['rungs'][-1]['resource'] or 'full'} resource")
+    y_pred = best_model.predict(X_test_scaled)
+    print(f"{label} Model (Best Parameters: {result['best_params']})")
+    print(f"Accuracy: {accuracy_score(y_test, y_pred):.2f}")
+    print("\nClassification Report:\n", classification_report(y_test, y_pred))
+
+    metrics = {
+        "best_params": result["best_params"],
+        "cv_accuracy_mean": float(cv_scores.mean()),
+        "cv_accuracy_std": float(cv_scores.std()),
+        "test_accuracy": float(accuracy_score(y_test, y_pred)),
+        "test_precision": float(precision_score(y_test, y_pred)),
+        "test_recall": float(recall_score(y_test, y_pred)),
+        "test_f1": float(f1_score(y_test, y_pred)),
+        "data_hash": search_data.data_hash,  # The scaled training data, see previous_model
+    }
+    return best_model, cv_scores.mean(), metrics
 
 # Logistic Regression with Cross-Validation
-grid_search_lr = GridSearchCV(LogisticRegression(max_iter=500), param_grid_lr, cv=cv, scoring='accuracy')
-grid_search_lr.fit(X_train_scaled, y_train)
-best_lr = grid_search_lr.best_estimator_
-cv_scores_lr = cross_val_score(best_lr, X_train_scaled, y_train, cv=cv, scoring='accuracy')
-print(f"Logistic Regression Cross-Validation Accuracy: {cv_scores_lr.mean():.2f} ± {cv_scores_lr.std():.2f}")
-y_pred_lr = best_lr.predict(X_test_scaled)
-accuracy_lr = accuracy_score(y_test, y_pred_lr)
-classification_rep_lr = classification_report(y_test, y_pred_lr)
-print(f"Logistic Regression Model (Best Parameters: {grid_search_lr.best_params_})")
-print(f"Accuracy: {accuracy_lr:.2f}")
-print("\nClassification Report:\n", classification_rep_lr)
+best_lr, accuracy_lr, metrics_lr = run_search("logistic_regression", "Logistic Regression", LogisticRegression(max_iter=500), param_grid_lr)
 
 # Random Forest with Cross-Validation
-grid_search_rf = GridSearchCV(RandomForestClassifier(), param_grid_rf, cv=cv, scoring='accuracy')
-grid_search_rf.fit(X_train_scaled, y_train)  # Use scaled data for consistency
-best_rf = grid_search_rf.best_estimator_
-cv_scores_rf = cross_val_score(best_rf, X_train_scaled, y_train, cv=cv, scoring='accuracy')
-print(f"Random Forest Cross-Validation Accuracy: {cv_scores_rf.mean():.2f} ± {cv_scores_rf.std():.2f}")
-y_pred_rf = best_rf.predict(X_test_scaled)
-accuracy_rf = accuracy_score(y_test, y_pred_rf)
-classification_rep_rf = classification_report(y_test, y_pred_rf)
-print(f"Random Forest Model (Best Parameters: {grid_search_rf.best_params_})")
-print(f"Accuracy: {accuracy_rf:.2f}")
-print("\nClassification Report:\n", classification_rep_rf)
+best_rf, accuracy_rf, metrics_rf = run_search("random_forest", "Random Forest", RandomForestClassifier(), param_grid_rf)
 
 # Gradient Boosting with Early Stopping
-grid_search_gmb = GridSearchCV(
+best_gmb, accuracy_gmb, metrics_gmb = run_search(
+    "gradient_boosting", "Gradient Boosting",
     GradientBoostingClassifier(n_iter_no_change=10, validation_fraction=0.1),  # Early stopping
-    param_grid_gmb, cv=cv, scoring='accuracy'
+    param_grid_gmb
 )
-grid_search_gmb.fit(X_train_scaled, y_train)
-best_gmb = grid_search_gmb.best_estimator_
-cv_scores_gmb = cross_val_score(best_gmb, X_train_scaled, y_train, cv=cv, scoring='accuracy')
-print(f"Gradient Boosting Cross-Validation Accuracy: {cv_scores_gmb.mean():.2f} ± {cv_scores_gmb.std():.2f}")
-y_pred_gmb = best_gmb.predict(X_test_scaled)
-accuracy_gmb = accuracy_score(y_test, y_pred_gmb)
-classification_rep_gmb = classification_report(y_test, y_pred_gmb)
-print(f"Gradient Boosting Model (Best Parameters: {grid_search_gmb.best_params_})")
-print(f"Accuracy: {accuracy_gmb:.2f}")
-print("\nClassification Report:\n", classification_rep_gmb)
-
-# Save the scaler
-scaler_filename = os.path.join(base_path, "../models/scaler.pkl")
-joblib.dump(scaler, scaler_filename)
-print(f"Scaler saved successfully at {scaler_filename}")
-
-# Save the test data for evaluation
-test_data = pd.concat([X_test, y_test], axis=1)
-test_data_path = os.path.join(base_path, "../data/test_data.csv")
-test_data.to_csv(test_data_path, index=False)
-print(f"Test data saved successfully at {test_data_path}")
-
-# Save the best models and their accuracies
-models = [best_lr, best_rf, best_gmb]
-model_names = ["logistic_regression.pkl", "random_forest.pkl", "gradient_boosting.pkl"]
-accuracies = [cv_scores_lr.mean(), cv_scores_rf.mean(), cv_scores_gmb.mean()]
 
+# Save the best models, the scaler, the explainer's training statistics and the metrics as one bundle
+# All three models are trained on the scaled training matrix
 model_folder = os.path.join(base_path, "../models")
-
-# Save each model and its accuracy
-for each, name, accuracy in zip(models, model_names, accuracies):
-    model_path = os.path.join(model_folder, name)
-    joblib.dump((each, accuracy), model_path)
-    print(f"{name} saved successfully at {model_folder} with accuracy {accuracy:.2f}")
\ No newline at end of file
+previous_bundle = None
+
+def previous_model(name):
+    """
+    Return the previously saved model of a family that was not trained within the search budget, with its
+    accuracy, metrics and input space. The bundle has one scaler, fitted on this run's training data, so a
+    model trained on scaled rows is only kept if it was trained on the same scaled data.
+    Exits with an error when there is no previous model or it cannot be kept.
+    """
+    global previous_bundle
+    if previous_bundle is None:
+        try:
+            previous_bundle = load_bundle(model_folder, mmap_mode=None)
+        except FileNotFoundError:
+            raise SystemExit(f"{name} was not trained within the search budget and {model_folder} has no previous "
+                             "models to keep instead; run again with a larger --max-seconds / --max-fits")
+    if name not in previous_bundle.models:
+        raise SystemExit(f"{name} was not trained within the search budget and the previous "
+                         f"{previous_bundle.source} artifacts have no {name} to keep instead")
+    input_space = previous_bundle.input_spaces[name]
+    metrics = previous_bundle.metrics.get(name, {})
+    if input_space == "scaled" and metrics.get("data_hash") != search_data.data_hash:
+        raise SystemExit(f"{name} was not trained within the search budget and the previous one was trained on "
+                         "different data, so it cannot be served with this run's scaler; run again with a larger "
+                         "--max-seconds / --max-fits")
+    print(f"{name} kept from the previous {previous_bundle.source} artifacts")
+    return previous_bundle.models[name], previous_bundle.accuracies[name], metrics, input_space
+
+bundle = ModelBundle(
+    models={}, accuracies={}, scaler=scaler, input_spaces={},
+    features=FEATURES, target=TARGET,
+    # The LIME explainer's training statistics, computed from the same data the server explains against
+    explainer_stats=compute_training_stats(X, FEATURES),
+)
+trained = {
+    "logistic_regression": (best_lr, accuracy_lr, metrics_lr),
+    "random_forest": (best_rf, accuracy_rf, metrics_rf),
+    "gradient_boosting": (best_gmb, accuracy_gmb, metrics_gmb),
+}
+for name, (each, accuracy, metrics) in trained.items():
+    if each is None:
+        # Not trained within the search budget: keep the previously saved model, in its own input space
+        each, accuracy, metrics, bundle.input_spaces[name] = previous_model(name)
+    else:
+        bundle.input_spaces[name] = "scaled"
+    bundle.models[name] = each
+    bundle.accuracies[name] = accuracy
+    bundle.metrics[name] = metrics
+
+# Soft voting ensemble of the three models, the last stage of the cascade serving mode (see cascade.py)
+# It refits the tuned models on the training data, so it is only rebuilt when all three were trained now
+if all(each is not None for each, _, _ in trained.values()):
+    voting = VotingClassifier(
+        estimators=[(name, each) for name, (each, _, _) in trained.items()], voting='soft'
+    ).fit(X_train_scaled, y_train)
+    y_pred = voting.predict(X_test_scaled)
+    print(f"Voting Ensemble Accuracy: {accuracy_score(y_test, y_pred):.2f}")
+    bundle.models[ENSEMBLE_NAME] = voting
+    bundle.input_spaces[ENSEMBLE_NAME] = "scaled"
+    # The ensemble is not cross-validated, its test accuracy is reported instead
+    bundle.accuracies[ENSEMBLE_NAME] = float(accuracy_score(y_test, y_pred))
+    bundle.metrics[ENSEMBLE_NAME] = {
+        "estimators": list(trained),
+        "test_accuracy": float(accuracy_score(y_test, y_pred)),
+        "test_precision": float(precision_score(y_test, y_pred)),
+        "test_recall": float(recall_score(y_test, y_pred)),
+        "test_f1": float(f1_score(y_test, y_pred)),
+        "data_hash": search_data.data_hash,
+    }
+elif previous_bundle is not None and ENSEMBLE_NAME in previous_bundle.models:
+    # The ensemble is optional, so without a previous one (or one trained on other data) the bundle has none
+    if previous_bundle.metrics.get(ENSEMBLE_NAME, {}).get("data_hash") == search_data.data_hash:
+        (bundle.models[ENSEMBLE_NAME], bundle.accuracies[ENSEMBLE_NAME], bundle.metrics[ENSEMBLE_NAME],
+         bundle.input_spaces[ENSEMBLE_NAME]) = previous_model(ENSEMBLE_NAME)
+    else:
+        print(f"{ENSEMBLE_NAME} not kept, the previous one was trained on different data")
+
+content_hash = save_bundle(model_folder, bundle)
+print(f"Model bundle {content_hash} saved successfully at {model_folder}: " + ", ".join(
+    f"{name} (accuracy {accuracy:.2f})" for name, accuracy in bundle.accuracies.items()
+))
+
+# Save the training and test data for evaluation, once the models they belong to are saved
+for name, (X_split, y_split) in {"train": (X_train, y_train), "test": (X_test, y_test)}.items():
+    split_data = pd.DataFrame(X_split, columns=FEATURES)
+    split_data[TARGET] = y_split
+    split_data.to_csv(source_path(name), index=False, float_format='%g')  # Shortest form of the float32 values
+    print(f"{name.capitalize()} data saved successfully at {source_path(name)}")
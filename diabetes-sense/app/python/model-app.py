@@ -1,218 +1,1097 @@
-# Import necessary libraries for the Flask app, machine learning, and data processing
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import joblib
-import numpy as np
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
-from lime.lime_tabular import LimeTabularExplainer
-import matplotlib
-matplotlib.use('Agg')  # Use the Agg backend for non-interactive plotting
-import matplotlib.pyplot as plt
-import base64
-from io import BytesIO
+# Import the libraries needed to start serving
+# Heavier libraries (pandas, LIME, the tuning search) are imported on first use by the endpoints that need them
 import os
-from sklearn.model_selection import GridSearchCV, cross_val_score
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Record the time spent in each startup phase, printed on start and returned by the /startup endpoint
+# Phases run lazily on the first request that needs them are recorded too, marked as lazy
+STARTUP_TIMINGS = {}
+startup_began = time.perf_counter()
+startup_seconds = None  # Set once the app is ready to serve
+
+@contextmanager
+def startup_phase(name):
+    """
+    Time the enclosed block and record it in STARTUP_TIMINGS under the given phase name.
+    Phases that run after startup, on the first request that needs them, are marked as lazy.
+    """
+    if startup_seconds is not None:
+        name = f"{name} (lazy)"
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = round(time.perf_counter() - began, 4)
+
+with startup_phase("imports"):
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from contextvars import copy_context
+    from functools import partial
+    import json
+    from flask import Flask, Response, g, request, jsonify, stream_with_context
+    from flask_cors import CORS
+    import numpy as np
+    from explainers import EXPLAINERS, build_explainer
+    from cascade import SERVING_MODES, cascade_path, load_cascade, resolve_stages, run_cascade
+    from charts import CHART_URL_PREFIX, DEFAULT_HEIGHT, DEFAULT_WIDTH, parse_chart_options, render_chart
+    from chart_store import CONTENT_TYPES, ChartStore, parse_chart_name
+    from rendering import ChartRenderer
+    from prediction_cache import PredictionCache
+    from model_registry import ModelRegistry, ModelSet
+    from compiled_trees import check_parity, compile_model
+    from explainer_stats import compute_training_stats, lime_training_data_stats
+    from lime_engine import parse_lime_options
+    from micro_batcher import MicroBatcher, QueueFull
+    from model_bundle import ENSEMBLE_NAME, load_bundle, watched_files
+    from schema import FEATURES
+    from telemetry import CASCADE_DECISIONS, end_trace, metrics_response, observe_request, register_cache, resume_trace, span, start_trace
 
 # Initialize the Flask app and enable CORS for cross-origin requests
 app = Flask(__name__)
 CORS(app)
 
+# "lazy" (default) defers the explainers, training data and tuning pool until a request needs them,
+# "eager" builds everything before serving, so the first requests do not pay for it
+STARTUP_MODE = os.getenv('STARTUP_MODE', 'lazy')
+
 # Define the folder where the models are stored
 model_folder = os.getenv('MODEL_FOLDER', os.path.join(os.path.dirname(__file__), '..', 'models'))
 
-# Load the machine learning models and their accuracies
-models = {}
-accuracies = {}
-model_names = ["logistic_regression.pkl", "random_forest.pkl", "gradient_boosting.pkl"]
+# Models are loaded with memory-mapped arrays by default, so workers share the pages of the model files
+# instead of each holding a private copy; set MODEL_MMAP=0 to load them fully into memory
+mmap_mode = 'r' if os.getenv('MODEL_MMAP', '1') != '0' else None
+
+# The tree ensembles are compiled into NumPy node arrays for fast small-batch predictions;
+# set COMPILED_TREES=0 to predict with the scikit-learn models directly
+use_compiled_trees = os.getenv('COMPILED_TREES', '1') != '0'
+
+def load_model_set(version, signature):
+    """
+    Load the model bundle (the models, their accuracies and input spaces, the scaler and the explainer
+    statistics) and the cascade stages into a new ModelSet. Bundles are versioned by their content hash;
+    a legacy folder of loose pickles keeps the given file-based version.
+    """
+    bundle = load_bundle(model_folder, mmap_mode=mmap_mode)
+    if bundle.features != FEATURES:
+        raise ValueError(f"Model bundle expects features {bundle.features}, not {FEATURES}")
+
+    # Predict with the compiled version of each tree ensemble; other models are used as they are
+    predictors = dict(bundle.models)
+    if use_compiled_trees:
+        for model_name, model in bundle.models.items():
+            compiled = compile_model(model)
+            if compiled is not None:
+                predictors[model_name] = compiled
+
+    return ModelSet(
+        bundle.content_hash or version, bundle.models, bundle.accuracies, bundle.scaler,
+        bundle.explainer_stats, signature, predictors, bundle.input_spaces,
+        cascade=resolve_stages(load_cascade(model_folder), bundle.models),
+    )
+
+def validate_model_set(model_set):
+    """
+    Check that a loaded ModelSet can serve predictions before it is swapped in.
+    Every model must accept the FEATURES columns and return valid binary probabilities for a probe row,
+    and every compiled model must match its scikit-learn model on a sample of rows around the training mean.
+    Raises ValueError otherwise.
+    """
+    if len(model_set.scaler.mean_) != len(FEATURES):
+        raise ValueError(f"Scaler expects {len(model_set.scaler.mean_)} features, not {len(FEATURES)}")
+
+    probe = model_set.scaler.mean_.reshape(1, -1)  # An average patient, in the original feature space
+    for model_name, model in model_set.models.items():
+        if getattr(model, "n_features_in_", len(FEATURES)) != len(FEATURES):
+            raise ValueError(f"Model '{model_name}' expects {model.n_features_in_} features, not {len(FEATURES)}")
+        if model.classes_.tolist() != [0, 1]:
+            raise ValueError(f"Model '{model_name}' has classes {model.classes_.tolist()}, expected [0, 1]")
+        probabilities = model.predict_proba(model_input(model_set, model_name, probe))
+        if probabilities.shape != (1, 2) or not np.allclose(probabilities.sum(axis=1), 1):
+            raise ValueError(f"Model '{model_name}' returned invalid probabilities {probabilities.tolist()}")
+
+        # Parity check of the compiled trees against scikit-learn, on rows spread around the training mean
+        predictor = model_set.predictors[model_name]
+        if predictor is not model:
+            random_state = np.random.RandomState(0)
+            sample = model_set.scaler.mean_ + model_set.scaler.scale_ * random_state.normal(size=(256, len(FEATURES)))
+            check_parity(predictor, model_input(model_set, model_name, sample))
+
+# Serve the models from a registry that swaps in retrained artifacts without a restart
+# The bundle (and legacy artifact) files and the cascade configuration are polled every MODEL_WATCH_INTERVAL
+# seconds (0 disables the watcher); POST /admin/reload forces a reload
+model_registry = ModelRegistry(
+    watched_files(model_folder) + [cascade_path(model_folder)], load_model_set, validate_model_set,
+    watch_interval=float(os.getenv('MODEL_WATCH_INTERVAL', 5)),
+)
+
+# Cache /predict results; the cache is cleared whenever a new model version is swapped in
+prediction_cache = PredictionCache(
+    max_size=int(os.getenv('PREDICT_CACHE_SIZE', 1024)),
+    ttl_seconds=float(os.getenv('PREDICT_CACHE_TTL', 3600)),
+    signature_fn=lambda: model_registry.version,
+)
+register_cache("predict", prediction_cache)  # Hit and miss counters are exported on /metrics
+
+# Rendered explanation images, served by /explanations/<name> and shared by the worker processes through
+# a folder on disk (CHART_STORE_DIR, empty to keep them in memory only)
+chart_store = ChartStore(
+    max_bytes=int(os.getenv('CHART_STORE_BYTES', 64 * 1024 * 1024)),
+    folder=os.getenv('CHART_STORE_DIR', os.path.join(tempfile.gettempdir(), 'diabetes-sense-charts')) or None,
+    max_disk_bytes=int(os.getenv('CHART_STORE_DISK_BYTES', 512 * 1024 * 1024)),
+)
+register_cache("charts", chart_store)
+
+# PNG charts are rendered on a pool of RENDER_WORKERS processes (0 renders in the request thread), each
+# starting with a template of the default explanation chart
+chart_renderer = ChartRenderer(
+    workers=int(os.getenv('RENDER_WORKERS', 2)),
+    templates=[(FEATURES, DEFAULT_WIDTH, DEFAULT_HEIGHT)],
+)
+
+# The single-row predictions of concurrent requests are scored together: rows wait up to PREDICT_BATCH_WINDOW_MS
+# (0, the default, scores every request on its own) or until PREDICT_BATCH_MAX_ROWS rows are queued, and
+# requests are answered 503 while PREDICT_QUEUE_DEPTH rows are already waiting
+batch_window_ms = float(os.getenv('PREDICT_BATCH_WINDOW_MS', 0))
+micro_batcher = MicroBatcher(
+    lambda key, matrix: score_rows(*key, matrix),
+    window_seconds=batch_window_ms / 1000,
+    max_batch_size=int(os.getenv('PREDICT_BATCH_MAX_ROWS', 64)),
+    max_queue_depth=int(os.getenv('PREDICT_QUEUE_DEPTH', 1024)),
+) if batch_window_ms > 0 else None
+
+# Objects built on first use, guarded by one lock so concurrent first requests build them only once
+lazy_lock = threading.RLock()
+training_data = None
+tuning_jobs = None
+explanation_pool = None
+
+# Explainer names a request can select; "auto" picks the fast exact explainer for each model type
+EXPLAINER_OPTIONS = ["auto", "lime"] + list(EXPLAINERS)
+
+# LIME samples its neighbourhood adaptively by default (LIME_MODE=fixed always draws 5000 samples), within
+# a budget of LIME_TIME_BUDGET_MS per explained row; requests can override both
+LIME_MODE = os.getenv('LIME_MODE', 'adaptive')
+LIME_TIME_BUDGET_MS = float(os.getenv('LIME_TIME_BUDGET_MS', 500))
+
+# /predict runs every selected model by default; PREDICT_MODE=cascade makes the cascade the default instead
+PREDICT_MODE = os.getenv('PREDICT_MODE', 'all')
+
+def get_training_data():
+    """
+    Return the training data as a tuple (features, labels), memory-mapped from the dataset store on first use.
+    Only /tune and a missing explainer statistics artifact need it.
+    """
+    global training_data
+    with lazy_lock:
+        if training_data is None:
+            with startup_phase("training_data"):
+                from dataset_store import load_dataset
+                training_data = load_dataset("balanced")
+        return training_data
+
+def get_explainer_stats(model_set):
+    """Return the explainer's training statistics, computing them from the training CSV if the artifact is missing."""
+    if model_set.explainer_stats is not None:
+        return model_set.explainer_stats
+
+    def compute():
+        with startup_phase("explainer_stats_from_csv"):
+            return compute_training_stats(get_training_data()[0], FEATURES)
+    return model_set.get_derived("explainer_stats", compute)
+
+def get_shared_explainer(model_set):
+    """
+    Return the shared LIME explainer of the given model version, building it from the precomputed
+    training statistics on first use. LIME only needs the real training rows for its statistics,
+    so a single row of feature minima and maxima stands in for the training matrix.
+    """
+    def build():
+        with startup_phase("lime_explainer"):
+            from lime.lime_tabular import LimeTabularExplainer
+            from lime_engine import SharedLimeExplainer
+
+            stats = get_explainer_stats(model_set)
+            training_data_stats = lime_training_data_stats(stats)
+            bounds = np.array([
+                [mins[0] for mins in stats["mins"]],
+                [maxs[-1] for maxs in stats["maxs"]],
+            ])
+            explainer = LimeTabularExplainer(
+                bounds, mode="classification", feature_names=FEATURES,
+                training_data_stats=training_data_stats,
+            )
+
+            # Share one perturbation neighbourhood per input row across all selected models
+            # LIME is seeded from the input row, so the same input always gets the same (cacheable) explanation
+            return SharedLimeExplainer(explainer, num_samples=5000, seed_from_input=True)
+    return model_set.get_derived("lime_explainer", build)
+
+def get_tuning_jobs():
+    """
+    Return the /tune job runner, creating it on first use.
+    Jobs run in the background on a bounded process pool (all cores by default), and evaluations are
+    recorded in the search report shared with ml_model.py, so they are not repeated on the same data.
+    """
+    global tuning_jobs
+    with lazy_lock:
+        if tuning_jobs is None:
+            with startup_phase("tuning"):
+                from tuning import TuningJobs
+                from search import SearchReport
+
+                tuning_jobs = TuningJobs(
+                    max_workers=int(os.getenv('TUNE_WORKERS', 0)) or None,
+                    max_active_jobs=int(os.getenv('TUNE_MAX_JOBS', 2)),
+                    max_finished_jobs=int(os.getenv('TUNE_MAX_FINISHED_JOBS', 100)),
+                    finished_ttl=float(os.getenv('TUNE_JOB_TTL', 24 * 3600)) or None,
+                    report=SearchReport(os.path.join(model_folder, 'search_report.json')),
+                )
+        return tuning_jobs
+
+def get_explanation_pool():
+    """
+    Return the thread pool that explains the models of a streamed prediction concurrently, creating it on first use.
+    Its size is set with EXPLAIN_WORKERS (default 4).
+    """
+    global explanation_pool
+    with lazy_lock:
+        if explanation_pool is None:
+            explanation_pool = ThreadPoolExecutor(max_workers=int(os.getenv('EXPLAIN_WORKERS', 4)))
+        return explanation_pool
+
+def records_to_matrix(records):
+    """
+    Convert a list of input records into a NumPy matrix with the columns in FEATURES order.
+    Missing features default to 0, matching the single-patient /predict behaviour.
+    """
+    return np.array([[record.get(feature, 0) for feature in FEATURES] for record in records], dtype=float)
+
+def score_models(model_set, input_matrix, selected_models):
+    """
+    Scale the whole input matrix once and make a single predict_proba call per selected model.
+    Returns a dictionary mapping each model name to the predicted labels and the confidence
+    of each row, both taken from the same probability matrix.
+    """
+    # Scale all rows in one call instead of once per model
+    with span("scale"):
+        input_scaled = scale_matrix(model_set, input_matrix)
+
+    scores = {}
+    for model_name, model in model_set.predictors.items():
+        if model_name not in selected_models:  # Skip models that are not selected
+            continue
+
+        # Each model gets the input space it was trained on, as recorded in the model bundle
+        model_rows = input_matrix if model_set.input_spaces[model_name] == "raw" else input_scaled
+
+        # One probability matrix per model, prediction and confidence are both derived from it
+        with span("inference", model_name):
+            probabilities = model.predict_proba(model_rows)
+        scores[model_name] = {
+            "predictions": model.classes_[np.argmax(probabilities, axis=1)],
+            "confidences": probabilities.max(axis=1),
+        }
+    return scores
+
+def score_rows(model_set, selected_models, input_matrix):
+    """Score input_matrix with score_models and split the scores into one scores dictionary per row."""
+    scores = score_models(model_set, input_matrix, selected_models)
+    return [
+        {
+            model_name: {field: values[row:row + 1] for field, values in score.items()}
+            for model_name, score in scores.items()
+        }
+        for row in range(len(input_matrix))
+    ]
+
+def score_input(model_set, input_matrix, selected_models):
+    """
+    Score input_matrix like score_models. A single row is scored together with the rows of concurrent
+    requests when micro-batching is enabled. Raises QueueFull when too many rows are waiting.
+    """
+    if micro_batcher is None or len(input_matrix) != 1:
+        return score_models(model_set, input_matrix, selected_models)
+    with span("batched_inference"):
+        return micro_batcher.score((model_set, tuple(selected_models)), input_matrix[0])
+
+def busy_response(error):
+    """Return the 503 response of a request rejected because the prediction queue is full."""
+    response = jsonify({"error": str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+def scale_matrix(model_set, matrix):
+    """
+    Scale a NumPy matrix of rows in FEATURES order with the scaler of the given model version.
+    Equivalent to scaler.transform, without the DataFrame feature name checks.
+    """
+    return (matrix - model_set.scaler.mean_) / model_set.scaler.scale_
+
+def model_predict_fn(model_set, model_name):
+    """
+    Return a predict_proba function for the given model that takes rows in the original feature space.
+    Models trained on scaled data get the scaling applied before predicting, so LIME always
+    perturbs and explains the unscaled values the explainer was built from.
+    """
+    model = model_set.predictors[model_name]
+    return lambda rows: model.predict_proba(model_input(model_set, model_name, rows))
+
+def model_input(model_set, model_name, matrix):
+    """
+    Convert a NumPy matrix of unscaled rows into the input space the given model was trained on,
+    as recorded in the model bundle.
+    """
+    if model_set.input_spaces[model_name] == "raw":
+        return matrix
+    return scale_matrix(model_set, matrix)
+
+def get_fast_explainer(model_set, model_name):
+    """
+    Return the fast exact explainer (linear / tree) of the given model, or None if it has none.
+    Explainers are built on first use; the linear explainer's background is the training feature mean.
+    """
+    def build():
+        with startup_phase(f"fast_explainer_{model_name}"):
+            background = np.array([get_explainer_stats(model_set)["feature_means"]])
+            return build_explainer(
+                model_set.models[model_name], model_input(model_set, model_name, background), FEATURES
+            )
+    return model_set.get_derived(("fast_explainer", model_name), build)
+
+def fast_explanation(model_set, fast_explainer, model_name, raw_row):
+    """Explain one unscaled input row with a model's fast explainer and return (explainer name, explanation)."""
+    with span(f"explain_{fast_explainer.name}", model_name):
+        model_row = model_input(model_set, model_name, raw_row.reshape(1, -1))[0]
+        return fast_explainer.name, fast_explainer.explain(model_row, raw_row)
+
+def lime_deadline(lime_options):
+    """Return the time.perf_counter() time by which an adaptive LIME explanation started now must stop sampling."""
+    return time.perf_counter() + lime_options["lime_time_budget_ms"] / 1000
+
+def explain_models(model_set, raw_row, model_names, method="auto", lime_options=None):
+    """
+    Generate explanations for one unscaled input row and every given model.
+    Models with a fast exact explainer matching the requested method use it directly;
+    the rest are explained with LIME, sampling the perturbation neighbourhood only once
+    (growing it until each model's explanation is stable in adaptive mode).
+    Returns a dictionary mapping each model name to a tuple (explainer name, explanation).
+    """
+    lime_options = lime_options or parse_lime_options({}, LIME_MODE, LIME_TIME_BUDGET_MS)
+    explanations = {}
+    lime_models = []
+    for model_name in model_names:
+        fast_explainer = get_fast_explainer(model_set, model_name)
+        if fast_explainer is not None and method in ("auto", fast_explainer.name):
+            explanations[model_name] = fast_explanation(model_set, fast_explainer, model_name, raw_row)
+        else:
+            lime_models.append(model_name)
+
+    if lime_models:
+        predict_fns = {model_name: model_predict_fn(model_set, model_name) for model_name in lime_models}
+        explained = get_shared_explainer(model_set).explain(
+            raw_row, predict_fns, num_features=8,
+            adaptive=lime_options["lime_mode"] == "adaptive", deadline=lime_deadline(lime_options),
+        )
+        for model_name, exp in explained.items():
+            explanations[model_name] = ("lime", exp)
+    return explanations
+
+def explain_prediction(model_name, explainer_name, exp, result, chart_options):
+    """
+    Build the explanation list, the explanation graph and the text explanation for one prediction.
+    The list keeps the "lime_explanation" key whichever explainer produced it, so existing clients keep working.
+    LIME explanations also report the neighbourhood samples they used and, in adaptive mode, their stability.
+    """
+    lime_explanation = exp.as_list()
+
+    # The graph shows the features in the fixed FEATURES order
+    feature_importances_dict = {feature: 0 for feature in FEATURES}  # Initialize all importances to 0
+
+    # Update the feature importances based on the explanation
+    # The feature index is used instead of the label, as labels such as "32.55 < BMI <= 36.10" do not start with the name
+    for feature_index, importance in exp.as_map():
+        feature_importances_dict[FEATURES[feature_index]] = importance
+
+    # Build the chart; an image is only rendered when the request asked for one
+    method_title = "LIME" if explainer_name == "lime" else f"{explainer_name.title()} Attribution"
+    with span("chart", model_name):
+        chart_fields = render_chart(
+            feature_importances_dict,
+            f'Key Features Impacting This Prediction ({method_title} Explanation)',
+            chart_options,
+            chart_store,
+            chart_renderer,
+        )
+
+    # Simplify feature names for the text explanation
+    top_features = [feature for feature, importance in sorted(feature_importances_dict.items(), key=lambda x: abs(x[1]), reverse=True)[:3]]
+
+    # Generate a simplified, user-friendly explanation with only feature names
+    explanation_text = (
+        f"The model '{model_name.replace('_', ' ').title()}' predicted that the patient is '{result}'. "
+        f"This conclusion was influenced by factors such as {', '.join(top_features)}. "
+        f"The graph above highlights the most important features that contributed to this prediction."
+    )
+
+    fields = {
+        "explainer": explainer_name,
+        "lime_explanation": lime_explanation,
+        **chart_fields,
+        "text_explanation": explanation_text,
+    }
+    if explainer_name == "lime":
+        fields["lime_samples"] = exp.samples
+        fields["lime_stability"] = round(exp.stability, 4) if exp.stability is not None else None
+        fields["lime_stop_reason"] = exp.stop_reason
+    return fields
+
+def build_results(model_set, input_matrix, selected_models, explain=True, explainer_method="auto", chart_options=None,
+                  lime_options=None, scores=None):
+    """
+    Score every row of input_matrix with the selected models of the given model version and build
+    one results dictionary per row.
+    Explanations are only generated when explain is True, using the requested explainer method,
+    LIME options and chart options (a JSON chart spec by default).
+    Rows the caller has already scored pass their scores, so they are not scored again.
+    """
+    chart_options = chart_options or parse_chart_options({})
+    if scores is None:
+        scores = score_input(model_set, input_matrix, selected_models)
+
+    all_results = []
+    for row in range(len(input_matrix)):
+        # Explanations are computed in the original feature space, with one shared LIME neighbourhood per row
+        explanations = explain_models(
+            model_set, input_matrix[row], scores.keys(), explainer_method, lime_options
+        ) if explain else {}
+
+        results = {}
+        for model_name, score in scores.items():
+            # Store the results for this model
+            results[model_name] = prediction_fields(model_set, model_name, score, row)
+            if explain:
+                results[model_name].update(explain_prediction(
+                    model_name, *explanations[model_name], results[model_name]["prediction"], chart_options
+                ))
+        all_results.append(results)
+    return all_results
+
+def build_cascade_results(model_set, input_matrix, explain=True, explainer_method="auto", chart_options=None,
+                          lime_options=None):
+    """
+    Score one input row with the cascade stages of the given model version, stopping at the first stage
+    confident enough to decide, and build the results of the deciding model only, plus a "cascade" entry
+    reporting which stage decided and the confidence of every stage that ran.
+    """
+    with span("cascade"):
+        decided_by, scores, report = run_cascade(
+            model_set.cascade, lambda model_name: score_input(model_set, input_matrix, (model_name,))[model_name]
+        )
+    CASCADE_DECISIONS.labels(decided_by).inc()
+
+    results = build_results(
+        model_set, input_matrix, (decided_by,), explain=explain, explainer_method=explainer_method,
+        chart_options=chart_options, lime_options=lime_options, scores={decided_by: scores},
+    )[0]
+    results["cascade"] = report
+    return results
+
+# The fields of a model's results that do not depend on the explanation, sent first by /predict/stream
+PREDICTION_FIELDS = ["prediction", "confidence", "accuracy", "model_version"]
+
+def prediction_fields(model_set, model_name, score, row):
+    """Return the prediction, confidence, accuracy and model version of one model for one scored row."""
+    # Convert the prediction to a human-readable result
+    result = "Diabetic" if score["predictions"][row] == 1 else "Not Diabetic"
+    return {
+        "prediction": result,
+        "confidence": float(score["confidences"][row]),
+        "accuracy": model_set.accuracies[model_name],
+        "model_version": model_set.version,
+    }
+
+def default_models(model_set):
+    """
+    Return the models a request runs when it selects none: every model except the voting ensemble,
+    which repeats their work and is only run when selected or by the cascade.
+    """
+    return [model_name for model_name in model_set.models if model_name != ENSEMBLE_NAME]
+
+def read_predict_options(data, model_set, explain_default=True):
+    """
+    Read the options of a /predict, /predict/stream or /predict/batch request: the selected models (in serving
+    order), whether to explain (explain_default when the request does not say), the explainer method,
+    the LIME options and the chart options.
+    Raises ValueError with a user facing message when one is invalid.
+    """
+    # Get the list of selected models from the input, or use all models by default
+    selected_models = data.get('models', default_models(model_set))
+    if not isinstance(selected_models, list) or not all(isinstance(model_name, str) for model_name in selected_models):
+        raise ValueError("'models' must be a list of model names")
+    unknown_models = [model_name for model_name in selected_models if model_name not in model_set.models]
+    if unknown_models:
+        raise ValueError(f"Unknown models {unknown_models}, expected any of {list(model_set.models)}")
+    selected_models = tuple(model_name for model_name in model_set.models if model_name in selected_models)
+
+    # Get the explainer to use: "auto" (fast exact explainers where available), "lime", "linear" or "tree"
+    explainer_method = data.get('explainer', 'auto')
+    if explainer_method not in EXPLAINER_OPTIONS:
+        raise ValueError(f"Unknown explainer '{explainer_method}', expected one of {EXPLAINER_OPTIONS}")
+
+    # Get the LIME options: "lime_mode" adaptive or fixed, and the adaptive mode's "lime_time_budget_ms"
+    lime_options = parse_lime_options(data, LIME_MODE, LIME_TIME_BUDGET_MS)
+
+    # Get the chart options: "chart_format" json (default), svg or png, plus optional size and DPI
+    chart_options = parse_chart_options(data)
+    return selected_models, bool(data.get('explain', explain_default)), explainer_method, lime_options, chart_options
 
-for name in model_names:
-    model_path = os.path.join(model_folder, name)
-    if not os.path.exists(model_path):
-        raise FileNotFoundError(f"Model file not found: {model_path}")
-    # Load the model and its accuracy from the file
-    model, accuracy = joblib.load(model_path)
-    models[name.split('.')[0]] = model  # Use the model name without the file extension as the key
-    accuracies[name.split('.')[0]] = accuracy
+def charts_available(results):
+    """Check that every chart URL in cached results is still in the chart store, so the client can fetch it."""
+    return all(
+        chart_store.contains(fields["lime_explanation_image_url"][len(CHART_URL_PREFIX):])
+        for fields in results.values() if "lime_explanation_image_url" in fields
+    )
 
-# Load the scaler for preprocessing input data
-scaler = joblib.load(os.path.join(model_folder, 'scaler.pkl'))
+def read_serving_mode(data):
+    """
+    Read the serving mode of a /predict request, "all" or "cascade" (PREDICT_MODE by default).
+    Raises ValueError with a user facing message when it is invalid.
+    """
+    mode = data.get('mode', PREDICT_MODE)
+    if mode not in SERVING_MODES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of {SERVING_MODES}")
+    return mode
 
-# Define the list of features expected in the input data
-FEATURES = ['Pregnancies', 'Glucose', 'BloodPressure', 'SkinThickness', 'Insulin', 'BMI', 'DiabetesPedigreeFunction', 'Age']
+def predict_cache_key(model_set, input_row, selected_models, explain, explainer_method, lime_options, chart_options,
+                      cascade=None):
+    """
+    Return the result cache key of one /predict input row and its options. Results of the cascade are cached
+    under its stages, which can change without the model version changing.
+    """
+    return (
+        model_set.version,
+        tuple(float(value) for value in input_row),
+        selected_models,
+        explain,
+        explainer_method,
+        tuple(sorted(lime_options.items())),
+        tuple(sorted(chart_options.items())),
+        tuple((stage["model"], stage["margin"]) for stage in cascade) if cascade is not None else None,
+    )
 
-# Load the training data for initializing the LIME explainer
-data = pd.read_csv(os.path.join(os.path.dirname(__file__), '..', 'data', 'balanced_pima.csv'))
-X_train = data[FEATURES]
+@app.before_request
+def begin_request_trace():
+    """Start recording the stage timings of every request, labelled with its route rather than its path."""
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    g.trace = start_trace(endpoint)
 
-# Initialize the LIME explainer with the training data
-explainer = LimeTabularExplainer(X_train.values, mode="classification", feature_names=FEATURES)
+@app.after_request
+def record_request_metrics(response):
+    """Count the request by route, method and status and record its total duration."""
+    trace = g.get('trace')
+    if trace is not None:
+        observe_request(trace.endpoint, request.method, response.status_code, time.perf_counter() - trace.began)
+    return response
+
+@app.teardown_request
+def finish_request_trace(error=None):
+    """Stop attributing spans to the finished request."""
+    end_trace()
+
+def wants_timings(data):
+    """
+    Check whether the request asked for its stage timings, with "timings": true in the JSON body
+    or ?timings=1 in the query string.
+    """
+    return data.get('timings') is True or request.args.get('timings', '').lower() in ('1', 'true')
 
 @app.route('/predict', methods=['POST'])
 def predict():
     """
     Handle POST requests to the /predict endpoint.
     This function takes input data, preprocesses it, and uses the selected models to make predictions.
-    It also generates LIME explanations for the predictions.
+    It also explains each prediction, with exact linear / tree attributions by default or LIME on request
+    ("explain": false skips the explanations).
+    With "mode" set to "cascade", the models run cheapest first and the first one confident enough answers
+    alone, with a "cascade" entry reporting which stage decided.
+    With "timings" set to true, the response also lists the time spent in each stage of the request.
     """
     try:
         # Parse the JSON input from the request
-        data = request.get_json()
-        input_data = [data.get(feature, 0) for feature in FEATURES]  # Default to 0 if a feature is missing
-        input_df = pd.DataFrame([input_data], columns=FEATURES)
-        
-        # Scale the input data using the preloaded scaler
-        input_df_scaled = scaler.transform(input_df)
-        
-        # Get the list of selected models from the input, or use all models by default
-        selected_models = data.get('models', models.keys())
-        results = {}
-        
-        # Iterate through the models and make predictions
-        for model_name, model in models.items():
-            if model_name not in selected_models:  # Skip models that are not selected
-                continue
-
-            # Handle scaling differences for Random Forest
-            if model_name == "random_forest":
-                prediction = model.predict(input_df)[0]
-                confidence = max(model.predict_proba(input_df)[0])
-                lime_input = input_df.values[0]
+        with span("parse"):
+            data = request.get_json()
+            input_matrix = records_to_matrix([data])
+
+        # Serve the whole request from one model version, even if a reload swaps in a new one meanwhile
+        model_set = model_registry.current
+
+        try:
+            selected_models, explain, explainer_method, lime_options, chart_options = read_predict_options(data, model_set)
+            mode = read_serving_mode(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # The cascade picks its own models, so the selected models do not apply to it
+        cascade = model_set.cascade if mode == "cascade" else None
+        if cascade is not None:
+            selected_models = ()
+
+        # Return the cached results if the same input was already predicted with the same options
+        cache_key = predict_cache_key(
+            model_set, input_matrix[0], selected_models, explain, explainer_method, lime_options, chart_options, cascade
+        )
+        with span("cache_lookup"):
+            results = prediction_cache.get(cache_key)
+        if results is None or not charts_available(results):
+            if cascade is not None:
+                results = build_cascade_results(
+                    model_set, input_matrix, explain=explain,
+                    explainer_method=explainer_method, chart_options=chart_options, lime_options=lime_options
+                )
             else:
-                prediction = model.predict(input_df_scaled)[0]
-                confidence = max(model.predict_proba(input_df_scaled)[0])
-                lime_input = input_df_scaled[0]
+                results = build_results(
+                    model_set, input_matrix, selected_models, explain=explain,
+                    explainer_method=explainer_method, chart_options=chart_options, lime_options=lime_options
+                )[0]
+            prediction_cache.put(cache_key, results)
 
-            # Convert the prediction to a human-readable result
-            result = "Diabetic" if prediction == 1 else "Not Diabetic"
+        # Add the stage timings of this request when asked for (never cached)
+        if wants_timings(data):
+            results = {**results, "timings": g.trace.timings()}
 
-            # Generate a LIME explanation for the prediction
-            exp = explainer.explain_instance(
-                lime_input, model.predict_proba, num_features=8
-            )
-            lime_explanation = exp.as_list()
-
-            # Define the fixed order of feature names for the graph
-            fixed_feature_order = ['Pregnancies', 'Glucose', 'BloodPressure', 'SkinThickness', 'Insulin', 'BMI', 'DiabetesPedigreeFunction', 'Age']
-            feature_importances_dict = {feature: 0 for feature in fixed_feature_order}  # Initialize all importances to 0
-
-            # Update the feature importances based on the LIME explanation
-            for feature, importance in lime_explanation:
-                simplified_feature = feature.split(' ')[0]  # Simplify the feature name
-                if simplified_feature in feature_importances_dict:
-                    feature_importances_dict[simplified_feature] = importance
-
-            # Prepare data for the graph
-            simplified_feature_names = list(feature_importances_dict.keys())
-            feature_importances = list(feature_importances_dict.values())
-
-            # Create a bar chart visualization of the LIME explanation
-            fig, ax = plt.subplots(figsize=(50, 30))  # Large graph size
-
-            # Set bar colors: green for positive, red for negative importances
-            bar_colors = ['green' if importance > 0 else 'red' for importance in feature_importances]
-            ax.barh(simplified_feature_names, feature_importances, color=bar_colors, height=0.8)
-
-            ax.set_xlabel('Feature Importance', fontsize=70)
-            # Update the graph title to be more descriptive and user-friendly
-            ax.set_title('Key Features Impacting This Prediction (LIME Explanation)', fontsize=80)
-            ax.tick_params(axis='both', which='major', labelsize=60)
-            # Rotate x-axis labels slightly to prevent overlapping
-            plt.xticks(rotation=45, ha='right')
-            plt.tight_layout(pad=3.0)
-
-            # Save the figure to a buffer and encode it as base64
-            buf = BytesIO()
-            fig.savefig(buf, format="png", dpi=200)  # High DPI for clarity
-            buf.seek(0)
-            img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-            plt.close(fig)
-
-            # Debugging: Ensure the image is properly encoded
-            if not img_base64:
-                print(f"Error: Failed to encode graph for model {model_name}")
-
-            # Simplify feature names for the text explanation
-            top_features = [feature for feature, importance in sorted(feature_importances_dict.items(), key=lambda x: abs(x[1]), reverse=True)[:3]]
-
-            # Generate a simplified, user-friendly explanation with only feature names
-            explanation_text = (
-                f"The model '{model_name.replace('_', ' ').title()}' predicted that the patient is '{result}'. "
-                f"This conclusion was influenced by factors such as {', '.join(top_features)}. "
-                f"The graph above highlights the most important features that contributed to this prediction."
+        # Return the results as a JSON response, with the model version that served them
+        with span("serialize"):
+            response = jsonify(results)
+        response.headers['X-Model-Version'] = model_set.version
+        return response
+    
+    except QueueFull as e:
+        # Too many rows are already waiting to be scored
+        return busy_response(e)
+
+    except Exception as e:
+        # Handle errors gracefully and return an error message
+        print(f"Error in predict function: {e}")
+        return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
+
+def stream_explanations(model_set, raw_row, results, explainer_method, lime_options, chart_options):
+    """
+    Explain one unscaled input row with every model in results concurrently and yield
+    (model name, explanation fields) as soon as each model's explanation and chart are done.
+    Fast explainers start straight away; LIME models share one perturbation neighbourhood,
+    sampled once (or batch by batch, as the models need them, in adaptive mode), then score it and fit
+    their surrogates in parallel.
+    """
+    pool = get_explanation_pool()
+
+    def explain_one(model_name, explain_fn):
+        explainer_name, exp = explain_fn()
+        return model_name, explain_prediction(
+            model_name, explainer_name, exp, results[model_name]["prediction"], chart_options
+        )
+
+    def submit(model_name, explain_fn):
+        # Run in a copy of the request's context, so the spans of the pool threads are recorded on its trace
+        return pool.submit(copy_context().run, explain_one, model_name, explain_fn)
+
+    def explain_lime(shared_explainer, neighbourhood, model_name):
+        if lime_options["lime_mode"] == "adaptive":
+            return "lime", shared_explainer.explain_model_adaptive(
+                neighbourhood, model_name, model_predict_fn(model_set, model_name), num_features=8, deadline=deadline
             )
+        return "lime", shared_explainer.explain_model(
+            neighbourhood, model_name, model_predict_fn(model_set, model_name), num_features=8
+        )
 
-            # Store the results for this model
-            results[model_name] = {
-                "prediction": result,
-                "confidence": confidence,
-                "accuracy": accuracies[model_name],
-                "lime_explanation": lime_explanation,
-                "lime_explanation_image": img_base64,  # Ensure this is properly encoded
-                "text_explanation": explanation_text,
+    futures = []
+    lime_models = []
+    for model_name in results:
+        fast_explainer = get_fast_explainer(model_set, model_name)
+        if fast_explainer is not None and explainer_method in ("auto", fast_explainer.name):
+            futures.append(submit(model_name, partial(fast_explanation, model_set, fast_explainer, model_name, raw_row)))
+        else:
+            lime_models.append(model_name)
+
+    if lime_models:
+        shared_explainer = get_shared_explainer(model_set)
+        deadline = lime_deadline(lime_options)
+        if lime_options["lime_mode"] == "adaptive":
+            neighbourhood = shared_explainer.build_adaptive_neighbourhood(raw_row)
+        else:
+            with span("lime_sampling"):
+                neighbourhood = shared_explainer.build_neighbourhood(raw_row)
+        for model_name in lime_models:
+            futures.append(submit(model_name, partial(explain_lime, shared_explainer, neighbourhood, model_name)))
+
+    for future in as_completed(futures):
+        yield future.result()
+
+@app.route('/predict/stream', methods=['POST'])
+def predict_stream():
+    """
+    Handle POST requests to the /predict/stream endpoint.
+    This function takes the same input and options as /predict but streams the results: first a "predictions"
+    event with the prediction, confidence and accuracy of every selected model, as soon as the models have
+    scored the input, then one "explanation" event per model as soon as its explanation is ready (the models
+    are explained concurrently), then a "done" event. Events are sent as newline-delimited JSON,
+    or as server-sent events when the request accepts text/event-stream.
+    """
+    try:
+        # Parse the JSON input from the request
+        with span("parse"):
+            data = request.get_json()
+            input_matrix = records_to_matrix([data])
+
+        # Serve the whole request from one model version
+        model_set = model_registry.current
+
+        try:
+            selected_models, explain, explainer_method, lime_options, chart_options = read_predict_options(data, model_set)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # The stream always runs the selected models; the cascade is only served by /predict
+        if data.get('mode', 'all') != 'all':
+            return jsonify({"error": "Only /predict supports 'mode', streams run every selected model"}), 400
+
+        # Results already computed by /predict or an earlier stream are replayed from the cache
+        cache_key = predict_cache_key(
+            model_set, input_matrix[0], selected_models, explain, explainer_method, lime_options, chart_options
+        )
+        with span("cache_lookup"):
+            cached = prediction_cache.get(cache_key)
+            if cached is not None and not charts_available(cached):
+                cached = None  # A chart was evicted from the store, render it again
+
+        server_sent_events = request.accept_mimetypes.best_match(
+            ['application/x-ndjson', 'text/event-stream']
+        ) == 'text/event-stream'
+        include_timings = wants_timings(data)
+        trace = g.trace
+
+        def encode(event, body):
+            """Encode one event as a server-sent event or as one line of JSON."""
+            if server_sent_events:
+                return f"event: {event}\ndata: {json.dumps(body)}\n\n"
+            return json.dumps({"event": event, **body}) + "\n"
+
+        # Score before streaming, so a full prediction queue is answered with a 503 status
+        results = cached
+        if results is None:
+            scores = score_input(model_set, input_matrix, selected_models)
+            results = {
+                model_name: prediction_fields(model_set, model_name, score, 0)
+                for model_name, score in scores.items()
             }
-        
-        # Return the results as a JSON response
-        return jsonify(results)
-    
+
+        def generate():
+            resume_trace(trace)
+            try:
+                yield encode("predictions", {
+                    "model_version": model_set.version,
+                    "results": {
+                        model_name: {field: fields[field] for field in PREDICTION_FIELDS}
+                        for model_name, fields in results.items()
+                    },
+                })
+
+                if explain and cached is not None:
+                    for model_name, fields in cached.items():
+                        explanation = {field: value for field, value in fields.items() if field not in PREDICTION_FIELDS}
+                        yield encode("explanation", {"model": model_name, **explanation})
+                elif explain:
+                    for model_name, explanation in stream_explanations(
+                        model_set, input_matrix[0], results, explainer_method, lime_options, chart_options
+                    ):
+                        results[model_name].update(explanation)
+                        yield encode("explanation", {"model": model_name, **explanation})
+
+                if cached is None:
+                    prediction_cache.put(cache_key, results)
+
+                done = {"model_version": model_set.version}
+                if include_timings:
+                    done["timings"] = trace.timings()
+                yield encode("done", done)
+
+            except Exception as e:
+                # The status line is already sent, so the error is reported as the last event
+                print(f"Error in predict_stream function: {e}")
+                yield encode("error", {"error": f"Prediction failed: {str(e)}"})
+
+        response = Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream' if server_sent_events else 'application/x-ndjson',
+        )
+        response.headers['X-Model-Version'] = model_set.version
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # Ask reverse proxies not to buffer the stream
+        return response
+
+    except QueueFull as e:
+        # Too many rows are already waiting to be scored
+        return busy_response(e)
+
     except Exception as e:
         # Handle errors gracefully and return an error message
-        print(f"Error in predict function: {e}")
+        print(f"Error in predict_stream function: {e}")
         return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
 
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """
+    Handle POST requests to the /predict/batch endpoint.
+    This function scores a whole cohort of patients at once: the input matrix is scaled once and
+    each selected model makes a single predict_proba call for all records.
+    LIME explanations are skipped unless the request sets "explain" to true, and stage timings
+    are included when it sets "timings" to true.
+    """
+    try:
+        # Parse the JSON input from the request
+        with span("parse"):
+            data = request.get_json()
+            records = data.get('records')
+            if not isinstance(records, list) or not records:
+                return jsonify({"error": "Batch prediction requires a non-empty 'records' list"}), 400
+
+            input_matrix = records_to_matrix(records)
+
+        # Serve the whole batch from one model version
+        model_set = model_registry.current
+
+        # Batches are not explained unless the request asks for it
+        try:
+            selected_models, explain, explainer_method, lime_options, chart_options = read_predict_options(
+                data, model_set, explain_default=False
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # The batch always runs the selected models; the cascade is only served by /predict
+        if data.get('mode', 'all') != 'all':
+            return jsonify({"error": "Only /predict supports 'mode', batches run every selected model"}), 400
+
+        results = build_results(
+            model_set, input_matrix, selected_models, explain=explain,
+            explainer_method=explainer_method, chart_options=chart_options, lime_options=lime_options
+        )
+
+        # Return one results dictionary per record, in input order
+        body = {"results": results, "model_version": model_set.version}
+        if wants_timings(data):
+            body["timings"] = g.trace.timings()
+        with span("serialize"):
+            response = jsonify(body)
+        response.headers['X-Model-Version'] = model_set.version
+        return response
+
+    except QueueFull as e:
+        # Too many rows are already waiting to be scored
+        return busy_response(e)
+
+    except Exception as e:
+        # Handle errors gracefully and return an error message
+        print(f"Error in predict_batch function: {e}")
+        return jsonify({"error": f"Batch prediction failed: {str(e)}"}), 500
+
+@app.route('/explanations/<name>', methods=['GET'])
+def explanation_chart(name):
+    """
+    Handle GET requests to the /explanations/<hash>.png|svg endpoint.
+    Returns a rendered explanation chart from the chart store. Charts are content-addressed, so the response
+    can be cached indefinitely; the hash is also the ETag, and a conditional request with a matching
+    If-None-Match gets a 304 Not Modified.
+    """
+    parsed = parse_chart_name(name)
+    content = chart_store.get(name) if parsed else None
+    if content is None:
+        return jsonify({"error": f"Unknown explanation chart: {name}. Repeat the prediction to render it again."}), 404
+
+    digest, chart_format = parsed
+    response = Response(content, content_type=CONTENT_TYPES[chart_format])
+    response.set_etag(digest)
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 3600
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    Handle GET requests to the /cache/stats endpoint.
+    Returns the size and hit/miss counters of the /predict result cache and of the explanation chart store.
+    """
+    return jsonify({**prediction_cache.stats(), "charts": chart_store.stats()})
+
 @app.route('/tune', methods=['POST'])
 def tune_models():
     """
     Handle POST requests to the /tune endpoint.
-    This function performs hyperparameter tuning for the models using GridSearchCV.
+    This function starts hyperparameter tuning of the models as a background job on a process pool
+    and returns the job id straight away. Poll /tune/<job_id> for progress and results.
+    The optional JSON body selects the search "mode" ("grid" or "halving") and a "max_seconds" / "max_fits" budget.
     """
     try:
-        # Define hyperparameter grids for each model
-        param_grids = {
-            "logistic_regression": {
-                "C": [0.1, 1, 10],
-                "solver": ["liblinear", "lbfgs"]
-            },
-            "random_forest": {
-                "n_estimators": [50, 100, 200],
-                "max_depth": [None, 10, 20]
-            },
-            "gradient_boosting": {
-                "learning_rate": [0.01, 0.1, 0.2],
-                "n_estimators": [50, 100, 200]
-            }
-        }
-
-        results = {}
-
-        # Iterate through the models and perform tuning
-        for model_name, model in models.items():
-            if model_name not in param_grids:
-                continue
+        options = request.get_json(silent=True) or {}
 
-            param_grid = param_grids[model_name]
-            grid_search = GridSearchCV(model, param_grid, cv=5, scoring='accuracy')
-            grid_search.fit(X_train, data['Outcome'])  # Assuming 'Outcome' is the target column
+        # Submit the search over every model's candidates on the training features and labels
+        with span("training_data"):
+            X, y = get_training_data()
+        with span("submit"):
+            job_id = get_tuning_jobs().submit(
+                model_registry.current.models, X, y,
+                mode=options.get('mode', 'grid'),
+                max_seconds=options.get('max_seconds'),
+                max_fits=options.get('max_fits'),
+            )
 
-            # Perform cross-validation with the best parameters
-            best_model = grid_search.best_estimator_
-            cv_scores = cross_val_score(best_model, X_train, data['Outcome'], cv=5, scoring='accuracy')
+        body = {"job_id": job_id, "status_url": f"/tune/{job_id}"}
+        if wants_timings(options):
+            body["timings"] = g.trace.timings()
+        return jsonify(body), 202
 
-            # Store the tuning results
-            results[model_name] = {
-                "best_params": grid_search.best_params_, 
-                "cv_scores": cv_scores.tolist(),
-                "mean_cv_score": np.mean(cv_scores)
-            }
+    except ValueError as e:
+        # Invalid search options
+        return jsonify({"error": str(e)}), 400
 
-        # Return the tuning results as a JSON response
-        return jsonify(results)
+    except RuntimeError as e:
+        # Too many tuning jobs are already queued or running
+        return jsonify({"error": str(e)}), 429
 
     except Exception as e:
         # Handle errors gracefully and return an error message
         print(f"Error in tune_models function: {e}")
         return jsonify({"error": f"Model tuning failed: {str(e)}"}), 500
 
+@app.route('/tune/<job_id>', methods=['GET'])
+def tune_status(job_id):
+    """
+    Handle GET requests to the /tune/<job_id> endpoint.
+    Returns the status of a tuning job, its progress (candidates evaluated out of the total)
+    and, once completed, the best parameters and cross-validation scores of each model.
+    """
+    # No job can exist before the first /tune request created the job runner
+    job = tuning_jobs.status(job_id) if tuning_jobs is not None else None
+    if job is None:
+        return jsonify({"error": f"Unknown or expired tuning job: {job_id}"}), 404
+    return jsonify(job)
+
+@app.route('/admin/reload', methods=['POST'])
+def reload_models():
+    """
+    Handle POST requests to the /admin/reload endpoint.
+    Loads and validates the model artifacts in the background and swaps them in once they are valid;
+    requests in flight finish on the previous version. Poll /admin/models for the served version.
+    When ADMIN_TOKEN is set, the request must send it in the X-Admin-Token header.
+    """
+    admin_token = os.getenv('ADMIN_TOKEN')
+    if admin_token and request.headers.get('X-Admin-Token') != admin_token:
+        return jsonify({"error": "Invalid admin token"}), 403
+
+    options = request.get_json(silent=True) or {}
+    model_registry.reload_in_background(force=bool(options.get('force', False)))
+    return jsonify({**model_registry.status(), "status_url": "/admin/models"}), 202
+
+@app.route('/admin/models', methods=['GET'])
+def model_status():
+    """
+    Handle GET requests to the /admin/models endpoint.
+    Returns the served model version, when it was loaded, the input space of each model,
+    the number of reloads and the last reload error.
+    """
+    return jsonify(model_registry.status())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Handle GET requests to the /metrics endpoint.
+    Returns the request counters, the per-endpoint, per-stage and per-model latency histograms
+    and the cache hit rates in the Prometheus text format.
+    """
+    body, content_type = metrics_response()
+    return Response(body, content_type=content_type)
+
+@app.route('/startup', methods=['GET'])
+def startup_report():
+    """
+    Handle GET requests to the /startup endpoint.
+    Returns the startup mode and the seconds spent in each startup phase, including lazy phases run so far.
+    """
+    return jsonify({"mode": STARTUP_MODE, "phases": dict(STARTUP_TIMINGS), "total_seconds": startup_seconds})
+
+def warm_up():
+    """Build everything that is otherwise built lazily, so the first requests do not pay for it."""
+    model_set = model_registry.current
+    get_shared_explainer(model_set)
+    for model_name in model_set.models:
+        get_fast_explainer(model_set, model_name)
+
+# Set once the warm-up predictions have run; /ready answers 503 until then
+ready = False
+
+def warm_up_predictions():
+    """
+    Predict an average patient with every model, so the first real requests do not pay for first-call
+    overheads, then mark the server as ready. In eager mode the prediction is also explained with
+    the fast explainers and with LIME.
+    """
+    global ready
+    with startup_phase("warm_up_predictions"):
+        model_set = model_registry.current
+        probe = model_set.scaler.mean_.reshape(1, -1)  # An average patient, in the original feature space
+        build_results(model_set, probe, tuple(model_set.models), explain=False)
+        if STARTUP_MODE == "eager":
+            for method in ("auto", "lime"):
+                build_results(model_set, probe, tuple(model_set.models), explainer_method=method)
+    ready = True
+
+def after_fork():
+    """
+    Prepare a worker process forked from a preloaded server (see gunicorn.conf.py): restart the
+    artifact watcher, and the warm-up predictions if they had not finished before the fork.
+    In eager mode the worker's chart rendering processes are started too.
+    """
+    model_registry.restart_watching()
+    if micro_batcher is not None:
+        micro_batcher.reset()  # The master's dispatcher thread does not survive the fork
+    if STARTUP_MODE == "eager":
+        threading.Thread(target=chart_renderer.start, daemon=True).start()
+    if not ready:
+        threading.Thread(target=warm_up_predictions, daemon=True).start()
+
+@app.route('/ready', methods=['GET'])
+def readiness():
+    """
+    Handle GET requests to the /ready endpoint.
+    Returns 200 once the models are loaded and the warm-up predictions have run, and 503 before,
+    so a load balancer only sends traffic to warmed-up workers.
+    """
+    body = {"ready": ready, "model_version": model_registry.version, "mode": STARTUP_MODE, "pid": os.getpid()}
+    return jsonify(body), 200 if ready else 503
+
+# Load and validate the first model version, then watch the artifacts for retrained versions
+with startup_phase("load_models"):
+    model_registry.reload()
+model_registry.start_watching()
+
+if STARTUP_MODE == "eager":
+    warm_up()
+    warm_up_predictions()
+else:
+    # Start serving straight away; /ready reports ready once the warm-up predictions are done
+    threading.Thread(target=warm_up_predictions, daemon=True).start()
+
+# Report the time spent in each startup phase
+startup_seconds = round(time.perf_counter() - startup_began, 4)
+print(f"Startup ({STARTUP_MODE}) took {startup_seconds:.3f}s: " + ", ".join(
+    f"{phase} {seconds:.3f}s" for phase, seconds in STARTUP_TIMINGS.items()
+))
+
 if __name__ == '__main__':
     # Run the Flask app in debug mode for easier development
+    # For production, serve it with gunicorn and the preloaded, multi-process setup of gunicorn.conf.py
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,213 @@
+import os
+import time
+
+import joblib
+import numpy as np
+from joblib.hashing import NumpyHasher
+from numpy.lib.recfunctions import repack_fields
+
+from explainer_stats import load_training_stats
+from model_registry import save_artifact
+from schema import FEATURES, TARGET
+
+# One versioned bundle of everything ml_model.py produces, shared by the server, evaluation and graphs.
+# The bundle holds every model, the scaler, the feature schema, the input space each model expects
+# ("scaled" or "raw"), the explainer's training statistics, the evaluation metrics and a content hash.
+# It is a single uncompressed joblib file, so its NumPy arrays can be memory-mapped when loaded.
+# Model folders from before the bundle (one (model, accuracy) pickle per model plus scaler.pkl)
+# are still loaded, with the input spaces the server used to assume for them.
+# A bundle may also hold a soft voting ensemble of the models, served by the cascade (see cascade.py) and on
+# request, but not among the models /predict runs by default.
+
+BUNDLE_FILE = "model_bundle.joblib"
+BUNDLE_FORMAT = 1
+
+# The models, in the order they are served
+MODEL_NAMES = ["logistic_regression", "random_forest", "gradient_boosting"]
+
+# The optional voting ensemble of the models, served after them
+ENSEMBLE_NAME = "voting_classifier"
+
+# Key of the scaler's file in the artifact paths of a legacy bundle
+SCALER_ARTIFACT = "scaler"
+
+# Input space of each model, "scaled" (standardized with the bundle's scaler) or "raw" (original units)
+INPUT_SPACES = ["scaled", "raw"]
+
+# Input spaces of the models in a legacy folder of loose pickles
+LEGACY_INPUT_SPACES = {"logistic_regression": "scaled", "random_forest": "raw", "gradient_boosting": "scaled",
+                       "voting_classifier": "scaled"}
+
+
+class ModelBundle:
+    """
+    The models of one training run with everything needed to serve, explain and evaluate them.
+    """
+
+    def __init__(self, models, accuracies, scaler, input_spaces, features=FEATURES, target=TARGET,
+                 explainer_stats=None, metrics=None, content_hash=None, created_at=None, source=BUNDLE_FILE,
+                 artifact_paths=None):
+        self.models = models
+        self.accuracies = accuracies
+        self.scaler = scaler
+        self.input_spaces = input_spaces
+        self.features = list(features)
+        self.target = target
+        self.explainer_stats = explainer_stats
+        self.metrics = metrics or {}
+        self.content_hash = content_hash
+        self.created_at = created_at
+        self.source = source  # The bundle file, or "legacy" for loose pickles
+        self.artifact_paths = artifact_paths or {}  # Legacy: the file of each model and of the scaler (SCALER_ARTIFACT)
+
+    def scale(self, matrix):
+        """Standardize a matrix of raw rows with the bundle's scaler."""
+        return (np.asarray(matrix, dtype=float) - self.scaler.mean_) / self.scaler.scale_
+
+    def model_input(self, model_name, matrix):
+        """Convert a matrix of raw rows into the input space the given model was trained on."""
+        if self.input_spaces[model_name] == "raw":
+            return np.asarray(matrix, dtype=float)
+        return self.scale(matrix)
+
+    def payload(self):
+        """Return the bundle's contents as the dictionary stored in the bundle file."""
+        return {
+            "format": BUNDLE_FORMAT,
+            "created_at": self.created_at,
+            "features": self.features,
+            "target": self.target,
+            "scaler": self.scaler,
+            "models": {
+                model_name: {
+                    "estimator": model,
+                    "input_space": self.input_spaces[model_name],
+                    "accuracy": self.accuracies[model_name],
+                    "metrics": self.metrics.get(model_name, {}),
+                }
+                for model_name, model in self.models.items()
+            },
+            "explainer_stats": self.explainer_stats,
+        }
+
+
+class BundleHasher(NumpyHasher):
+    """
+    joblib's hasher, except that structured arrays are hashed without their padding bytes. Fitted trees keep
+    their nodes in such an array, and its padding is left uninitialized, so hashing it as is would give the
+    same model a different hash in every process.
+    """
+
+    def save(self, obj):
+        if isinstance(obj, np.ndarray) and obj.dtype.names and not obj.dtype.hasobject:
+            obj = repack_fields(obj)
+        super().save(obj)
+
+
+def content_hash(payload):
+    """
+    Return the content hash of a bundle payload: a hash of what is served (the schema, the scaler, each model
+    with its input space and accuracy, and the explainer statistics), so retraining to the same models gives
+    the same version whenever it runs.
+    """
+    served = {
+        "format": payload["format"],
+        "features": payload["features"],
+        "target": payload["target"],
+        "scaler": payload["scaler"],
+        "models": {
+            model_name: (entry["estimator"], entry["input_space"], entry["accuracy"])
+            for model_name, entry in payload["models"].items()
+        },
+        "explainer_stats": payload["explainer_stats"],
+    }
+    return BundleHasher(hash_name="md5", coerce_mmap=True).hash(served)[:16]
+
+
+def bundle_path(model_folder):
+    """Return the path of the bundle file in a model folder."""
+    return os.path.join(model_folder, BUNDLE_FILE)
+
+
+def watched_files(model_folder):
+    """Return every file a model folder may be loaded from: the bundle and the legacy artifacts."""
+    legacy = [f"{model_name}.pkl" for model_name in MODEL_NAMES + [ENSEMBLE_NAME]]
+    legacy += ["scaler.pkl", "explainer_stats.json"]
+    return [bundle_path(model_folder)] + [os.path.join(model_folder, name) for name in legacy]
+
+
+def save_bundle(model_folder, bundle):
+    """
+    Write the bundle to the model folder, replacing the previous one atomically.
+    The content hash (see content_hash) is stored in the bundle and returned.
+    """
+    for model_name, input_space in bundle.input_spaces.items():
+        if input_space not in INPUT_SPACES:
+            raise ValueError(f"Unknown input space '{input_space}' for {model_name}, expected one of {INPUT_SPACES}")
+
+    bundle.created_at = bundle.created_at or time.time()
+    payload = bundle.payload()
+    payload["content_hash"] = content_hash(payload)
+    save_artifact(payload, bundle_path(model_folder))
+    bundle.content_hash = payload["content_hash"]
+    return bundle.content_hash
+
+
+def load_legacy_bundle(model_folder, mmap_mode=None):
+    """Load a model folder of loose (model, accuracy) pickles, scaler.pkl and explainer_stats.json."""
+    models = {}
+    accuracies = {}
+    artifact_paths = {}
+    scaler_path = os.path.join(model_folder, "scaler.pkl")
+    for model_name in MODEL_NAMES:
+        model_path = os.path.join(model_folder, f"{model_name}.pkl")
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+        # Load the model and its accuracy from the file
+        models[model_name], accuracies[model_name] = joblib.load(model_path, mmap_mode=mmap_mode)
+        artifact_paths[model_name] = model_path
+
+    # The voting ensemble is optional: the models are served without it if it is missing or cannot be loaded
+    ensemble_path = os.path.join(model_folder, f"{ENSEMBLE_NAME}.pkl")
+    if os.path.exists(ensemble_path):
+        try:
+            models[ENSEMBLE_NAME], accuracies[ENSEMBLE_NAME] = joblib.load(ensemble_path, mmap_mode=mmap_mode)
+            artifact_paths[ENSEMBLE_NAME] = ensemble_path
+        except Exception as e:
+            print(f"Skipping {ensemble_path}, it could not be loaded: {type(e).__name__}: {e}")
+
+    scaler = joblib.load(scaler_path, mmap_mode=mmap_mode)
+    artifact_paths[SCALER_ARTIFACT] = scaler_path
+    return ModelBundle(
+        models, accuracies, scaler, dict(LEGACY_INPUT_SPACES),
+        explainer_stats=load_training_stats(os.path.join(model_folder, "explainer_stats.json")),
+        source="legacy", artifact_paths=artifact_paths,
+    )
+
+
+def load_bundle(model_folder, mmap_mode='r'):
+    """
+    Load the model bundle of a model folder, memory-mapping its arrays unless mmap_mode is None.
+    Falls back to the legacy loose pickles when the folder has no bundle.
+    """
+    path = bundle_path(model_folder)
+    if not os.path.exists(path):
+        return load_legacy_bundle(model_folder, mmap_mode)
+
+    payload = joblib.load(path, mmap_mode=mmap_mode)
+    if payload.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"Unsupported model bundle format {payload.get('format')} in {path}")
+
+    entries = payload["models"]
+    return ModelBundle(
+        models={model_name: entry["estimator"] for model_name, entry in entries.items()},
+        accuracies={model_name: entry["accuracy"] for model_name, entry in entries.items()},
+        scaler=payload["scaler"],
+        input_spaces={model_name: entry["input_space"] for model_name, entry in entries.items()},
+        features=payload["features"],
+        target=payload["target"],
+        explainer_stats=payload["explainer_stats"],
+        metrics={model_name: entry["metrics"] for model_name, entry in entries.items()},
+        content_hash=payload["content_hash"],
+        created_at=payload["created_at"],
+    )
@@ -0,0 +1,190 @@
+import hashlib
+import os
+import threading
+import time
+
+import joblib
+
+from prediction_cache import file_signature
+
+# Hot-reloadable model artifacts for the server.
+# The registry holds one immutable ModelSet (models, accuracies, scaler, explainer statistics and the
+# version of those files). Requests take the current ModelSet once and use it to the end, while a reload
+# loads and validates the new artifacts in the background and then swaps the reference in one assignment,
+# so in-flight requests finish on the version they started with and nothing is served half-loaded.
+# Reloads are triggered by watching the artifact files or by calling reload() directly (the admin endpoint).
+
+
+def artifact_version(paths):
+    """
+    Return a short content hash of the given files, used as the model version.
+    Missing files are skipped, so optional artifacts do not prevent versioning.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def save_artifact(value, path):
+    """
+    Dump value with joblib to a temporary file and move it over path in one step.
+    The server memory-maps and watches the artifacts, so they must never be seen half-written
+    or truncated in place.
+    """
+    tmp_path = f"{path}.tmp"
+    joblib.dump(value, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class ModelSet:
+    """
+    One loaded version of the model artifacts. Never modified after loading, except for
+    objects derived from it (explainers) that are built on first use and cached per version.
+    """
+
+    def __init__(self, version, models, accuracies, scaler, explainer_stats, signature, predictors=None,
+                 input_spaces=None, cascade=None):
+        self.version = version
+        self.models = models
+        self.predictors = predictors or models  # What predict_proba is called on; may be compiled versions of models
+        self.input_spaces = input_spaces or {model_name: "scaled" for model_name in models}
+        self.accuracies = accuracies
+        self.cascade = cascade or []  # Stages of the cascade serving mode, see cascade.py
+        self.scaler = scaler
+        self.explainer_stats = explainer_stats
+        self.signature = signature  # File signature the artifacts were loaded from
+        self.loaded_at = time.time()
+        self.derived = {}
+        self.lock = threading.RLock()
+
+    def get_derived(self, key, build):
+        """Return the object cached under key for this version, building it with build() on first use."""
+        with self.lock:
+            if key not in self.derived:
+                self.derived[key] = build()
+            return self.derived[key]
+
+
+class ModelRegistry:
+    """
+    Keeps the current ModelSet and replaces it atomically when the artifacts change.
+    load_fn(version, signature) loads a ModelSet from the watched paths and validate_fn(model_set)
+    raises an exception if it must not be served. A failed reload keeps the current version.
+    """
+
+    def __init__(self, paths, load_fn, validate_fn=None, watch_interval=0):
+        self.paths = list(paths)
+        self.load_fn = load_fn
+        self.validate_fn = validate_fn
+        self.watch_interval = watch_interval
+        self.model_set = None
+        self.reload_lock = threading.Lock()  # Only one reload loads artifacts at a time
+        self.reloads = 0
+        self.last_error = None
+        self.last_attempt_signature = None
+        self.watcher = None
+
+    @property
+    def current(self):
+        """The ModelSet to serve requests with; take it once per request."""
+        return self.model_set
+
+    @property
+    def version(self):
+        """The version currently served, or None before the first load."""
+        model_set = self.model_set
+        return model_set.version if model_set else None
+
+    def load(self):
+        """Load and validate the artifacts on disk and return the new ModelSet, without serving it."""
+        signature = file_signature(self.paths)
+        model_set = self.load_fn(artifact_version(self.paths), signature)
+        if self.validate_fn:
+            self.validate_fn(model_set)
+        return model_set
+
+    def reload(self, force=False):
+        """
+        Load the artifacts and swap them in if they are valid and changed (or force is set).
+        Returns True if a new version is now served. Errors are recorded in last_error and, on the
+        first load, raised, since there is no previous version to fall back on.
+        """
+        with self.reload_lock:
+            signature = file_signature(self.paths)
+            self.last_attempt_signature = signature
+            if not force and self.model_set is not None and signature == self.model_set.signature:
+                return False
+            try:
+                model_set = self.load()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                if self.model_set is None:
+                    raise
+                print(f"Model reload failed, still serving version {self.model_set.version}: {self.last_error}")
+                return False
+
+            previous = self.model_set
+            self.model_set = model_set  # Atomic swap, requests holding the previous set are unaffected
+            self.last_error = None
+            if previous is not None:
+                self.reloads += 1
+                print(f"Reloaded models: version {previous.version} -> {model_set.version}")
+            return True
+
+    def reload_in_background(self, force=False):
+        """Start a reload in a background thread and return immediately."""
+        threading.Thread(target=self.reload, kwargs={"force": force}, daemon=True).start()
+
+    def watch(self):
+        """
+        Poll the artifact files every watch_interval seconds and reload when they change.
+        A change is only loaded once the files are unchanged for one interval, so a retraining run
+        that writes the artifacts one after another is picked up as a single new version.
+        """
+        pending = None
+        while True:
+            time.sleep(self.watch_interval)
+            signature = file_signature(self.paths)
+            if signature in (self.model_set.signature, self.last_attempt_signature):
+                pending = None
+                continue
+            if signature != pending:
+                pending = signature  # Wait for the files to settle
+                continue
+            pending = None
+            self.reload()
+
+    def start_watching(self):
+        """Start the file watcher thread if a watch interval is configured."""
+        if self.watch_interval > 0 and self.watcher is None:
+            self.watcher = threading.Thread(target=self.watch, daemon=True)
+            self.watcher.start()
+
+    def restart_watching(self):
+        """
+        Restart the file watcher in a forked worker process: threads do not survive fork, and the
+        reload lock may have been held by one of the parent's threads.
+        """
+        self.reload_lock = threading.Lock()
+        self.watcher = None
+        self.start_watching()
+
+    def status(self):
+        """Return the served version and the reload history."""
+        model_set = self.model_set
+        return {
+            "model_version": self.version,
+            "loaded_at": model_set.loaded_at if model_set else None,
+            "models": list(model_set.models) if model_set else [],
+            "input_spaces": dict(model_set.input_spaces) if model_set else {},
+            "cascade": list(model_set.cascade) if model_set else [],
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+            "watch_interval": self.watch_interval,
+        }
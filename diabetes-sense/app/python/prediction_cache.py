@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# In-process LRU/TTL cache for /predict results.
+# Entries are keyed on the ordered feature vector plus the selected models and explanation options,
+# and the whole cache is dropped when the signature of the loaded model files changes.
+
+
+def file_signature(paths):
+    """
+    Return a signature of the given files (modification time and size), used to detect changed models.
+    Missing files are included as None so that deleting a model also invalidates the cache.
+    """
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+class PredictionCache:
+    """
+    Thread-safe LRU cache with a per-entry time to live and hit/miss/eviction counters.
+    signature_fn is called on every lookup; when its value changes all cached entries are discarded.
+    """
+
+    def __init__(self, max_size=1024, ttl_seconds=3600, signature_fn=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.signature_fn = signature_fn
+        self.signature = signature_fn() if signature_fn else None
+        self.entries = OrderedDict()  # key -> (expiry time, value), least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def check_signature(self):
+        """Clear the cache if the watched files changed. Must be called with the lock held."""
+        if self.signature_fn is None:
+            return
+        signature = self.signature_fn()
+        if signature != self.signature:
+            self.entries.clear()
+            self.signature = signature
+            self.invalidations += 1
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss or an expired entry."""
+        with self.lock:
+            self.check_signature()
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]  # Drop the expired entry
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Store value under key, evicting the least recently used entries beyond max_size."""
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Discard every cached entry."""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Return the size and counters of the cache."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from dataset_store import CACHE_FOLDER
+from model_bundle import SCALER_ARTIFACT
+from model_registry import artifact_version
+
+# Persistent store of model probabilities for the offline tools (evaluation.py and its LIME explanations).
+# The probabilities of one model on one dataset are saved as a .npy file named by a hash of the model's
+# version, the dataset's content hash and the input space the rows were given in, and are memory-mapped
+# when read back, so a repeated analysis run skips inference entirely. The model version is the bundle's
+# content hash (which covers the scaler), or for legacy folders a hash of the model's file and, for models
+# trained on scaled rows, of scaler.pkl. The dataset is identified by the SHA-256 of its CSV, or for
+# generated rows such as LIME's neighbourhoods by a hash of the array itself. Changing either side changes
+# the name, so stale probabilities are never read: they are no longer used and are deleted first once the
+# folder is above max_bytes, least recently used first.
+
+# Bump when the stored layout changes, so previously stored probabilities are not read
+STORE_VERSION = 1
+
+# Folder of the stored probabilities (empty disables the store) and its size bound
+PREDICTION_STORE = os.getenv('PREDICTION_STORE', os.path.join(CACHE_FOLDER, 'predictions'))
+PREDICTION_STORE_BYTES = int(os.getenv('PREDICTION_STORE_BYTES', 256 * 1024 * 1024))
+
+# A stored entry: 32 hex digits and the .npy extension
+NAME_PATTERN = re.compile(r"^[0-9a-f]{32}\.npy$")
+
+
+def array_hash(matrix):
+    """Return the SHA-256 of an array's shape, type and values, identifying rows that have no dataset name."""
+    matrix = np.ascontiguousarray(matrix)
+    digest = hashlib.sha256(f"{matrix.dtype.str}{matrix.shape}".encode('utf-8'))
+    digest.update(matrix.tobytes())
+    return digest.hexdigest()
+
+
+def model_version(bundle, model_name):
+    """
+    Return a hash of a model of the bundle and of the scaling its rows go through. Legacy models are hashed
+    by their files, with scaler.pkl for models trained on scaled rows, as pickling a tree copies uninitialized
+    padding bytes and so is not reproducible.
+    """
+    if bundle.content_hash:
+        return f"{bundle.content_hash}/{model_name}"
+    paths = [bundle.artifact_paths[model_name]]
+    if bundle.input_spaces[model_name] == "scaled":
+        paths.append(bundle.artifact_paths[SCALER_ARTIFACT])
+    return f"{artifact_version(paths)}/{model_name}"
+
+
+def entry_name(model_key, dataset_key, input_space):
+    """Return the name of the stored probabilities of a model version on a dataset, given in an input space."""
+    key = json.dumps(
+        {"model": model_key, "dataset": dataset_key, "input_space": input_space, "version": STORE_VERSION},
+        sort_keys=True,
+    )
+    return f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}.npy"
+
+
+class PredictionStore:
+    """
+    Size-bounded LRU store of model probabilities in a folder, shared by every process using the folder.
+    """
+
+    def __init__(self, folder=PREDICTION_STORE, max_bytes=PREDICTION_STORE_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.bytes = None  # Size of the folder, computed on the first write
+        self.model_versions = {}  # (id of the bundle, model name) -> model version, hashed once per bundle
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def model_version(self, bundle, model_name):
+        """Return the version of a model of the bundle, computing it once per loaded bundle."""
+        key = (id(bundle), model_name)
+        with self.lock:
+            if key not in self.model_versions:
+                self.model_versions[key] = (bundle, model_version(bundle, model_name))  # Keeps the bundle (and its id) alive
+            return self.model_versions[key][1]
+
+    def get(self, name, rows):
+        """Return the stored probabilities of an entry as a read-only memory map, or None if it is not stored."""
+        try:
+            probabilities = np.load(self.path(name), mmap_mode='r')
+            os.utime(self.path(name))  # Mark as recently used for the eviction
+        except (OSError, ValueError):
+            probabilities = None
+        with self.lock:
+            if probabilities is None or len(probabilities) != rows:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return probabilities
+
+    def put(self, name, probabilities):
+        """Write the probabilities of an entry atomically, then evict the least recently used beyond max_bytes."""
+        temporary = f"{self.path(name)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            np.save(f, np.ascontiguousarray(probabilities))
+        os.replace(temporary, self.path(name))
+        with self.lock:
+            if self.bytes is None:
+                self.bytes = sum(entry.stat().st_size for entry in os.scandir(self.folder) if entry.is_file())
+            else:
+                self.bytes += os.path.getsize(self.path(name))
+            if self.bytes > self.max_bytes:
+                self.bytes = self.trim()
+
+    def predict_proba(self, bundle, model_name, X, dataset_key=None):
+        """
+        Return the probabilities of a model of the bundle for the raw rows X, from the store if they were
+        computed before. dataset_key identifies the rows, e.g. the SHA-256 of their dataset; by default the
+        rows are hashed.
+        """
+        input_space = bundle.input_spaces[model_name]
+        name = entry_name(self.model_version(bundle, model_name), dataset_key or array_hash(X), input_space)
+        probabilities = self.get(name, len(X))
+        if probabilities is None:
+            probabilities = bundle.models[model_name].predict_proba(bundle.model_input(model_name, X))
+            self.put(name, probabilities)
+        return probabilities
+
+    def trim(self):
+        """
+        Delete the least recently used entries until the folder is below 90% of max_bytes.
+        Returns the remaining size of the folder. Called with the lock held.
+        """
+        files = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.folder) if entry.is_file() and NAME_PATTERN.match(entry.name)
+        )
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.evictions += 1
+            except OSError:
+                pass  # Already deleted by another process
+        return total
+
+    def stats(self):
+        """Return the counters of the store."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "folder": self.folder,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+def default_store():
+    """Return the store in PREDICTION_STORE, or None when the store is disabled."""
+    return PredictionStore() if PREDICTION_STORE else None
@@ -0,0 +1,345 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Out-of-core preprocessing of the Pima / EHR extracts.
+# The cleaning steps of preprocessing.py (dropping rows with impossible zeros, median imputation,
+# IQR outlier filtering and class undersampling) run on CSV chunks, so the input never has to fit in memory.
+# Medians and quartiles come from mergeable quantile sketches built while streaming the chunks. Each IQR
+# filter is computed on the rows left by the previous ones, as in the original script, so the quartiles
+# of a filter are sketched in the pass after the previous filter's bounds are known.
+# The cleaned rows are written to a columnar .npy file (each column stored contiguously) and optionally to CSV.
+
+# Columns where a zero means "not measured"; the row is dropped
+DROP_ZERO_COLUMNS = ['Glucose', 'BloodPressure', 'BMI']
+
+# Columns where a zero is replaced by the column median
+IMPUTE_ZERO_COLUMNS = ['SkinThickness', 'Pregnancies', 'Insulin']
+
+# Columns filtered with the IQR method, in this order
+OUTLIER_COLUMNS = ['BMI', 'Insulin', 'BloodPressure', 'Pregnancies']
+
+
+class QuantileSketch:
+    """
+    Mergeable summary of a stream of values for quantile queries.
+    Keeps the distinct values and their counts, which is exact as long as the number of distinct values
+    stays within capacity. Beyond that, neighbouring values are merged into capacity / 2 buckets of equal
+    weight, which bounds the rank error of a quantile by about 2 / capacity of the count.
+    Sketches built on separate chunks can be merged into the sketch of their union.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.values = np.empty(0)
+        self.weights = np.empty(0)
+
+    @property
+    def count(self):
+        """The number of values summarized."""
+        return float(self.weights.sum())
+
+    def add(self, values, weights):
+        """Add values with the given weights and compact the summary if it exceeds capacity."""
+        values, inverse = np.unique(np.concatenate([self.values, values]), return_inverse=True)
+        self.weights = np.bincount(inverse, weights=np.concatenate([self.weights, weights]))
+        self.values = values
+        if len(self.values) > self.capacity:
+            self.compact()
+
+    def update(self, values):
+        """Add a chunk of values, ignoring missing ones."""
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        self.add(values, np.ones(len(values)))
+
+    def merge(self, other):
+        """Add the values summarized by another sketch."""
+        self.add(other.values, other.weights)
+
+    def compact(self):
+        """Merge neighbouring values into buckets of equal weight, each represented by its weighted mean."""
+        buckets = self.capacity // 2
+        cumulative = np.cumsum(self.weights)
+        bucket = np.minimum((cumulative - self.weights) * buckets // cumulative[-1], buckets - 1).astype(int)
+        weights = np.bincount(bucket, weights=self.weights)
+        totals = np.bincount(bucket, weights=self.values * self.weights)
+        used = weights > 0
+        self.values = totals[used] / weights[used]
+        self.weights = weights[used]
+
+    def quantile(self, q):
+        """
+        Return the q quantile with linear interpolation between the two nearest values,
+        like pandas.Series.quantile (and median for q = 0.5).
+        """
+        if not len(self.values):
+            return float('nan')
+        # Position of the quantile among the sorted values (0-based, as in pandas)
+        position = q * (self.count - 1)
+        cumulative = np.cumsum(self.weights)
+        lower = int(np.floor(position))
+        fraction = position - lower
+        # Value at 0-based rank r is the first value whose cumulative weight exceeds r
+        lower_value = self.values[min(np.searchsorted(cumulative, lower, side='right'), len(self.values) - 1)]
+        upper_value = self.values[min(np.searchsorted(cumulative, lower + 1, side='right'), len(self.values) - 1)]
+        return float(lower_value + (upper_value - lower_value) * fraction)
+
+
+class ColumnarWriter:
+    """
+    Write rows to a 2-D .npy file in Fortran (column-major) order without holding them in memory.
+    Each column is appended to its own temporary file; close() writes the .npy header and then the
+    columns one after another, which is exactly the layout of a Fortran-ordered array. Unless sidecar is
+    False, the column names are written next to it, in <path without .npy>.columns.json.
+    The temporary files are unique to the writer, and the .npy file is only swapped in once complete, so
+    several processes can write the same path at once.
+    """
+
+    def __init__(self, path, columns, dtype=np.float64, sidecar=True):
+        self.path = path
+        self.columns = list(columns)
+        self.dtype = np.dtype(dtype)
+        self.sidecar = sidecar
+        self.rows = 0
+        self.parts = [temporary_file(path, ".part") for _ in self.columns]
+
+    def write(self, frame):
+        """Append the rows of a DataFrame (with at least the writer's columns)."""
+        for part, column in zip(self.parts, self.columns):
+            part.write(np.ascontiguousarray(frame[column].to_numpy(dtype=self.dtype)).tobytes())
+        self.rows += len(frame)
+
+    def close(self):
+        """Assemble the column files into the .npy file and return its path."""
+        for part in self.parts:
+            part.close()
+
+        with temporary_file(self.path, ".tmp") as f:
+            header = {'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': True,
+                      'shape': (self.rows, len(self.columns))}
+            np.lib.format.write_array_header_1_0(f, header)
+            for part in self.parts:
+                with open(part.name, "rb") as column:
+                    for block in iter(lambda: column.read(1 << 24), b""):
+                        f.write(block)
+                os.remove(part.name)
+        os.replace(f.name, self.path)
+
+        if self.sidecar:
+            with temporary_file(self.path, ".tmp", mode="w") as sidecar:
+                json.dump({"columns": self.columns, "rows": self.rows}, sidecar)
+            os.replace(sidecar.name, columns_path(self.path))
+        return self.path
+
+
+def temporary_file(path, suffix, mode="wb"):
+    """Open a new file with a unique name next to path, for writing what is then moved to path."""
+    handle, name = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix=suffix, dir=os.path.dirname(path) or ".")
+    os.close(handle)
+    return open(name, mode)  # Opened by name, so the file's name attribute is its path
+
+
+def columns_path(path):
+    """Return the path of the column names written next to a columnar .npy file."""
+    return os.path.splitext(path)[0] + ".columns.json"
+
+
+def read_columnar(path):
+    """
+    Open a columnar .npy file written by ColumnarWriter as a memory-mapped DataFrame-free view.
+    Returns a tuple (matrix, columns), where matrix is a read-only memmap of shape (rows, columns).
+    """
+    with open(columns_path(path)) as f:
+        columns = json.load(f)["columns"]
+    return np.load(path, mmap_mode='r'), columns
+
+
+class PreprocessingPipeline:
+    """
+    Clean a CSV file chunk by chunk: drop rows with a zero in DROP_ZERO_COLUMNS, replace zeros in
+    IMPUTE_ZERO_COLUMNS with the column median, then remove the IQR outliers of each of OUTLIER_COLUMNS in turn.
+    fit() streams the file once per dependent statistic to learn the medians and IQR bounds,
+    transform() streams it once more to write the cleaned rows.
+    """
+
+    def __init__(self, source, chunksize=100_000, drop_zero_columns=DROP_ZERO_COLUMNS,
+                 impute_zero_columns=IMPUTE_ZERO_COLUMNS, outlier_columns=OUTLIER_COLUMNS,
+                 iqr_factor=1.5, sketch_capacity=4096):
+        self.source = source
+        self.chunksize = chunksize
+        self.drop_zero_columns = list(drop_zero_columns)
+        self.impute_zero_columns = list(impute_zero_columns)
+        self.outlier_columns = list(outlier_columns)
+        self.iqr_factor = iqr_factor
+        self.sketch_capacity = sketch_capacity
+        self.medians = None  # Column -> median used for imputation
+        self.bounds = []  # (column, lower bound, upper bound) of each IQR filter, in order
+        self.passes = 0
+        self.stats = {}
+
+    def chunks(self):
+        """Yield the source CSV as DataFrame chunks."""
+        self.passes += 1
+        yield from pd.read_csv(self.source, chunksize=self.chunksize)
+
+    def clean(self, chunk, stats=None):
+        """
+        Apply the steps learned so far to one chunk: dropping zeros, imputation (once the medians are known)
+        and the IQR filters whose bounds are known. Row counts removed by each step are added to stats.
+        """
+        stats = stats if stats is not None else {}
+        kept = chunk[(chunk[self.drop_zero_columns] != 0).all(axis=1)]
+        stats["dropped_zero"] = stats.get("dropped_zero", 0) + len(chunk) - len(kept)
+        chunk = kept
+
+        if self.medians is not None:
+            for column in self.impute_zero_columns:
+                stats[f"imputed_{column}"] = stats.get(f"imputed_{column}", 0) + int((chunk[column] == 0).sum())
+                chunk = chunk.assign(**{column: chunk[column].replace(0, self.medians[column])})
+
+        for column, lb, ub in self.bounds:
+            kept = chunk[(chunk[column] >= lb) & (chunk[column] <= ub)]
+            stats[f"outliers_{column}"] = stats.get(f"outliers_{column}", 0) + len(chunk) - len(kept)
+            chunk = kept
+        return chunk
+
+    def fit(self):
+        """
+        Learn the imputation medians and the IQR bounds of every outlier column.
+        A column's quartiles are sketched in the first pass where all steps before its filter are known;
+        filters on columns untouched by imputation can share the pass that learns the medians.
+        """
+        self.medians = None
+        self.bounds = []
+        while True:
+            # Decide what this pass can sketch
+            sketch_medians = self.medians is None
+            next_filter = self.outlier_columns[len(self.bounds)] if len(self.bounds) < len(self.outlier_columns) else None
+            if next_filter is not None and sketch_medians and next_filter in self.impute_zero_columns:
+                next_filter = None  # Its quartiles depend on the imputed values, sketch it next pass
+            if not sketch_medians and next_filter is None:
+                break
+
+            sketches = {}
+            if sketch_medians:
+                sketches.update({column: QuantileSketch(self.sketch_capacity) for column in self.impute_zero_columns})
+            if next_filter is not None:
+                sketches.setdefault(next_filter, QuantileSketch(self.sketch_capacity))
+
+            for chunk in self.chunks():
+                chunk = self.clean(chunk)
+                for column, sketch in sketches.items():
+                    sketch.update(chunk[column].to_numpy())
+
+            if sketch_medians:
+                self.medians = {column: sketches[column].quantile(0.5) for column in self.impute_zero_columns}
+            if next_filter is not None:
+                q1, q3 = sketches[next_filter].quantile(0.25), sketches[next_filter].quantile(0.75)
+                iqr = q3 - q1
+                self.bounds.append((next_filter, q1 - self.iqr_factor * iqr, q3 + self.iqr_factor * iqr))
+        return self
+
+    def transform(self, npy_path, csv_path=None, target='Outcome', keep_frame=False):
+        """
+        Stream the cleaned rows into a columnar .npy file (and a CSV file if csv_path is given).
+        With keep_frame, the cleaned rows are also kept in memory as self.frame, a DataFrame with the source
+        row index and the column types read from the CSV.
+        Returns a dictionary with the number of rows read, removed by each step and written, and the class counts.
+        """
+        stats = {"rows_read": 0}
+        class_counts = {}
+        writer = None
+        frames = []
+        source_dtypes = None
+        for index, chunk in enumerate(self.chunks()):
+            stats["rows_read"] += len(chunk)
+            if source_dtypes is None:
+                source_dtypes = chunk.dtypes
+            chunk = self.clean(chunk, stats)
+            if keep_frame:
+                frames.append(chunk)
+            if writer is None:
+                writer = ColumnarWriter(npy_path, chunk.columns)
+            writer.write(chunk)
+            if csv_path:
+                chunk.to_csv(csv_path, mode="w" if index == 0 else "a", header=index == 0, index=False)
+            for label, count in chunk[target].value_counts().items():
+                class_counts[int(label)] = class_counts.get(int(label), 0) + int(count)
+
+        writer.close()
+        stats["rows_written"] = writer.rows
+        stats["class_counts"] = class_counts
+        self.stats = stats
+        if keep_frame:
+            self.frame = restore_dtypes(pd.concat(frames), source_dtypes)
+        return stats
+
+
+def restore_dtypes(frame, dtypes):
+    """
+    Cast the columns of a cleaned frame back to the types they were read with, where no value was changed
+    into one the type cannot hold (e.g. an integer column imputed with a fractional median stays float).
+    """
+    for column, dtype in dtypes.items():
+        values = frame[column]
+        if values.dtype != dtype and np.issubdtype(dtype, np.integer) and (values % 1 == 0).all():
+            frame[column] = values.astype(dtype)
+    return frame
+
+
+def undersample(npy_path, output_path, target='Outcome', random_state=42, csv_path=None, chunksize=100_000):
+    """
+    Balance a columnar dataset by undersampling every class to the size of the smallest one, and shuffle it.
+    Rows of each class are selected uniformly without replacement in one streaming pass: each chunk gets a
+    hypergeometric share of the rows still to select, then that many of its rows are picked at random.
+    The selected rows are scattered to random positions of the memory-mapped output, so only the
+    row permutation (8 bytes per output row) is held in memory.
+    Returns the number of rows written per class.
+    """
+    matrix, columns = read_columnar(npy_path)
+    rng = np.random.RandomState(random_state)
+    labels_column = columns.index(target)
+
+    # Count the classes, then select as many rows of each as the smallest class has
+    labels, counts = np.unique(matrix[:, labels_column], return_counts=True)
+    size = int(counts.min())
+    remaining = dict(zip(labels.tolist(), counts.tolist()))
+    to_select = {label: size for label in remaining}
+
+    total = size * len(labels)
+    positions = rng.permutation(total)
+    output = np.lib.format.open_memmap(f"{output_path}.tmp", mode="w+", dtype=matrix.dtype,
+                                       shape=(total, len(columns)), fortran_order=True)
+    written = 0
+    for start in range(0, matrix.shape[0], chunksize):
+        chunk = np.asarray(matrix[start:start + chunksize])
+        selected = []
+        for label in remaining:
+            rows = np.flatnonzero(chunk[:, labels_column] == label)
+            others = remaining[label] - len(rows)
+            take = rng.hypergeometric(len(rows), others, to_select[label]) if to_select[label] and others else to_select[label]
+            take = min(take, len(rows))
+            selected.append(rows[rng.choice(len(rows), take, replace=False)] if take else rows[:0])
+            remaining[label] = others
+            to_select[label] -= take
+        selected = np.sort(np.concatenate(selected))
+        output[positions[written:written + len(selected)]] = chunk[selected]
+        written += len(selected)
+
+    output.flush()
+    del output
+    os.replace(f"{output_path}.tmp", output_path)
+    with open(columns_path(output_path), "w") as f:
+        json.dump({"columns": columns, "rows": total}, f)
+
+    if csv_path:
+        balanced, _ = read_columnar(output_path)
+        for start in range(0, total, chunksize):
+            frame = pd.DataFrame(np.asarray(balanced[start:start + chunksize]), columns=columns)
+            frame = frame.apply(lambda column: column.astype(np.int64) if (column % 1 == 0).all() else column)
+            frame.to_csv(csv_path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+    return {int(label): size for label in labels}
@@ -0,0 +1,201 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+# Thread-safe matplotlib rendering for the server (explanation charts) and evaluation.py (ROC curves and
+# LIME figures). Every chart is drawn on its own matplotlib Figure with an Agg canvas; pyplot and its
+# global figure manager are never used, so renders do not have to be serialized behind a lock.
+# A ChartRenderer runs the renders on a bounded process pool, so they use several cores instead of
+# contending for one interpreter. Each process keeps templates of the bar chart layout: a template is
+# a figure with its axes and one bar per feature already created, and a render only updates the bar
+# widths, colors, title and axis limits before encoding the PNG. The pool processes create the
+# template of the default 8-feature layout when they start.
+
+# Templates kept per process (or thread) for the bar chart layouts in use, least recently used evicted first
+MAX_TEMPLATES = 8
+
+# Layouts kept per template: margins computed by tight_layout for a title, axis label and set of ticks
+MAX_LAYOUTS = 256
+
+# Templates of the current thread; pool processes render in a single thread
+local = threading.local()
+
+
+class BarChartTemplate:
+    """
+    A horizontal bar chart figure for a fixed list of bar labels and a fixed size, redrawn with new bar data.
+    """
+
+    def __init__(self, labels, width, height):
+        # Import matplotlib only when a chart is actually rendered
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.figure = Figure(figsize=(width, height))
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+        self.bars = self.axes.barh(list(labels), [0.0] * len(labels), height=0.8)
+        self.default_layout = self.subplot_params()
+        self.layouts = OrderedDict()  # (title, x label, tick labels) -> subplot params
+
+    def subplot_params(self):
+        params = self.figure.subplotpars
+        return {"left": params.left, "right": params.right, "bottom": params.bottom, "top": params.top}
+
+    def render(self, spec, dpi):
+        """Draw the bars of a chart spec with the template's labels and return the PNG bytes."""
+        for bar, item in zip(self.bars, spec["bars"]):
+            bar.set_width(item["value"])
+            bar.set_color(item["color"])
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self.axes.set_title(spec["title"])
+        self.axes.set_xlabel(spec["x_label"])
+        tick_labels = self.axes.get_xticklabels()
+        for label in tick_labels:
+            # Rotate x-axis labels slightly to prevent overlapping
+            label.set(rotation=45, ha='right')
+
+        # tight_layout is the slowest step after encoding, so the margins are computed once per title,
+        # axis label and tick labels. They are computed from the default margins, so a chart spec always
+        # renders to the same image whichever charts the template drew before.
+        key = (spec["title"], spec["x_label"], tuple(label.get_text() for label in tick_labels))
+        layout = self.layouts.get(key)
+        if layout is None:
+            self.figure.subplots_adjust(**self.default_layout)
+            self.figure.tight_layout()
+            layout = self.layouts[key] = self.subplot_params()
+            if len(self.layouts) > MAX_LAYOUTS:
+                self.layouts.popitem(last=False)
+        else:
+            self.layouts.move_to_end(key)
+            self.figure.subplots_adjust(**layout)
+
+        buf = BytesIO()
+        self.figure.savefig(buf, format="png", dpi=dpi)
+        return buf.getvalue()
+
+
+def get_template(labels, width, height):
+    """Return the current thread's template for the given bar labels and size, creating it on first use."""
+    templates = getattr(local, "templates", None)
+    if templates is None:
+        templates = local.templates = OrderedDict()
+    key = (tuple(labels), float(width), float(height))
+    template = templates.get(key)
+    if template is None:
+        template = templates[key] = BarChartTemplate(labels, width, height)
+        if len(templates) > MAX_TEMPLATES:
+            templates.popitem(last=False)
+    else:
+        templates.move_to_end(key)
+    return template
+
+
+def create_templates(layouts):
+    """Create the templates of the given (labels, width, height) layouts; the initializer of the pool processes."""
+    for labels, width, height in layouts:
+        get_template(labels, width, height)
+
+
+def render_bar_chart(spec, width, height, dpi):
+    """Render a horizontal bar chart spec (see charts.chart_spec) as PNG bytes on a template."""
+    labels = [bar["label"] for bar in spec["bars"]]
+    return get_template(labels, width, height).render(spec, dpi)
+
+
+def render_roc_curves(curves, title, width=6.4, height=4.8, dpi=100):
+    """
+    Render ROC curves as PNG bytes. curves is a list of (false positive rates, true positive rates, label);
+    the diagonal of a random classifier is drawn for reference.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(width, height))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    for fpr, tpr, label in curves:
+        axes.plot(fpr, tpr, label=label)
+    axes.plot([0, 1], [0, 1], "k--")
+    axes.set_xlabel("False Positive Rate")
+    axes.set_ylabel("True Positive Rate")
+    axes.set_title(title)
+    axes.legend(loc="lower right")
+
+    buf = BytesIO()
+    figure.savefig(buf, format="png", dpi=dpi)
+    return buf.getvalue()
+
+
+class ChartRenderer:
+    """
+    Runs the render functions of this module on a bounded process pool, or in the calling thread
+    when workers is 0. templates lists the (labels, width, height) bar chart layouts each pool
+    process creates when it starts.
+    """
+
+    def __init__(self, workers=2, templates=()):
+        self.workers = workers
+        self.templates = list(templates)
+        self.executor = None  # Created on first use, so importing the app does not start worker processes
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        """Return the process pool, creating it on first use; None when rendering in the calling thread."""
+        with self.lock:
+            if self.executor is None and self.workers > 0:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=create_templates, initargs=(self.templates,),
+                )
+            return self.executor
+
+    def submit(self, function, *args):
+        """Schedule function(*args) on the pool and return its Future; without a pool, run it straight away."""
+        executor = self.get_executor()
+        if executor is not None:
+            return executor.submit(function, *args)
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def run(self, function, *args):
+        """
+        Run function(*args) on the pool and return its result. If a pool process died, the pool is
+        replaced for the next call and this call renders in the calling thread instead.
+        """
+        executor = self.get_executor()
+        if executor is None:
+            return function(*args)
+        try:
+            return executor.submit(function, *args).result()
+        except BrokenProcessPool:
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = None
+            return function(*args)
+
+    def render_bar_chart(self, spec, width, height, dpi):
+        return self.run(render_bar_chart, spec, width, height, dpi)
+
+    def render_roc_curves(self, curves, title, width=6.4, height=4.8, dpi=100):
+        return self.run(render_roc_curves, curves, title, width, height, dpi)
+
+    def start(self):
+        """Start the pool processes now rather than on the first render."""
+        executor = self.get_executor()
+        if executor is not None:
+            executor.submit(os.getpid).result()
+
+    def shutdown(self):
+        """Stop the pool processes, waiting for the renders in progress."""
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
@@ -1,97 +1,72 @@
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
-import joblib
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import accuracy_score
-import pandas as pd
-
-# Load the models
-model_folder = r"C:\Users\tayye\Desktop\Diabetes-Prediction-using-Machine-Learning-and-Explainable-AI-Techniques\diabetes-sense\app\models"
-model_names = ["logistic_regression.pkl", "random_forest.pkl", "gradient_boosting.pkl"]
-models = [joblib.load(model_folder + "\\" + name)[0] for name in model_names]
-
-# Load the data
-data = pd.read_pickle(r"C:\Users\tayye\Desktop\Diabetes-Prediction-using-Machine-Learning-and-Explainable-AI-Techniques\diabetes-sense\app\data\preprocessed_pima.pkl")
-X = data[['Pregnancies', 'Glucose', 'BloodPressure', 'SkinThickness', 'Insulin', 'BMI', 'DiabetesPedigreeFunction', 'Age']]
-y = data['Outcome']
-
-# Split the data
-from sklearn.model_selection import train_test_split
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=42)
-
-# Standardize the data
-from sklearn.preprocessing import StandardScaler
-scaler = StandardScaler()
-X_train_scaled = scaler.fit_transform(X_train)
-X_test_scaled = scaler.transform(X_test)
-
-# Save the test data to a CSV file for manual testing
-X_test_with_labels = X_test.copy()
-X_test_with_labels['Outcome'] = y_test
-X_test_with_labels.to_csv(r"C:\Users\tayye\Desktop\Diabetes-Prediction-using-Machine-Learning-and-Explainable-AI-Techniques\diabetes-sense\app\data\test_data.csv", index=False)
-print("Test data saved to test_data.csv")
-
-# Calculate accuracies and confidence scores
-accuracy_train = []
-accuracy_test = []
-confidence_scores = []
-
-for model in models:
-    if isinstance(model, RandomForestClassifier):
-        y_train_pred = model.predict(X_train)
-        y_test_pred = model.predict(X_test)
-        confidence = np.mean([max(proba) for proba in model.predict_proba(X_test)])
-    else:
-        y_train_pred = model.predict(X_train_scaled)
-        y_test_pred = model.predict(X_test_scaled)
-        confidence = np.mean([max(proba) for proba in model.predict_proba(X_test_scaled)])
-    
-    accuracy_train.append(accuracy_score(y_train, y_train_pred))
-    accuracy_test.append(accuracy_score(y_test, y_test_pred))
-    confidence_scores.append(confidence)
-
-# Sample LIME scores (replace with actual LIME scores if available)
-lime_scores = [0.85, 0.80, 0.82]
-
-# Print the calculated values for verification
-print("Training Accuracies:", accuracy_train)
-print("Test Accuracies:", accuracy_test)
+import os
+from evaluation_engine import load_report
+
+# Load the evaluation report written by evaluation.py, instead of scoring the models again
+evaluation_folder = os.path.join(os.path.dirname(__file__), '..', 'evaluation')
+report = load_report(evaluation_folder)
+datasets = report["datasets"]
+model_names = report["models"]
+labels = [name.replace("_", " ").title() for name in model_names]
+print(f"Evaluation report of model version {report['model_version']}")
+
+# Accuracies, confidence intervals and confidence scores from the report
+def accuracies(dataset):
+    """Return each model's accuracy on a dataset of the report and the distances to its interval's bounds."""
+    results = [datasets[dataset]["models"][name] for name in model_names]
+    values = np.array([result["metrics"]["accuracy"] for result in results])
+    intervals = [result["intervals"].get("accuracy") or [value, value] for result, value in zip(results, values)]
+    errors = np.array([[value - low for (low, _), value in zip(intervals, values)],
+                       [high - value for (_, high), value in zip(intervals, values)]])
+    return values, errors
+
+accuracy_test, errors_test = accuracies("test")
+confidence_scores = [datasets["test"]["models"][name]["mean_confidence"] for name in model_names]
+lime_scores = [report.get("lime", {}).get(name, {}).get("mean_surrogate_r2", np.nan) for name in model_names]
+
+# Print the values for verification
+if "train" in datasets:
+    accuracy_train, errors_train = accuracies("train")
+    print("Training Accuracies:", accuracy_train.tolist())
+print("Test Accuracies:", accuracy_test.tolist())
 print("Confidence Scores:", confidence_scores)
 print("LIME Scores:", lime_scores)
 
 # Plotting accuracy/confidence comparison
 plt.figure(figsize=(18, 6))
 
-# Training and Test Accuracy
+# Training and Test Accuracy, with their bootstrap confidence intervals
 plt.subplot(1, 3, 1)
 x = np.arange(len(model_names))
 width = 0.35
 
-plt.bar(x - width/2, accuracy_train, width, label='Train Accuracy')
-plt.bar(x + width/2, accuracy_test, width, label='Test Accuracy')
+if "train" in datasets:
+    plt.bar(x - width/2, accuracy_train, width, yerr=errors_train, capsize=4, label='Train Accuracy')
+plt.bar(x + width/2, accuracy_test, width, yerr=errors_test, capsize=4, label='Test Accuracy')
 
 plt.xlabel('Models')
 plt.ylabel('Accuracy')
 plt.title('Model Accuracy Comparison')
-plt.xticks(x, ['Logistic Regression', 'Random Forest', 'Gradient Boosting'])
+plt.xticks(x, labels)
 plt.legend()
 
 # Confidence Scores Comparison
 plt.subplot(1, 3, 2)
-sns.barplot(x=['Logistic Regression', 'Random Forest', 'Gradient Boosting'], y=confidence_scores)
+sns.barplot(x=labels, y=confidence_scores)
 
 plt.xlabel('Models')
 plt.ylabel('Confidence Score')
 plt.title('Model Confidence Comparison')
 
-# LIME Explainable AI Comparison
+# LIME Explainable AI Comparison: R² of the local surrogates around the explained test instances
 plt.subplot(1, 3, 3)
-sns.barplot(x=['Logistic Regression', 'Random Forest', 'Gradient Boosting'], y=lime_scores)
+sns.barplot(x=labels, y=lime_scores)
 
 plt.xlabel('Models')
-plt.ylabel('LIME Score')
+plt.ylabel('LIME Score (surrogate R²)')
 plt.title('LIME Explainable AI Comparison')
 
 plt.tight_layout()
-plt.show()
\ No newline at end of file
+plt.show()
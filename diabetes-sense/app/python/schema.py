@@ -0,0 +1,7 @@
+# Schema of the Pima diabetes data shared by preprocessing, training, evaluation and serving.
+
+# Feature columns, in the order the models and the scaler expect them
+FEATURES = ['Pregnancies', 'Glucose', 'BloodPressure', 'SkinThickness', 'Insulin', 'BMI', 'DiabetesPedigreeFunction', 'Age']
+
+# Target column: 1 for diabetic, 0 for not diabetic
+TARGET = 'Outcome'
@@ -0,0 +1,389 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import as_completed
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+
+# Hyperparameter search shared by ml_model.py and the /tune endpoint.
+# Two modes are offered:
+# - "grid": every candidate is evaluated on every fold with its full parameters (like GridSearchCV)
+# - "halving": successive halving, where all candidates start with a small resource (training samples,
+#   or n_estimators for forests and boosting) and only the best 1/factor of them move on to the next,
+#   larger resource. Tree ensembles are grown with warm_start between rungs instead of being refitted.
+# Searches can share a wall-clock / fit-count budget, the folds of a SearchData object and a persisted
+# SearchReport, so candidates already evaluated on the same data are not fitted again.
+
+SEARCH_MODES = ["grid", "halving"]
+
+# Resource of the first halving round, per resource type, unless min_resource is given
+DEFAULT_MIN_RESOURCE = {"n_estimators": 10, "n_samples": 30}
+
+
+class SearchData:
+    """
+    The training matrix, labels and cross-validation folds shared by the searches of all model families.
+    The folds, the per-fold sample orders used for n_samples halving and the data hash are computed once.
+    """
+
+    def __init__(self, X, y, n_splits=5, shuffle=False, random_state=None):
+        self.X = np.ascontiguousarray(X, dtype=float)
+        self.y = np.asarray(y)
+        cv = StratifiedKFold(n_splits=n_splits, shuffle=shuffle, random_state=random_state if shuffle else None)
+        self.splits = list(cv.split(self.X, self.y))
+
+        # Order each fold's training rows so that any prefix keeps the class balance of the fold
+        rng = np.random.RandomState(0)
+        self.sample_orders = [self.stratified_order(train, rng) for train, _ in self.splits]
+
+        digest = hashlib.sha256()
+        digest.update(self.X.tobytes())
+        digest.update(self.y.tobytes())
+        digest.update(json.dumps([n_splits, shuffle, random_state]).encode())
+        self.data_hash = digest.hexdigest()[:16]
+
+    def stratified_order(self, train, rng):
+        """Return the training indices shuffled and interleaved by class, so prefixes stay stratified."""
+        permuted = rng.permutation(train)
+        labels = self.y[permuted]
+        keys = np.empty(len(permuted))
+        for label in np.unique(labels):
+            mask = labels == label
+            keys[mask] = (np.arange(mask.sum()) + 0.5) / mask.sum()
+        return permuted[np.argsort(keys, kind='stable')]
+
+
+class SearchBudget:
+    """
+    A wall-clock and/or fit-count budget shared by several searches. The clock starts on first use.
+    """
+
+    def __init__(self, max_seconds=None, max_fits=None):
+        self.max_seconds = max_seconds
+        self.max_fits = max_fits
+        self.started = None
+        self.fits = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the clock, if it is not running yet."""
+        if self.started is None:
+            self.started = time.monotonic()
+
+    def charge(self, fits=1):
+        """Count fits against the budget."""
+        with self.lock:
+            self.fits += fits
+
+    def remaining_fits(self):
+        """Return how many more fits the budget allows."""
+        return math.inf if self.max_fits is None else max(self.max_fits - self.fits, 0)
+
+    def exhausted(self):
+        """Return True once the time or fit budget has been used up."""
+        if self.max_fits is not None and self.fits >= self.max_fits:
+            return True
+        return self.max_seconds is not None and self.started is not None and \
+            time.monotonic() - self.started >= self.max_seconds
+
+
+class SearchReport:
+    """
+    Persisted record of every (candidate, resource) evaluation and search summary, grouped by data hash.
+    Stored as JSON and written atomically, so it can be shared by ml_model.py and the server.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.datasets = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.datasets = json.load(f).get("datasets", {})
+
+    def dataset(self, data_hash):
+        """Return the section of the report for one data hash. Must be called with the lock held."""
+        return self.datasets.setdefault(data_hash, {"evaluations": {}, "searches": {}})
+
+    def lookup(self, data_hash, key):
+        """Return the fold scores recorded for key, or None if it was never evaluated on this data."""
+        with self.lock:
+            scores = self.datasets.get(data_hash, {}).get("evaluations", {}).get(key)
+        return None if scores is None else [np.nan if score is None else score for score in scores]
+
+    def record(self, data_hash, key, scores):
+        """Record the fold scores of one evaluation."""
+        with self.lock:
+            self.dataset(data_hash)["evaluations"][key] = [None if np.isnan(score) else score for score in scores]
+
+    def record_search(self, data_hash, name, summary):
+        """Record the summary of a finished search."""
+        with self.lock:
+            self.dataset(data_hash)["searches"][name] = summary
+
+    def save(self):
+        """Write the report to disk, replacing the previous file atomically."""
+        if not self.path:
+            return
+        with self.lock:
+            content = json.dumps({"datasets": self.datasets}, indent=2, default=str)
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(content)
+        os.replace(temp_path, self.path)
+
+
+def fit_and_score(estimator, params, resource_name, resource, X, y, train, test, scoring, previous=None,
+                  keep_model=False):
+    """
+    Fit one candidate on one fold and score it. Runs in a worker process when an executor is used.
+    For the n_estimators resource the model is fitted with warm_start, and previous (the same candidate
+    and fold fitted at a smaller resource) is grown instead of starting from scratch.
+    Returns (score, fitted model if keep_model else None); failed fits score NaN,
+    like GridSearchCV's default error_score.
+    """
+    try:
+        if previous is not None:
+            model = previous
+        else:
+            model = clone(estimator).set_params(**params)
+            if resource_name == "n_estimators":
+                model.set_params(warm_start=True)
+        if resource_name == "n_estimators":
+            model.set_params(n_estimators=int(resource))
+        elif resource_name == "n_samples":
+            train = train[:int(resource)]
+
+        model.fit(X[train], y[train])
+        score = float(check_scoring(model, scoring=scoring)(model, X[test], y[test]))
+        return score, model if keep_model else None
+    except Exception:
+        return np.nan, None
+
+
+class SuccessiveHalvingSearch:
+    """
+    Search one model family's parameter grid in "grid" or "halving" mode.
+    In halving mode, resource is "n_estimators" (default for estimators that have it) or "n_samples";
+    when it is n_estimators, the n_estimators values of the grid only set the maximum resource.
+    """
+
+    def __init__(self, name, estimator, param_grid, mode="grid", resource=None, factor=3,
+                 min_resource=None, scoring='accuracy', refit=True):
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+        self.name = name
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.mode = mode
+        if resource is None and mode == "halving":
+            resource = "n_estimators" if "n_estimators" in estimator.get_params() else "n_samples"
+        self.resource = resource if mode == "halving" else None
+        self.factor = factor
+        self.min_resource = min_resource
+        self.scoring = scoring
+        self.refit = refit
+
+    def plan(self, data):
+        """
+        Return (candidates, rungs), where rungs is a list of (resource, number of candidates) per round.
+        """
+        if self.mode == "grid":
+            candidates = list(ParameterGrid(self.param_grid))
+            return candidates, [(None, len(candidates))]
+
+        param_grid = dict(self.param_grid)
+        if self.resource == "n_estimators":
+            max_resource = max(param_grid.pop("n_estimators", [self.estimator.get_params()["n_estimators"]]))
+        else:
+            max_resource = max(len(order) for order in data.sample_orders)
+        min_resource = min(self.min_resource or DEFAULT_MIN_RESOURCE[self.resource], max_resource)
+        candidates = list(ParameterGrid(param_grid))
+
+        # As many rounds as needed to get down to one candidate, limited by the resource range
+        n_required = 1 + int(math.floor(math.log(len(candidates), self.factor) + 1e-9))
+        n_possible = 1 + int(math.floor(math.log(max_resource / min_resource, self.factor) + 1e-9))
+        n_rungs = max(1, min(n_required, n_possible))
+        rungs = [
+            (max(min_resource, int(max_resource / self.factor ** (n_rungs - 1 - i))),
+             int(math.ceil(len(candidates) / self.factor ** i)))
+            for i in range(n_rungs)
+        ]
+        return candidates, rungs
+
+    def total_fits(self, data):
+        """Return the number of fits the search needs without budget limits or cached evaluations."""
+        _, rungs = self.plan(data)
+        return sum(n_candidates for _, n_candidates in rungs) * len(data.splits)
+
+    def evaluation_key(self, params, resource):
+        """Return the report key identifying one candidate evaluated at one resource."""
+        params_key = json.dumps(params, sort_keys=True, default=str)
+        return f"{self.name}|{self.estimator!r}|{params_key}|{self.scoring}|{self.resource}={resource}"
+
+    def evaluate(self, data, candidates, alive, resource, warm_models, keep_models, budget, executor, progress, report):
+        """
+        Evaluate the alive candidates on every fold at one resource.
+        Returns a dictionary of candidate index -> fold scores, for candidates whose folds all completed.
+        """
+        n_folds = len(data.splits)
+        fold_scores = {}
+        tasks = []
+        for candidate in alive:
+            key = self.evaluation_key(candidates[candidate], resource)
+            cached = report.lookup(data.data_hash, key) if report else None
+            if cached is not None and len(cached) == n_folds:
+                fold_scores[candidate] = cached
+                if progress:
+                    progress(n_folds)
+            else:
+                tasks.extend((candidate, fold) for fold in range(n_folds))
+
+        # Only start as many whole candidates as the fit budget allows
+        if budget is not None:
+            allowed = budget.remaining_fits()
+            if allowed < len(tasks):
+                tasks = tasks[:int(allowed // n_folds) * n_folds]
+
+        def task_args(candidate, fold):
+            train, test = data.splits[fold]
+            if self.resource == "n_samples":
+                train = data.sample_orders[fold]
+            previous = warm_models.pop((candidate, fold), None)
+            return (self.estimator, candidates[candidate], self.resource, resource,
+                    data.X, data.y, train, test, self.scoring, previous, keep_models)
+
+        scores = {}
+
+        def record(candidate, fold, score, model):
+            scores[(candidate, fold)] = score
+            if model is not None:
+                warm_models[(candidate, fold)] = model
+            if budget is not None:
+                budget.charge()
+            if progress:
+                progress(1)
+
+        if executor is None:
+            for candidate, fold in tasks:
+                if budget is not None and budget.exhausted():
+                    break
+                record(candidate, fold, *fit_and_score(*task_args(candidate, fold)))
+        else:
+            futures = {executor.submit(fit_and_score, *task_args(*task)): task for task in tasks}
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue  # Cancelled once the budget ran out; the fits already running are still recorded
+                record(*futures[future], *future.result())
+                if budget is not None and budget.exhausted():
+                    # Stop the fits that have not started yet
+                    for pending in futures:
+                        pending.cancel()
+
+        for candidate in {candidate for candidate, _ in tasks}:
+            if all((candidate, fold) in scores for fold in range(n_folds)):
+                fold_scores[candidate] = [scores[(candidate, fold)] for fold in range(n_folds)]
+                if report:
+                    report.record(data.data_hash, self.evaluation_key(candidates[candidate], resource),
+                                  fold_scores[candidate])
+        return fold_scores
+
+    @staticmethod
+    def mean_score(scores):
+        """Mean fold score, with failed (NaN) candidates ranked last."""
+        mean = float(np.mean(scores))
+        return -math.inf if np.isnan(mean) else mean
+
+    def run(self, data, budget=None, executor=None, progress=None, report=None):
+        """
+        Run the search on data. executor (a concurrent.futures executor) parallelises the fits,
+        progress is called with the number of fits completed, and report caches evaluations.
+        Returns a summary dictionary; with refit, "best_estimator" holds the best candidate fitted on all of data.
+        If the budget runs out before any candidate is evaluated, "best_params" is None and nothing is refitted.
+        """
+        started = time.monotonic()
+        if budget is not None:
+            budget.start()
+        candidates, rungs = self.plan(data)
+
+        alive = list(range(len(candidates)))
+        latest = {}  # candidate -> (resource, fold scores) at the last round it was evaluated in
+        warm_models = {}  # (candidate, fold) -> model fitted at the previous resource, grown with warm_start
+        history = []
+        budget_exhausted = False
+        for index, (resource, n_candidates) in enumerate(rungs):
+            if index > 0:
+                # Promote the best candidates of the previous round
+                alive = sorted(alive, key=lambda candidate: -self.mean_score(latest[candidate][1]))[:n_candidates]
+            keep_models = self.resource == "n_estimators" and index < len(rungs) - 1
+            fold_scores = self.evaluate(data, candidates, alive, resource, warm_models, keep_models,
+                                        budget, executor, progress, report)
+            if not fold_scores:
+                budget_exhausted = True
+                break
+            for candidate, scores in fold_scores.items():
+                latest[candidate] = (resource, scores)
+            history.append({"resource": resource, "n_candidates": len(alive), "n_evaluated": len(fold_scores)})
+            complete = len(fold_scores) == len(alive)
+            alive = [candidate for candidate in alive if candidate in fold_scores]
+            # Out of budget with rounds left, or before every candidate of this round was evaluated
+            if budget is not None and budget.exhausted() and (index < len(rungs) - 1 or not complete):
+                budget_exhausted = True
+                break
+
+        if not latest:
+            # The budget ran out before this family got a single complete candidate
+            return {
+                "mode": self.mode,
+                "resource": self.resource,
+                "best_params": None,
+                "cv_scores": [],
+                "mean_cv_score": None,
+                "cv_results": {"params": [], "resource": [], "mean_test_score": []},
+                "rungs": history,
+                "budget_exhausted": True,
+                "elapsed_seconds": time.monotonic() - started,
+            }
+
+        # The best candidate is chosen among those evaluated at the largest resource reached
+        final_resource = history[-1]["resource"]
+        finalists = [candidate for candidate in sorted(latest) if latest[candidate][0] == final_resource]
+        best = max(finalists, key=lambda candidate: self.mean_score(latest[candidate][1]))
+        best_params = dict(candidates[best])
+        if self.resource == "n_estimators":
+            best_params["n_estimators"] = int(final_resource)
+
+        summary = {
+            "mode": self.mode,
+            "resource": self.resource,
+            "best_params": best_params,
+            "cv_scores": latest[best][1],
+            "mean_cv_score": float(np.mean(latest[best][1])),
+            "cv_results": {
+                "params": [candidates[candidate] for candidate in sorted(latest)],
+                "resource": [latest[candidate][0] for candidate in sorted(latest)],
+                # Failed candidates are reported as None, since NaN is not valid JSON
+                "mean_test_score": [
+                    None if np.isnan(np.mean(latest[candidate][1])) else float(np.mean(latest[candidate][1]))
+                    for candidate in sorted(latest)
+                ],
+            },
+            "rungs": history,
+            "budget_exhausted": budget_exhausted,
+            "elapsed_seconds": time.monotonic() - started,
+        }
+        if report:
+            report.record_search(data.data_hash, self.name, summary)
+
+        if self.refit:
+            # Refit the best candidate on all the training data, with the full resource
+            best_estimator = clone(self.estimator).set_params(**best_params)
+            best_estimator.fit(data.X, data.y)
+            summary = {**summary, "best_estimator": best_estimator}
+        return summary
@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Stage-level latency instrumentation for the backend.
+# Each request runs inside a Trace; span("stage", model) times one stage of it (scaling, inference,
+# explanation, chart rendering, serialization...) and feeds the duration into a Prometheus histogram
+# labelled by endpoint, stage and model. The spans of the current request are also kept on its Trace,
+# so a client can ask for them in a "timings" block of the response.
+# Metrics live in their own registry and are exposed in the Prometheus text format by metrics_response.
+# Under a multi-process server (gunicorn.conf.py sets PROMETHEUS_MULTIPROC_DIR), the counters and histograms
+# of all workers are aggregated from prometheus_client's shared files; cache statistics are per worker.
+
+METRICS_REGISTRY = CollectorRegistry()
+
+# Buckets from half a millisecond (a compiled tree prediction) to ten seconds (a large LIME batch)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_SECONDS = Histogram(
+    "diabetes_sense_stage_duration_seconds", "Time spent in one stage of a request",
+    ["endpoint", "stage", "model"], buckets=LATENCY_BUCKETS, registry=METRICS_REGISTRY,
+)
+REQUEST_SECONDS = Histogram(
+    "diabetes_sense_request_duration_seconds", "Time spent handling a request",
+    ["endpoint", "method"], buckets=LATENCY_BUCKETS, registry=METRICS_REGISTRY,
+)
+REQUESTS = Counter(
+    "diabetes_sense_requests", "Requests handled, by response status",
+    ["endpoint", "method", "status"], registry=METRICS_REGISTRY,
+)
+
+# Micro-batching of concurrent single-row predictions (see micro_batcher.py)
+MICRO_BATCH_ROWS = Histogram(
+    "diabetes_sense_micro_batch_rows", "Rows scored together by one batched inference",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256), registry=METRICS_REGISTRY,
+)
+MICRO_BATCH_QUEUE_SECONDS = Histogram(
+    "diabetes_sense_micro_batch_queue_seconds", "Time a row waited in the queue before its batch was scored",
+    buckets=LATENCY_BUCKETS, registry=METRICS_REGISTRY,
+)
+MICRO_BATCH_QUEUE_DEPTH = Gauge(
+    "diabetes_sense_micro_batch_queue_depth", "Rows waiting to be scored",
+    registry=METRICS_REGISTRY, multiprocess_mode="livesum",
+)
+MICRO_BATCH_REJECTED = Counter(
+    "diabetes_sense_micro_batch_rejected", "Rows rejected because the queue was full",
+    registry=METRICS_REGISTRY,
+)
+
+# Cascade serving (see cascade.py)
+CASCADE_DECISIONS = Counter(
+    "diabetes_sense_cascade_decisions", "Cascade predictions by the model of the stage that decided them",
+    ["model"], registry=METRICS_REGISTRY,
+)
+
+# The trace of the request being handled in the current thread (or context), if any
+current_trace = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """
+    The spans recorded while handling one request.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.began = time.perf_counter()
+        self.spans = []  # (stage, model, seconds) in the order the stages finished
+        self.lock = threading.Lock()
+
+    def add(self, stage, model, seconds):
+        """Record a finished span."""
+        with self.lock:
+            self.spans.append((stage, model, seconds))
+
+    def timings(self):
+        """Return the spans recorded so far and the time since the request started, in milliseconds."""
+        with self.lock:
+            spans = list(self.spans)
+        return {
+            "total_ms": round((time.perf_counter() - self.began) * 1000, 3),
+            "spans": [
+                {"stage": stage, "model": model, "ms": round(seconds * 1000, 3)} if model else
+                {"stage": stage, "ms": round(seconds * 1000, 3)}
+                for stage, model, seconds in spans
+            ],
+        }
+
+
+def start_trace(endpoint):
+    """Start the trace of a new request in the current context and return it."""
+    trace = Trace(endpoint)
+    current_trace.set(trace)
+    return trace
+
+
+def resume_trace(trace):
+    """
+    Record the spans of the current context on an existing trace, e.g. in the generator of a streamed
+    response, which runs after the request's teardown has ended its trace.
+    """
+    current_trace.set(trace)
+
+
+def end_trace():
+    """Stop recording spans for the current context."""
+    current_trace.set(None)
+
+
+@contextmanager
+def span(stage, model=None):
+    """
+    Time the enclosed block as one stage of the current request, optionally for one model.
+    Outside of a request the duration is recorded under the "none" endpoint.
+    """
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - began
+        trace = current_trace.get()
+        endpoint = trace.endpoint if trace is not None else "none"
+        STAGE_SECONDS.labels(endpoint=endpoint, stage=stage, model=model or "").observe(seconds)
+        if trace is not None:
+            trace.add(stage, model, seconds)
+
+
+def observe_request(endpoint, method, status, seconds):
+    """Count a handled request and record its total duration."""
+    REQUESTS.labels(endpoint=endpoint, method=method, status=str(status)).inc()
+    REQUEST_SECONDS.labels(endpoint=endpoint, method=method).observe(seconds)
+
+
+class CacheCollector:
+    """
+    Expose the counters of caches with a stats() method (such as PredictionCache) as Prometheus metrics,
+    read from the caches themselves on every scrape. Each cache belongs to one worker process, so the
+    metrics are labelled with the process id.
+    """
+
+    def __init__(self):
+        self.caches = {}
+
+    def add(self, name, cache):
+        self.caches[name] = cache
+
+    def collect(self):
+        hits = CounterMetricFamily("diabetes_sense_cache_hits", "Cache lookups that found an entry", labels=["cache", "pid"])
+        misses = CounterMetricFamily("diabetes_sense_cache_misses", "Cache lookups that found no entry", labels=["cache", "pid"])
+        hit_ratio = GaugeMetricFamily("diabetes_sense_cache_hit_ratio", "Share of cache lookups that were hits", labels=["cache", "pid"])
+        entries = GaugeMetricFamily("diabetes_sense_cache_entries", "Entries currently held in the cache", labels=["cache", "pid"])
+        pid = str(os.getpid())
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            hits.add_metric([name, pid], stats["hits"])
+            misses.add_metric([name, pid], stats["misses"])
+            hit_ratio.add_metric([name, pid], stats["hit_rate"])
+            entries.add_metric([name, pid], stats["size"])
+        return [hits, misses, hit_ratio, entries]
+
+
+cache_collector = CacheCollector()
+METRICS_REGISTRY.register(cache_collector)
+
+
+def register_cache(name, cache):
+    """Report the hit and miss counters of a cache under the given name."""
+    cache_collector.add(name, cache)
+
+
+def metrics_response():
+    """Return the body and content type of a /metrics response in the Prometheus text format."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        # Aggregate the metrics every worker wrote to the shared folder, plus this worker's caches
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(cache_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(METRICS_REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Remove the metrics files of an exited worker process from a multi-process metrics folder."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend modules are imported by name, as the scripts in the parent folder import each other
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from sklearn.datasets import make_classification
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier, VotingClassifier
+from sklearn.linear_model import LogisticRegression
+
+from compiled_trees import MAX_COMPILED_ROWS, CompiledBoosting, CompiledForest, CompiledVoting, compile_model
+
+TOLERANCE = 1e-9
+
+
+@pytest.fixture(scope="module")
+def data():
+    X, y = make_classification(n_samples=300, n_features=8, n_informative=5, random_state=0)
+    X_new, _ = make_classification(n_samples=200, n_features=8, n_informative=5, random_state=1)
+    return X, y, X_new
+
+
+def fitted_models(X, y):
+    forest = RandomForestClassifier(n_estimators=25, max_depth=6, random_state=0).fit(X, y)
+    boosting = GradientBoostingClassifier(n_estimators=30, max_depth=3, random_state=0).fit(X, y)
+    boosting_zero = GradientBoostingClassifier(n_estimators=30, init="zero", random_state=0).fit(X, y)
+    voting = VotingClassifier(
+        estimators=[("lr", LogisticRegression()), ("rf", RandomForestClassifier(n_estimators=10, random_state=0)),
+                    ("gb", GradientBoostingClassifier(n_estimators=20, random_state=0))],
+        voting="soft", weights=[1, 2, 1],
+    ).fit(X, y)
+    return {"forest": forest, "boosting": boosting, "boosting_zero": boosting_zero, "voting": voting}
+
+
+@pytest.fixture(scope="module")
+def models(data):
+    X, y, _ = data
+    return fitted_models(X, y)
+
+
+def test_compile_model_types(models):
+    assert isinstance(compile_model(models["forest"]), CompiledForest)
+    assert isinstance(compile_model(models["boosting"]), CompiledBoosting)
+    assert isinstance(compile_model(models["boosting_zero"]), CompiledBoosting)
+    assert isinstance(compile_model(models["voting"]), CompiledVoting)
+    assert compile_model(LogisticRegression().fit([[0.0], [1.0]], [0, 1])) is None
+
+
+@pytest.mark.parametrize("name", ["forest", "boosting", "boosting_zero", "voting"])
+def test_single_rows_match_sklearn(data, models, name):
+    _, _, X_new = data
+    compiled = compile_model(models[name])
+    for row in X_new[:50]:
+        np.testing.assert_allclose(compiled.predict_proba(row[None, :]), models[name].predict_proba(row[None, :]),
+                                   rtol=0, atol=TOLERANCE)
+
+
+@pytest.mark.parametrize("name", ["forest", "boosting", "boosting_zero", "voting"])
+@pytest.mark.parametrize("rows", [2, 10, MAX_COMPILED_ROWS, MAX_COMPILED_ROWS + 1, 200])
+def test_batches_match_sklearn(data, models, name, rows):
+    _, _, X_new = data
+    compiled = compile_model(models[name])
+    expected = models[name].predict_proba(X_new[:rows])
+    np.testing.assert_allclose(compiled.predict_proba(X_new[:rows]), expected, rtol=0, atol=TOLERANCE)
+    # Both paths, whichever one the batch size would pick
+    np.testing.assert_allclose(compiled.predict_proba_compiled(X_new[:rows]), expected, rtol=0, atol=TOLERANCE)
+    np.testing.assert_allclose(compiled.predict_proba_large(X_new[:rows]), expected, rtol=0, atol=TOLERANCE)
+
+
+def test_float32_thresholds_match_sklearn(models):
+    # Inputs lying exactly on a threshold are rounded to float32 as scikit-learn does
+    forest = models["forest"]
+    compiled = compile_model(forest)
+    tree = forest.estimators_[0].tree_
+    splits = tree.feature >= 0
+    X = np.zeros((int(splits.sum()), forest.n_features_in_))
+    X[np.arange(len(X)), tree.feature[splits]] = tree.threshold[splits]
+    np.testing.assert_allclose(compiled.predict_proba(X), forest.predict_proba(X), rtol=0, atol=TOLERANCE)
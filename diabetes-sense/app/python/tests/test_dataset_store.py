@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataset_store
+from schema import FEATURES, TARGET
+
+
+@pytest.fixture
+def data_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset_store, "DATA_FOLDER", str(tmp_path))
+    monkeypatch.setattr(dataset_store, "CACHE_FOLDER", str(tmp_path / "cache"))
+    return tmp_path
+
+
+def write_csv(folder, rows, seed=0):
+    rng = np.random.RandomState(seed)
+    data = pd.DataFrame(rng.randint(0, 200, size=(rows, len(FEATURES))), columns=FEATURES)
+    data[TARGET] = rng.randint(0, 2, size=rows)
+    data.to_csv(folder / dataset_store.DATASETS["balanced"], index=False)
+    return data
+
+
+def load_in_process(data_folder, barrier, results):
+    dataset_store.DATA_FOLDER = str(data_folder)
+    dataset_store.CACHE_FOLDER = str(data_folder / "cache")
+    barrier.wait()  # Every process finds the cache empty and builds it
+    try:
+        features, labels = dataset_store.load_dataset("balanced")
+        results.put((np.asarray(features, dtype=np.float64).sum(), int(np.asarray(labels).sum()), len(labels)))
+    except Exception as e:
+        results.put(repr(e))
+
+
+def test_loads_the_csv_rows(data_folder):
+    data = write_csv(data_folder, 50)
+    features, labels = dataset_store.load_dataset("balanced")
+    np.testing.assert_array_equal(features, data[FEATURES].to_numpy(dtype=np.float32))
+    np.testing.assert_array_equal(labels, data[TARGET].to_numpy(dtype=np.int8))
+    assert isinstance(features, np.memmap)
+
+
+def test_changed_csv_replaces_the_build(data_folder):
+    write_csv(data_folder, 50, seed=0)
+    first = dataset_store.dataset_hash("balanced")
+    data = write_csv(data_folder, 60, seed=1)
+    features, _ = dataset_store.load_dataset("balanced")
+    np.testing.assert_array_equal(features, data[FEATURES].to_numpy(dtype=np.float32))
+    assert dataset_store.dataset_hash("balanced") != first
+    # Only the files of the current build are left
+    current = [os.path.basename(path) for path in dataset_store.manifest_paths(dataset_store.read_manifest("balanced"))]
+    assert sorted(os.listdir(data_folder / "cache")) == sorted(current + ["balanced.manifest.json"])
+
+
+def test_concurrent_builds(data_folder):
+    data = write_csv(data_folder, 200_000)
+    expected = (data[FEATURES].to_numpy(dtype=np.float64).sum(), int(data[TARGET].sum()), len(data))
+    processes = 6
+    for _ in range(3):
+        barrier = multiprocessing.Barrier(processes)
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=load_in_process, args=(data_folder, barrier, results))
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        outcomes = [results.get(timeout=120) for _ in workers]
+        for worker in workers:
+            worker.join()
+        assert outcomes == [expected] * processes
+        # No temporary files are left behind, and the next trial builds from an empty cache again
+        assert len(os.listdir(data_folder / "cache")) == 3
+        for name in os.listdir(data_folder / "cache"):
+            os.remove(data_folder / "cache" / name)
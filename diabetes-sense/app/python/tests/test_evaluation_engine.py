@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from sklearn.metrics import accuracy_score, confusion_matrix, f1_score, precision_score, recall_score, roc_auc_score
+
+from evaluation_engine import bootstrap, compute_metrics, confidence_interval, roc_auc
+
+
+def labelled_scores(rows, seed, ties=False):
+    rng = np.random.RandomState(seed)
+    y = rng.randint(0, 2, rows).astype(np.int8)
+    scores = np.clip(0.3 * y + rng.uniform(0, 0.7, rows), 0, 1)
+    if ties:
+        scores = np.round(scores, 1)  # Few distinct scores, shared by both classes
+    return y, (scores >= 0.5).astype(int), scores
+
+
+def assert_matches_sklearn(y, predictions, scores):
+    metrics = compute_metrics(y, predictions, scores)
+    assert metrics["accuracy"] == pytest.approx(accuracy_score(y, predictions), abs=1e-15)
+    assert metrics["precision"] == pytest.approx(precision_score(y, predictions, zero_division=0), abs=1e-15)
+    assert metrics["recall"] == pytest.approx(recall_score(y, predictions, zero_division=0), abs=1e-15)
+    assert metrics["f1"] == pytest.approx(f1_score(y, predictions, zero_division=0), abs=1e-15)
+    tp, fp, fn, tn = metrics["counts"]
+    assert [[tn, fp], [fn, tp]] == confusion_matrix(y, predictions, labels=[0, 1]).tolist()
+    return metrics
+
+
+@pytest.mark.parametrize("ties", [False, True])
+def test_metrics_match_sklearn(ties):
+    y, predictions, scores = labelled_scores(500, seed=0, ties=ties)
+    metrics = assert_matches_sklearn(y, predictions, scores)
+    assert metrics["roc_auc"] == pytest.approx(roc_auc_score(y, scores), abs=1e-12)
+
+
+def test_single_class_metrics():
+    _, predictions, scores = labelled_scores(100, seed=1)
+    for label in (0, 1):
+        y = np.full(100, label, dtype=np.int8)
+        metrics = assert_matches_sklearn(y, predictions, scores)
+        assert np.isnan(metrics["roc_auc"])  # sklearn raises: the AUC is undefined with a single class
+
+
+def test_resample_rows_match_sklearn():
+    y, predictions, scores = labelled_scores(200, seed=2, ties=True)
+    indices = np.random.default_rng(0).integers(0, len(y), size=(20, len(y)))
+    aucs = roc_auc(y[indices], scores[indices])
+    metrics = compute_metrics(y[indices], predictions[indices], scores[indices])
+    for row, each in enumerate(indices):
+        assert aucs[row] == pytest.approx(roc_auc_score(y[each], scores[each]), abs=1e-12)
+        assert metrics["f1"][row] == pytest.approx(f1_score(y[each], predictions[each]), abs=1e-15)
+
+
+def test_bootstrap_does_not_depend_on_the_workers():
+    y, predictions, scores = labelled_scores(300, seed=3)
+    model_scores = {"first": (predictions, scores), "second": (1 - predictions, 1 - scores)}
+    resamples = 250  # Several chunks, so the pool runs
+    in_process = bootstrap(y, model_scores, resamples, seed=7, workers=0)
+    pooled = bootstrap(y, model_scores, resamples, seed=7, workers=2)
+    for model_name in model_scores:
+        for metric, values in in_process[model_name].items():
+            assert len(values) == resamples
+            np.testing.assert_array_equal(pooled[model_name][metric], values)
+            assert confidence_interval(pooled[model_name][metric], 0.95) == confidence_interval(values, 0.95)
+    assert not np.array_equal(bootstrap(y, model_scores, resamples, seed=8, workers=0)["first"]["accuracy"],
+                              in_process["first"]["accuracy"])
@@ -0,0 +1,105 @@
+import copy
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier, VotingClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+
+from explainer_stats import compute_training_stats
+from incremental_training import rescale_model, retraining_triggers, update_scaler
+from model_bundle import ModelBundle
+from schema import FEATURES
+
+
+def pima_like(rows, seed):
+    """Rows with the repeated integer and one-decimal values of the Pima data, so split thresholds sit between close values."""
+    rng = np.random.RandomState(seed)
+    X = np.column_stack([
+        rng.randint(0, 15, rows), rng.randint(60, 200, rows), rng.randint(40, 110, rows), rng.randint(10, 60, rows),
+        rng.randint(15, 400, rows), rng.normal(32, 6, rows).round(1), rng.uniform(0.08, 2.4, rows).round(3),
+        rng.randint(21, 80, rows),
+    ]).astype(float)
+    y = (X[:, 1] + 2 * X[:, 5] + rng.normal(0, 20, rows) > 190).astype(int)
+    return X, y
+
+
+MODELS = {
+    "logistic_regression": lambda: LogisticRegression(max_iter=1000),
+    "random_forest": lambda: RandomForestClassifier(n_estimators=20, random_state=0),
+    "gradient_boosting": lambda: GradientBoostingClassifier(n_estimators=20, random_state=0),
+    "voting_classifier": lambda: VotingClassifier([(name, make()) for name, make in list(MODELS.items())[:3]], voting="soft"),
+}
+
+
+@pytest.mark.parametrize("model_name", list(MODELS))
+def test_rescaled_models_predict_as_before(model_name):
+    X, y = pima_like(400, seed=0)
+    X_new, _ = pima_like(60, seed=1)
+    scaler = StandardScaler().fit(X)
+    model = MODELS[model_name]().fit(scaler.transform(X), y)
+
+    updated_scaler = copy.deepcopy(scaler)
+    rescaled = copy.deepcopy(model)
+    rows = np.vstack([X, X_new])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        update_scaler(updated_scaler, X_new)
+        rescale_model(rescaled, scaler, updated_scaler, rows)
+        before = model.predict_proba(scaler.transform(rows))
+        after = rescaled.predict_proba(updated_scaler.transform(rows))
+
+    np.testing.assert_allclose(after, before, rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(rescaled.predict(updated_scaler.transform(rows)), model.predict(scaler.transform(rows)))
+
+
+@pytest.mark.parametrize("feature_names", [False, True])
+def test_scaler_update_matches_a_fit_on_all_rows(feature_names):
+    X, _ = pima_like(400, seed=0)
+    X_new, _ = pima_like(60, seed=1)
+    scaler = StandardScaler().fit(pd.DataFrame(X, columns=FEATURES) if feature_names else X)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")  # Feature names given to a scaler fitted without them, or the reverse
+        update_scaler(scaler, X_new)
+    expected = StandardScaler().fit(np.vstack([X, X_new]))
+    np.testing.assert_allclose(scaler.mean_, expected.mean_)
+    np.testing.assert_allclose(scaler.scale_, expected.scale_)
+
+
+def make_bundle(X, y):
+    scaler = StandardScaler().fit(X)
+    model = LogisticRegression(max_iter=1000).fit(scaler.transform(X), y)
+    accuracy = float((model.predict(scaler.transform(X)) == y).mean())
+    return ModelBundle(
+        models={"logistic_regression": model}, accuracies={"logistic_regression": accuracy}, scaler=scaler,
+        input_spaces={"logistic_regression": "scaled"}, explainer_stats=compute_training_stats(X, FEATURES),
+        metrics={"logistic_regression": {"test_accuracy": accuracy}},
+    )
+
+
+def test_similar_cases_update_incrementally():
+    X, y = pima_like(400, seed=0)
+    bundle = make_bundle(X, y)
+    psi, drifted, drops = retraining_triggers(bundle, X[:100], y[:100])
+    assert set(psi) == set(FEATURES)
+    assert drifted == {} and drops == {}
+
+
+def test_drifted_feature_triggers_a_full_search():
+    X, y = pima_like(400, seed=0)
+    bundle = make_bundle(X, y)
+    X_new = X[:100].copy()
+    X_new[:, FEATURES.index("Glucose")] += 60
+    _, drifted, _ = retraining_triggers(bundle, X_new, y[:100])
+    assert list(drifted) == ["Glucose"]
+
+
+def test_accuracy_drop_triggers_a_full_search():
+    X, y = pima_like(400, seed=0)
+    bundle = make_bundle(X, y)
+    _, drifted, drops = retraining_triggers(bundle, X[:100], 1 - y[:100])  # Every label flipped
+    assert drifted == {}
+    assert list(drops) == ["logistic_regression"]
+    assert drops["logistic_regression"] > 0.5
@@ -0,0 +1,46 @@
+import numpy as np
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import StandardScaler
+
+from model_bundle import ModelBundle, load_bundle, save_bundle
+from schema import FEATURES
+
+
+def make_bundle(seed=0, created_at=None):
+    X, y = make_classification(n_samples=200, n_features=len(FEATURES), random_state=0)
+    scaler = StandardScaler().fit(X)
+    forest = RandomForestClassifier(n_estimators=10, random_state=seed).fit(scaler.transform(X), y)
+    return ModelBundle(
+        models={"random_forest": forest}, accuracies={"random_forest": 0.9}, scaler=scaler,
+        input_spaces={"random_forest": "scaled"}, created_at=created_at,
+    )
+
+
+def test_identical_retrains_get_the_same_version(tmp_path):
+    (tmp_path / "first").mkdir()
+    (tmp_path / "second").mkdir()
+    # Two separate fits, whose tree node arrays have different (uninitialized) padding bytes
+    first = save_bundle(tmp_path / "first", make_bundle(created_at=1.0))
+    second = save_bundle(tmp_path / "second", make_bundle(created_at=2.0))
+    assert first == second
+    assert load_bundle(tmp_path / "first").content_hash == first
+
+
+def test_changed_models_get_a_new_version(tmp_path):
+    (tmp_path / "first").mkdir()
+    (tmp_path / "second").mkdir()
+    first = save_bundle(tmp_path / "first", make_bundle(seed=0))
+    second = save_bundle(tmp_path / "second", make_bundle(seed=1))
+    assert first != second
+
+
+def test_loaded_bundle_predicts_like_the_saved_one(tmp_path):
+    bundle = make_bundle()
+    save_bundle(tmp_path, bundle)
+    loaded = load_bundle(tmp_path)
+    X = np.random.RandomState(0).normal(size=(20, len(FEATURES)))
+    np.testing.assert_array_equal(
+        loaded.models["random_forest"].predict_proba(loaded.model_input("random_forest", X)),
+        bundle.models["random_forest"].predict_proba(bundle.model_input("random_forest", X)),
+    )
@@ -0,0 +1,98 @@
+import os
+
+import joblib
+import numpy as np
+from sklearn.datasets import make_classification
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+
+from model_bundle import LEGACY_INPUT_SPACES, ModelBundle, load_bundle, save_bundle
+from prediction_store import PredictionStore, model_version
+from schema import FEATURES
+
+X, y = make_classification(n_samples=200, n_features=len(FEATURES), random_state=0)
+
+
+def saved_bundle(folder, seed=0):
+    folder.mkdir()
+    scaler = StandardScaler().fit(X)
+    model = LogisticRegression(C=1.0 + seed).fit(scaler.transform(X), y)
+    save_bundle(folder, ModelBundle(
+        models={"logistic_regression": model}, accuracies={"logistic_regression": 0.9}, scaler=scaler,
+        input_spaces={"logistic_regression": "scaled"},
+    ))
+    return load_bundle(folder)
+
+
+def test_stored_probabilities_are_read_back(tmp_path):
+    bundle = saved_bundle(tmp_path / "models")
+    store = PredictionStore(folder=tmp_path / "store")
+    first = store.predict_proba(bundle, "logistic_regression", X, "dataset-sha")
+    second = store.predict_proba(bundle, "logistic_regression", X, "dataset-sha")
+    assert isinstance(second, np.memmap)
+    np.testing.assert_array_equal(second, first)
+    assert (store.stats()["hits"], store.stats()["misses"]) == (1, 1)
+
+
+def test_new_model_or_dataset_gets_a_new_entry(tmp_path):
+    bundle = saved_bundle(tmp_path / "models")
+    retrained = saved_bundle(tmp_path / "retrained", seed=1)
+    store = PredictionStore(folder=tmp_path / "store")
+    store.predict_proba(bundle, "logistic_regression", X, "dataset-sha")
+
+    # A retrained model is not served the first model's probabilities
+    probabilities = store.predict_proba(retrained, "logistic_regression", X, "dataset-sha")
+    np.testing.assert_array_equal(
+        probabilities, retrained.models["logistic_regression"].predict_proba(retrained.scale(X))
+    )
+    # Nor is a changed dataset, even with the same number of rows
+    X_changed = X + 1
+    probabilities = store.predict_proba(bundle, "logistic_regression", X_changed, "changed-sha")
+    np.testing.assert_array_equal(
+        probabilities, bundle.models["logistic_regression"].predict_proba(bundle.scale(X_changed))
+    )
+    assert (store.stats()["hits"], store.stats()["misses"]) == (0, 3)
+    assert len(os.listdir(tmp_path / "store")) == 3
+
+
+def test_entry_with_another_row_count_is_a_miss(tmp_path):
+    store = PredictionStore(folder=tmp_path / "store")
+    name = "0" * 32 + ".npy"
+    store.put(name, np.zeros((10, 2)))
+    assert store.get(name, 11) is None
+    assert store.get(name, 10).shape == (10, 2)
+    assert (store.stats()["hits"], store.stats()["misses"]) == (1, 1)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    entry = np.zeros((1000, 2))  # About 16 kB each
+    store = PredictionStore(folder=tmp_path / "store", max_bytes=3.5 * entry.nbytes)
+    names = [f"{index:032x}.npy" for index in range(4)]
+    for index, name in enumerate(names[:3]):
+        store.put(name, entry)
+        os.utime(store.path(name), (index, index))  # Written in order, one second apart
+    store.get(names[0], len(entry))  # The oldest is used again
+    store.put(names[3], entry)
+
+    assert sorted(os.listdir(tmp_path / "store")) == sorted([names[0], names[2], names[3]])
+    assert store.stats()["evictions"] == 1
+
+
+def test_legacy_models_are_versioned_with_the_scaler(tmp_path):
+    scaler = StandardScaler().fit(X)
+    models = {
+        "logistic_regression": LogisticRegression().fit(scaler.transform(X), y),
+        "random_forest": RandomForestClassifier(n_estimators=5, random_state=0).fit(X, y),
+        "gradient_boosting": GradientBoostingClassifier(n_estimators=5, random_state=0).fit(scaler.transform(X), y),
+    }
+    for model_name, model in models.items():
+        joblib.dump((model, 0.9), tmp_path / f"{model_name}.pkl")
+    joblib.dump(scaler, tmp_path / "scaler.pkl")
+    before = {model_name: model_version(load_bundle(tmp_path), model_name) for model_name in models}
+
+    joblib.dump(StandardScaler().fit(X[:100]), tmp_path / "scaler.pkl")  # Refitted, the models unchanged
+    after = {model_name: model_version(load_bundle(tmp_path), model_name) for model_name in models}
+    for model_name in models:
+        changed = LEGACY_INPUT_SPACES[model_name] == "scaled"
+        assert (after[model_name] != before[model_name]) == changed
@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from preprocessing_pipeline import PreprocessingPipeline, read_columnar
+from schema import FEATURES, TARGET
+
+
+def test_kept_frame_has_the_source_index_and_types(tmp_path):
+    rng = np.random.RandomState(0)
+    data = pd.DataFrame(rng.randint(0, 120, size=(300, len(FEATURES))), columns=FEATURES)
+    data["BMI"] = rng.uniform(20, 40, size=300).round(1)
+    data[TARGET] = rng.randint(0, 2, size=300)
+    data.to_csv(tmp_path / "raw.csv", index=False)
+
+    pipeline = PreprocessingPipeline(tmp_path / "raw.csv", chunksize=64).fit()
+    pipeline.transform(tmp_path / "clean.npy", keep_frame=True)
+    frame = pipeline.frame
+
+    # Rows are dropped, never renumbered, and the integer columns stay integers
+    assert len(frame) < len(data)
+    assert frame.index.isin(data.index).all()
+    assert frame.dtypes.to_dict() == data.dtypes.to_dict()
+    matrix, columns = read_columnar(tmp_path / "clean.npy")
+    np.testing.assert_array_equal(np.asarray(matrix), frame[columns].to_numpy(dtype=float))
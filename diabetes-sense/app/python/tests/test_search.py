@@ -0,0 +1,85 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+from sklearn.datasets import make_classification
+from sklearn.linear_model import LogisticRegression
+
+from search import SearchBudget, SearchData, SuccessiveHalvingSearch
+
+PARAM_GRID = {"C": [0.01, 0.1, 1, 10, 100], "class_weight": ["balanced", None]}
+
+
+@pytest.fixture(scope="module")
+def data():
+    X, y = make_classification(n_samples=200, n_features=8, random_state=0)
+    return SearchData(X, y, n_splits=5, shuffle=True, random_state=42)
+
+
+@pytest.fixture(scope="module")
+def executor():
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        yield pool
+
+
+def test_search_on_executor_finds_the_best_candidate(data, executor):
+    search = SuccessiveHalvingSearch("logistic_regression", LogisticRegression(max_iter=500), PARAM_GRID)
+    serial = search.run(data)
+    parallel = search.run(data, executor=executor)
+    assert parallel["best_params"] == serial["best_params"]
+    assert parallel["cv_scores"] == serial["cv_scores"]
+    assert not parallel["budget_exhausted"]
+
+
+def test_time_budget_on_executor_stops_without_failing(data, executor):
+    # The budget runs out with the first completed fit, so the fits still queued are cancelled
+    search = SuccessiveHalvingSearch("logistic_regression", LogisticRegression(max_iter=500), PARAM_GRID)
+    result = search.run(data, budget=SearchBudget(max_seconds=0), executor=executor)
+    assert result["budget_exhausted"]
+    evaluated = len(result["cv_results"]["params"])
+    assert evaluated < len(PARAM_GRID["C"]) * len(PARAM_GRID["class_weight"])
+    if result["best_params"] is not None:
+        assert np.isfinite(result["mean_cv_score"])
+        assert result["best_estimator"] is not None
+
+
+def test_fit_budget_on_executor_evaluates_whole_candidates(data, executor):
+    search = SuccessiveHalvingSearch("logistic_regression", LogisticRegression(max_iter=500), PARAM_GRID)
+    budget = SearchBudget(max_fits=10)
+    result = search.run(data, budget=budget, executor=executor)
+    assert len(result["cv_results"]["params"]) == 2  # Two candidates of five folds each
+    assert budget.fits == 10
+
+
+def test_budgeted_tuning_job_completes():
+    import time
+    from sklearn.ensemble import RandomForestClassifier
+    from tuning import TuningJobs
+
+    X, y = make_classification(n_samples=200, n_features=8, random_state=0)
+    jobs = TuningJobs(max_workers=1)
+    job_id = jobs.submit({"random_forest": RandomForestClassifier()}, X, y, max_seconds=0.3)
+    deadline = time.monotonic() + 120
+    while jobs.jobs[job_id]["status"] in ("queued", "running") and time.monotonic() < deadline:
+        time.sleep(0.1)
+    jobs.executor.shutdown(cancel_futures=True)
+    assert jobs.jobs[job_id]["status"] == "completed", jobs.jobs[job_id]["error"]
+    assert jobs.jobs[job_id]["results"]["random_forest"]["budget_exhausted"]
+
+
+def test_finished_tuning_jobs_are_forgotten():
+    import time
+    from tuning import TuningJobs
+
+    jobs = TuningJobs(max_workers=1, max_finished_jobs=3, finished_ttl=3600)
+    now = time.time()
+    for index in range(5):
+        jobs.jobs[f"finished-{index}"] = {"status": "completed", "finished_at": now - 10 + index, "progress": {}}
+    jobs.jobs["expired"] = {"status": "failed", "finished_at": now - 7200, "progress": {}}
+    jobs.jobs["running"] = {"status": "running", "finished_at": None, "progress": {}}
+
+    # The expired job and the oldest finished jobs beyond three are forgotten, the running one is kept
+    assert jobs.status("expired") is None
+    assert jobs.status("finished-0") is None
+    assert sorted(jobs.jobs) == ["finished-2", "finished-3", "finished-4", "running"]
+    assert jobs.status("finished-4")["status"] == "completed"
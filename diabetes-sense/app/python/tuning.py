@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from search import SEARCH_MODES, SearchBudget, SearchData, SuccessiveHalvingSearch
+
+# Background hyperparameter tuning for the /tune endpoint.
+# A tuning request returns a job id straight away; the search itself (shared with ml_model.py, see
+# search.py) runs in a coordinator thread that hands every candidate/fold fit to a bounded process pool,
+# so it uses all cores. The fold scores of every candidate are kept, like GridSearchCV.cv_results_, so the
+# best candidate's scores are reported directly instead of being recomputed with cross_val_score.
+
+# Hyperparameter grids for each model
+PARAM_GRIDS = {
+    "logistic_regression": {
+        "C": [0.1, 1, 10],
+        "solver": ["liblinear", "lbfgs"]
+    },
+    "random_forest": {
+        "n_estimators": [50, 100, 200],
+        "max_depth": [None, 10, 20]
+    },
+    "gradient_boosting": {
+        "learning_rate": [0.01, 0.1, 0.2],
+        "n_estimators": [50, 100, 200]
+    }
+}
+
+
+class TuningJobs:
+    """
+    Runs tuning jobs in the background on a shared, bounded process pool and keeps their status.
+    At most max_active_jobs jobs may be queued or running at the same time.
+    Finished jobs are forgotten finished_ttl seconds after they finish (None keeps them), and beyond the
+    max_finished_jobs most recent ones, oldest first.
+    Evaluations are cached in the given SearchReport, so repeated jobs on the same data skip them.
+    """
+
+    def __init__(self, max_workers=None, max_active_jobs=2, cv=5, report=None, max_finished_jobs=100,
+                 finished_ttl=24 * 3600):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_active_jobs = max_active_jobs
+        self.max_finished_jobs = max_finished_jobs
+        self.finished_ttl = finished_ttl
+        self.cv = cv
+        self.report = report
+        self.executor = None  # Created on first use, so importing the app does not start worker processes
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        """Return the process pool, creating it on first use."""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def submit(self, models, X, y, param_grids=PARAM_GRIDS, mode="grid", max_seconds=None, max_fits=None):
+        """
+        Start tuning the given models (a dictionary of name -> estimator) in the background.
+        mode is "grid" or "halving"; max_seconds / max_fits optionally bound the whole job.
+        Returns the job id. Raises ValueError for invalid options and RuntimeError when too many jobs are active.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+
+        # The folds are computed once and shared by the searches of every model family
+        data = SearchData(X, y, n_splits=self.cv)
+        searches = [
+            SuccessiveHalvingSearch(model_name, models[model_name], param_grids[model_name], mode=mode, refit=False)
+            for model_name in models if model_name in param_grids
+        ]
+        budget = SearchBudget(max_seconds=max_seconds, max_fits=max_fits)
+
+        with self.lock:
+            self.evict_finished()
+            active = [job for job in self.jobs.values() if job["status"] in ("queued", "running")]
+            if len(active) >= self.max_active_jobs:
+                raise RuntimeError(f"Too many tuning jobs running (limit {self.max_active_jobs})")
+
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "mode": mode,
+                "progress": {"done": 0, "total": sum(search.total_fits(data) for search in searches)},
+                "submitted_at": time.time(),
+                "finished_at": None,
+                "results": None,
+                "error": None,
+            }
+
+        # Run the searches in a coordinator thread so the request can return immediately
+        threading.Thread(target=self.run, args=(job_id, data, searches, budget), daemon=True).start()
+        return job_id
+
+    def run(self, job_id, data, searches, budget):
+        """Run the searches of a job on the process pool, updating its progress, and store the results."""
+        job = self.jobs[job_id]
+        with self.lock:
+            job["status"] = "running"
+
+        def progress(fits):
+            with self.lock:
+                job["progress"]["done"] += fits
+
+        try:
+            executor = self.get_executor()
+            results = {
+                search.name: search.run(data, budget=budget, executor=executor, progress=progress, report=self.report)
+                for search in searches
+            }
+            if self.report:
+                self.report.save()
+
+            with self.lock:
+                job["results"] = results
+                job["status"] = "completed"
+                job["finished_at"] = time.time()
+                self.evict_finished()
+        except Exception as e:
+            with self.lock:
+                job["error"] = str(e)
+                job["status"] = "failed"
+                job["finished_at"] = time.time()
+                self.evict_finished()
+
+    def evict_finished(self):
+        """Forget the finished jobs past finished_ttl or beyond max_finished_jobs. Called with the lock held."""
+        finished = sorted(
+            (job["finished_at"], job_id) for job_id, job in self.jobs.items() if job["finished_at"] is not None
+        )
+        expired = 0
+        if self.finished_ttl is not None:
+            deadline = time.time() - self.finished_ttl
+            expired = sum(1 for finished_at, _ in finished if finished_at < deadline)
+        excess = len(finished) - self.max_finished_jobs
+        for _, job_id in finished[:max(expired, excess)]:
+            del self.jobs[job_id]
+
+    def status(self, job_id):
+        """Return a copy of the job's status, or None for an unknown or forgotten job id."""
+        with self.lock:
+            self.evict_finished()
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            return {**job, "progress": dict(job["progress"])}